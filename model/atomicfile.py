@@ -0,0 +1,24 @@
+"""Saving files so a crash (or another thread saving the same file) never leaves a half written one behind."""
+
+import os
+import tempfile
+
+
+def atomic_save(path, save):
+    """
+    Calls save(temp path) to write a new temp file next to path, then replaces path with it. The temp file
+    keeps the extension of path, for writers that pick the format by it (or append it, like numpy.save).
+    """
+
+    directory, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory or ".", prefix=name + ".", suffix=".tmp" + os.path.splitext(name)[1])
+    os.close(fd)
+    try:
+        save(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
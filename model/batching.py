@@ -0,0 +1,63 @@
+"""Dynamic micro-batching of concurrent single-window predictions."""
+
+import asyncio
+import numpy
+
+
+class MicroBatcher:
+    """
+    Collects the windows passed to predict for up to max_delay seconds or max_size windows, whatever
+    happens first, and runs them together as a single batch through run_batch (on executor). run_batch
+    receives a (count, timesteps, features) array and returns count predictions. So, a request waits at
+    most max_delay plus the time of one batched run.
+    """
+
+    def __init__(self, run_batch, executor, max_delay=0.002, max_size=256):
+        self.run_batch = run_batch
+        self.executor = executor
+        self.max_delay = max_delay
+        self.max_size = max_size
+        self.pending = []  # (window, future)
+        self.flush_handle = None
+
+    @property
+    def queue_depth(self):
+        return len(self.pending)
+
+    async def predict(self, window):
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self.pending.append((window, future))
+        if len(self.pending) >= self.max_size:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.max_delay, self.flush)
+        return await future
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.pending = self.pending, []
+
+        # windows of different shapes (ie another timesteps) can't be stacked together
+        by_shape = {}
+        for window, future in batch:
+            by_shape.setdefault(window.shape, []).append((window, future))
+        for entries in by_shape.values():
+            asyncio.ensure_future(self.run(entries))
+
+    async def run(self, entries):
+        loop = asyncio.get_event_loop()
+        try:
+            array = numpy.stack([window for window, _ in entries])
+            predictions = await loop.run_in_executor(self.executor, self.run_batch, array)
+        except Exception as e:
+            for _, future in entries:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), prediction in zip(entries, predictions):
+            if not future.done():
+                future.set_result(prediction)
@@ -0,0 +1,282 @@
+"""
+Reproducible benchmarks of the prediction server and the training pipeline, on a synthetic dataset and model.
+Measures csv loading and windowing, train_init memory, epoch and freeze time, single-window latency and batch
+throughput, both in-process (each engine) and over a local websocket (and a shared memory channel). Prints the
+results as json, so runs can be compared.
+
+python benchmark.py [--rows N] [--timesteps N] [--features N] [--out results.json] ...
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+from timeit import default_timer as timer
+import numpy
+
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def synthetic_csv(path, rows, features, seed=0):
+    """Writes a training csv like the exported ones: price, features..., output (0 or 1)."""
+
+    random = numpy.random.RandomState(seed)
+    price = 100 + numpy.cumsum(random.randn(rows))
+    x = random.rand(rows, features)
+    y = (x[:, 0] + 0.1 * random.randn(rows) > 0.5).astype(numpy.float64)  # learnable, but not trivially
+    numpy.savetxt(path, numpy.column_stack([price, x, y]), delimiter=",", fmt="%.6f")
+
+
+def latencies(function, count):
+    """p50 and p99 of function(), in ms."""
+
+    times = []
+    for _ in range(count):
+        start = timer()
+        function()
+        times.append(timer() - start)
+    times = numpy.array(times) * 1000
+    return {'p50_ms': float(numpy.percentile(times, 50)), 'p99_ms': float(numpy.percentile(times, 99)),
+            'count': count}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on linux, bytes on macos
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+
+
+def bench_data(csv_path, timesteps):
+    from dataset import load_csv, sidecar_path
+    from windowing import sliding_windows
+
+    results = {}
+    start = timer()
+    numpy.loadtxt(csv_path, delimiter=",", ndmin=2)
+    results['loadtxt_sec'] = timer() - start
+
+    for suffix in ("", "_meta.json"):
+        if os.path.exists(sidecar_path(csv_path) + suffix):
+            os.remove(sidecar_path(csv_path) + suffix)
+    start = timer()
+    load_csv(csv_path)
+    results['load_csv_cold_sec'] = timer() - start
+    start = timer()
+    dataset = load_csv(csv_path)
+    results['load_csv_warm_sec'] = timer() - start
+
+    start = timer()
+    windows = numpy.ascontiguousarray(sliding_windows(dataset[:, 1:-1], timesteps))
+    results['windowing_sec'] = timer() - start
+    results['windows'] = windows.shape[0]
+    return results
+
+
+def train_init_rss(csv_path, timesteps):
+    """Peak rss growth of train_init, measured in this process. Used by bench_train_init_rss."""
+
+    sys.path.insert(0, MODEL_DIR)
+    import predictionserver as ps
+    ps.require_tf()
+    rss = peak_rss_mb()
+    assert ps.process("train_init", "%s,%d" % (csv_path, timesteps)) == "ok"
+    return peak_rss_mb() - rss
+
+
+def bench_train_init_rss(csv_path, timesteps):
+    """
+    Peak rss growth of train_init, in a new process: in this one, the peak of loading and windowing the csv in
+    bench_data would hide it.
+    """
+
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--train-init-rss", csv_path,
+                                      str(timesteps)])
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def bench_training(ps, csv_path, timesteps, epochs, batch_size, pb_path):
+    results = {'train_init_peak_rss_growth_mb': bench_train_init_rss(csv_path, timesteps)}
+    start = timer()
+    assert ps.process("train_init", "%s,%d" % (csv_path, timesteps)) == "ok"
+    results['train_init_sec'] = timer() - start
+
+    messages = []
+    start = timer()
+    reply = ps.process("train_fit", "%d,%d,0.2,0,0" % (epochs, batch_size), messages.append)
+    assert reply.startswith("job:"), reply
+    ps.train_job.result()
+    if not messages[-1].split(":", 2)[2].startswith("ok"):
+        raise RuntimeError(messages[-1])
+    results['epoch_sec'] = (timer() - start) / epochs
+
+    start = timer()
+    assert ps.process("train_save", pb_path) == "ok"
+    results['train_save_sec'] = timer() - start
+    return results
+
+
+def bench_in_process(ps, pb_path, timesteps, features, samples, batch_size):
+    """Latency and throughput of each engine, calling the server functions directly."""
+
+    random = numpy.random.RandomState(1)
+    window = random.rand(timesteps, features)
+    query = "|".join(",".join("%f" % v for v in row) for row in window)
+    batch = random.rand(batch_size, timesteps, features).astype(numpy.float32)
+
+    results = {}
+    # the numpy engine predicts the .npz train_save exported next to the .pb
+    for engine, path in (("tf", pb_path), ("numpy", ps.numpy_model.npz_path(pb_path))):
+        name = "bench_" + engine
+        start = timer()
+        ps.process("model_load", "%s,%s" % (name, path))
+        load_time = timer() - start
+
+        ps.predict(name, batch)  # warm up
+        start = timer()
+        rounds = max(1, samples // batch_size)
+        for _ in range(rounds):
+            ps.predict(name, batch)
+        throughput = rounds * batch_size / (timer() - start)
+
+        results[engine] = {
+            'load_sec': load_time,
+            'single_text': latencies(lambda: ps.process("model_predict", "%s:%s" % (name, query)), samples),
+            'single_array': latencies(lambda: ps.predict(name, window[numpy.newaxis]), samples),
+            'batch_windows_per_sec': throughput,
+        }
+        ps.process("model_unload", name)
+    return results
+
+
+async def bench_websocket_client(port, pb_path, timesteps, features, samples, batch_size, process_start):
+    import websockets
+    from predictionserver import BINARY_HEADER, BINARY_PREDICT, BINARY_PREDICT_BATCH
+    from shm import ShmClient
+
+    # the server binds before importing tf, so retry until it accepts connections
+    deadline = timer() + 60
+    while True:
+        try:
+            socket = await websockets.connect("ws://127.0.0.1:%d" % port, max_size=None)
+            break
+        except OSError:
+            if timer() > deadline:
+                raise
+            await asyncio.sleep(0.05)
+
+    async def request(msg):
+        await socket.send(msg)
+        reply = await socket.recv()
+        if isinstance(reply, str) and reply.startswith("error"):
+            raise RuntimeError(reply)
+        return reply
+
+    await request("ping:")
+    results = {'first_ping_sec': timer() - process_start}
+
+    slot = int((await request("model_load:bench,%s" % pb_path)).split(":")[1])
+    random = numpy.random.RandomState(1)
+    window = random.rand(timesteps, features)
+    query = "model_predict:bench:" + "|".join(",".join("%f" % v for v in row) for row in window)
+    single_frame = BINARY_HEADER.pack(BINARY_PREDICT, slot, timesteps, features, 1) + window.astype('<f4').tobytes()
+    batch = random.rand(batch_size, timesteps, features).astype('<f4')
+    batch_frame = BINARY_HEADER.pack(BINARY_PREDICT_BATCH, slot, timesteps, features, batch_size) + batch.tobytes()
+
+    async def latencies_async(msg):
+        times = []
+        for _ in range(samples):
+            start = timer()
+            await request(msg)
+            times.append(timer() - start)
+        times = numpy.array(times) * 1000
+        return {'p50_ms': float(numpy.percentile(times, 50)), 'p99_ms': float(numpy.percentile(times, 99)),
+                'count': samples}
+
+    await request(single_frame)  # warm up
+    results['single_text'] = await latencies_async(query)
+    results['single_binary'] = await latencies_async(single_frame)
+    channel = ShmClient((await request("shm_open:%d" % 2 ** 22)).split(":", 1)[1])
+    channel.request(single_frame)  # warm up
+    results['single_shm'] = latencies(lambda: channel.request(single_frame), samples)
+    channel.close()
+    rounds = max(1, samples // batch_size)
+    start = timer()
+    for _ in range(rounds):
+        await request(batch_frame)
+    results['batch_windows_per_sec'] = rounds * batch_size / (timer() - start)
+    await socket.send("bye")
+    await socket.close()
+    return results
+
+
+def bench_websocket(pb_path, timesteps, features, samples, batch_size, port, server_args):
+    """Runs a server process and benchmarks it as a client."""
+
+    start = timer()
+    server = subprocess.Popen([sys.executable, os.path.join(MODEL_DIR, "predictionserver.py"), "127.0.0.1", str(port)]
+                              + server_args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        return asyncio.get_event_loop().run_until_complete(
+            bench_websocket_client(port, pb_path, timesteps, features, samples, batch_size, start))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000, help="rows of the synthetic csv")
+    parser.add_argument("--timesteps", type=int, default=8)
+    parser.add_argument("--features", type=int, default=16)
+    parser.add_argument("--epochs", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=256, help="for training and batched predictions")
+    parser.add_argument("--samples", type=int, default=2000, help="predictions per latency measure")
+    parser.add_argument("--port", type=int, default=8091, help="for the websocket benchmark")
+    parser.add_argument("--no-websocket", action="store_true", help="skip the websocket benchmark")
+    parser.add_argument("--server-args", default="", help="extra predictionserver.py args, like '--engine numpy'")
+    parser.add_argument("--out", help="write the json here instead of stdout")
+    parser.add_argument("--train-init-rss", nargs=2, metavar=("CSV", "TIMESTEPS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.train_init_rss:
+        print(json.dumps(train_init_rss(args.train_init_rss[0], int(args.train_init_rss[1]))))
+        return
+
+    sys.path.insert(0, MODEL_DIR)
+    import predictionserver as ps
+    ps.require_tf()
+
+    work_dir = tempfile.mkdtemp(prefix="benchmark")
+    try:
+        csv_path = os.path.join(work_dir, "train.csv")
+        pb_path = os.path.join(work_dir, "model.pb")
+        synthetic_csv(csv_path, args.rows, args.features)
+
+        results = {
+            'config': dict(vars(args), python=platform.python_version(), tensorflow=ps.tf.__version__,
+                           cpus=os.cpu_count()),
+            'data': bench_data(csv_path, args.timesteps),
+            'training': bench_training(ps, csv_path, args.timesteps, args.epochs, args.batch_size, pb_path),
+            'in_process': bench_in_process(ps, pb_path, args.timesteps, args.features, args.samples, args.batch_size),
+        }
+        if not args.no_websocket:
+            results['websocket'] = bench_websocket(pb_path, args.timesteps, args.features, args.samples,
+                                                   args.batch_size, args.port, args.server_args.split())
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    text = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
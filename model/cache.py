@@ -0,0 +1,59 @@
+"""Cache of predictions by model and window content."""
+
+import hashlib
+import threading
+import numpy
+from collections import OrderedDict
+
+
+class PredictionCache:
+    """
+    Predictions keyed by (model key, window shape and dtype, hash of the float32 window bytes), so the same
+    window on the same model file is predicted only once. The same bytes in another shape are another window. Bounded to max_size predictions, evicting the least recently used.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def predict(self, model_key, model, array):
+        """Like model.predict(array), but only predicting the windows not in the cache."""
+
+        array = numpy.ascontiguousarray(array, dtype='<f4')
+        keys = [(model_key, window.shape, window.dtype.str, hashlib.blake2b(window.tobytes(), digest_size=16).digest())
+                for window in array]
+        result = numpy.empty(array.shape[0], dtype=numpy.float32)
+        missing = []
+        with self.lock:
+            for i, key in enumerate(keys):
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    result[i] = self.entries[key]
+                else:
+                    missing.append(i)
+            self.hits += array.shape[0] - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            predictions = model.predict(array[missing])
+            result[missing] = predictions
+            with self.lock:
+                for i, prediction in zip(missing, predictions):
+                    self.entries[keys[i]] = prediction
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+        return result
+
+    def invalidate(self, model_name):
+        """Drops the predictions of the model loaded as model_name (model keys are (name, file hash))."""
+
+        with self.lock:
+            for key in [k for k in self.entries if k[0][0] == model_name]:
+                del self.entries[key]
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries), 'max_size': self.max_size}
@@ -0,0 +1,38 @@
+"""Training CSVs loading, cached as memory-mapped float32 binary sidecars."""
+
+import json
+import os
+import numpy
+from atomicfile import atomic_save
+
+
+def sidecar_path(csv_path):
+    return csv_path + ".npy"
+
+
+def load_csv(csv_path):
+    """
+    Returns the csv at csv_path as a read-only memory-mapped float32 array. The first call parses
+    the text and saves it next to the csv as a .npy sidecar, later calls just map the sidecar, as long
+    as the csv path, size and mtime are still the ones the sidecar was built from.
+    """
+
+    stat = os.stat(csv_path)
+    key = {'path': os.path.abspath(csv_path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+    npy_path = sidecar_path(csv_path)
+    meta_path = npy_path + "_meta.json"
+
+    try:
+        with open(meta_path) as f:
+            if json.load(f) == key:
+                return numpy.load(npy_path, mmap_mode='r')
+    except (OSError, ValueError):
+        pass  # no sidecar yet, or a broken one. rebuild it.
+
+    print("loading txt...")
+    dataset = numpy.loadtxt(csv_path, delimiter=",", dtype=numpy.float32, ndmin=2)
+
+    atomic_save(npy_path, lambda tmp_path: numpy.save(tmp_path, dataset))
+    with open(meta_path, 'w') as f:
+        json.dump(key, f)
+    return numpy.load(npy_path, mmap_mode='r')
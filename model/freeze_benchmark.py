@@ -0,0 +1,65 @@
+"""
+Times freezing (tf_graph_util.convert_variables_to_constants, what train_save does) against graph size, on
+keras models with more and more stacked GRU layers, and checks the frozen graph is byte-identical to the one
+tensorflow's own graph_util produces.
+
+python freeze_benchmark.py [max layers] [repeats]
+"""
+
+import sys
+from timeit import default_timer as timer
+import tensorflow as tf
+import tf_graph_util
+
+try:
+    reference_graph_util = tf.compat.v1.graph_util
+except AttributeError:
+    reference_graph_util = tf.graph_util
+
+
+def stacked_gru(layers, timesteps=8, features=16):
+    model = tf.keras.models.Sequential()
+    for i in range(layers):
+        kwargs = {'input_shape': (timesteps, features)} if i == 0 else {}
+        model.add(tf.keras.layers.GRU(32, return_sequences=i < layers - 1, **kwargs))
+    model.add(tf.keras.layers.Dense(32, activation='relu'))
+    model.add(tf.keras.layers.Dense(1, activation='sigmoid'))
+    return model
+
+
+def best_time(function, repeats):
+    best, result = float('inf'), None
+    for _ in range(repeats):
+        start = timer()
+        result = function()
+        best = min(best, timer() - start)
+    return best, result
+
+
+def benchmark(layers, repeats):
+    tf.keras.backend.clear_session()
+    model = stacked_gru(layers)
+    session = tf.keras.backend.get_session()
+    graph_def = session.graph.as_graph_def()
+    for node in graph_def.node:
+        node.device = ""
+    output_names = [out.op.name for out in model.outputs]
+
+    ours_time, ours = best_time(lambda: tf_graph_util.convert_variables_to_constants(
+        session, graph_def, output_names), repeats)
+    reference_time, reference = best_time(lambda: reference_graph_util.convert_variables_to_constants(
+        session, graph_def, output_names), repeats)
+    identical = ours.SerializeToString(deterministic=True) == reference.SerializeToString(deterministic=True)
+    return len(graph_def.node), len(ours.node), ours_time, reference_time, identical
+
+
+if __name__ == '__main__':
+    max_layers = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    print("%6s %8s %8s %10s %10s %9s" % ("layers", "nodes", "frozen", "ours", "tf", "identical"))
+    layers = 1
+    while layers <= max_layers:
+        nodes, frozen_nodes, ours_time, reference_time, identical = benchmark(layers, repeats)
+        print("%6d %8d %8d %9.3fs %9.3fs %9s" % (layers, nodes, frozen_nodes, ours_time, reference_time, identical))
+        layers *= 2
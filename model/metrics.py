@@ -0,0 +1,133 @@
+"""Request counters, latency histograms and gauges of the prediction server, as json or as a scrapable text."""
+
+import bisect
+import threading
+from collections import defaultdict
+
+# histogram bucket upper bounds, in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# time spent running models (session.run or numpy) by the current thread, see add_run_time
+run_time = threading.local()
+
+
+def add_run_time(seconds):
+    run_time.seconds = getattr(run_time, 'seconds', 0.0) + seconds
+
+
+def take_run_time():
+    """The model run time added by this thread since the last call."""
+
+    seconds = getattr(run_time, 'seconds', 0.0)
+    run_time.seconds = 0.0
+    return seconds
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # the last one is for anything over the last bound
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile (inf if over the last bound)."""
+
+        target, seen = p / 100.0 * self.count, 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target and count > 0:
+                return BUCKETS[i] if i < len(BUCKETS) else float('inf')
+        return 0.0
+
+    def summary(self):
+        return {'count': self.count, 'mean_ms': self.sum / max(self.count, 1) * 1000,
+                'p50_ms': self.percentile(50) * 1000, 'p99_ms': self.percentile(99) * 1000}
+
+
+class Metrics:
+    """
+    Per message type counts, errors and latency histograms by phase (like parse, run and send), plus gauges:
+    functions sampled when the metrics are read, returning a number.
+    """
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.histograms = defaultdict(Histogram)  # (message type, phase) -> Histogram
+        self.gauges = {}
+        self.lock = threading.Lock()
+
+    def count(self, msg_type, error=False):
+        with self.lock:
+            self.counts[msg_type] += 1
+            if error:
+                self.errors[msg_type] += 1
+
+    def observe(self, msg_type, phase, seconds):
+        with self.lock:
+            self.histograms[(msg_type, phase)].observe(seconds)
+
+    def gauge(self, name, function):
+        self.gauges[name] = function
+
+    def snapshot(self):
+        """Everything as a json-able dict."""
+
+        with self.lock:
+            messages = {msg_type: {'count': count, 'errors': self.errors[msg_type], 'latency': {}}
+                        for msg_type, count in self.counts.items()}
+            for (msg_type, phase), histogram in self.histograms.items():
+                messages.setdefault(msg_type, {'count': 0, 'errors': 0, 'latency': {}})
+                messages[msg_type]['latency'][phase] = histogram.summary()
+        return {'messages': messages, 'gauges': {name: function() for name, function in self.gauges.items()}}
+
+    def text(self):
+        """Everything in the prometheus text format."""
+
+        lines = ["# TYPE predictionserver_messages_total counter"]
+        with self.lock:
+            for msg_type, count in sorted(self.counts.items()):
+                lines.append('predictionserver_messages_total{type="%s"} %d' % (msg_type, count))
+            lines.append("# TYPE predictionserver_errors_total counter")
+            for msg_type, count in sorted(self.errors.items()):
+                lines.append('predictionserver_errors_total{type="%s"} %d' % (msg_type, count))
+            lines.append("# TYPE predictionserver_latency_seconds histogram")
+            for (msg_type, phase), histogram in sorted(self.histograms.items()):
+                labels = 'type="%s",phase="%s"' % (msg_type, phase)
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append('predictionserver_latency_seconds_bucket{%s,le="%s"} %d' % (labels, bound, cumulative))
+                lines.append('predictionserver_latency_seconds_sum{%s} %f' % (labels, histogram.sum))
+                lines.append('predictionserver_latency_seconds_count{%s} %d' % (labels, histogram.count))
+        for name, function in sorted(self.gauges.items()):
+            lines.append("# TYPE predictionserver_%s gauge" % name)
+            lines.append("predictionserver_%s %s" % (name, float(function())))
+        return "\n".join(lines) + "\n"
+
+
+def serve_http(metrics, port, host="127.0.0.1"):
+    """Serves metrics.text() to any GET on host:port, from a daemon thread. Returns the server."""
+
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # don't log every scrape
+
+    server = HTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,158 @@
+"""
+Pure numpy inference for the models train_init and buildmodel.py build (GRU, Dropout, Dense, Dense), so
+predicting doesn't need a tensorflow session at all. The weights are exported to a .npz, either from the keras
+model or from the frozen .pb.
+"""
+
+import os
+import re
+import sys
+import numpy
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: numpy.maximum(x, 0),
+    'tanh': numpy.tanh,
+    'sigmoid': lambda x: 1 / (1 + numpy.exp(-x)),
+    'hard_sigmoid': lambda x: numpy.clip(0.2 * x + 0.5, 0, 1),
+}
+
+
+class NumpyModel:
+    """Same interface as GraphModel, but the forward pass is done with numpy."""
+
+    def __init__(self, weights):
+        self.kernel = weights['gru_kernel']
+        self.recurrent_kernel = weights['gru_recurrent_kernel']
+        bias = weights['gru_bias']
+        self.reset_after = bias.ndim == 2
+        if self.reset_after:  # keras keeps separate input and recurrent biases in this mode
+            self.input_bias, self.recurrent_bias = bias[0], bias[1]
+        else:
+            self.input_bias, self.recurrent_bias = bias, None
+        self.recurrent_activation = ACTIVATIONS[str(weights['recurrent_activation'])]
+        self.dense_kernel = weights['dense_kernel']
+        self.dense_bias = weights['dense_bias']
+        self.dense_activation = ACTIVATIONS[str(weights['dense_activation'])]
+        self.output_kernel = weights['output_kernel']
+        self.output_bias = weights['output_bias']
+        self.output_activation = ACTIVATIONS[str(weights['output_activation'])]
+
+    @staticmethod
+    def load(path):
+        with numpy.load(path) as weights:
+            return NumpyModel(dict(weights))
+
+    def predict(self, array):
+        """Returns the predictions for the (count, timesteps, features) array."""
+
+        array = numpy.asarray(array, dtype=numpy.float32)
+        units = self.recurrent_kernel.shape[0]
+        # the input part of every gate, for all the timesteps at once
+        inputs = numpy.dot(array, self.kernel) + self.input_bias
+        rk_z, rk_r, rk_h = (self.recurrent_kernel[:, :units],
+                            self.recurrent_kernel[:, units:2 * units],
+                            self.recurrent_kernel[:, 2 * units:])
+
+        h = numpy.zeros((array.shape[0], units), dtype=numpy.float32)
+        for t in range(array.shape[1]):
+            x_z, x_r, x_h = inputs[:, t, :units], inputs[:, t, units:2 * units], inputs[:, t, 2 * units:]
+            if self.reset_after:
+                recurrent = numpy.dot(h, self.recurrent_kernel) + self.recurrent_bias
+                z = self.recurrent_activation(x_z + recurrent[:, :units])
+                r = self.recurrent_activation(x_r + recurrent[:, units:2 * units])
+                hh = numpy.tanh(x_h + r * recurrent[:, 2 * units:])
+            else:
+                z = self.recurrent_activation(x_z + numpy.dot(h, rk_z))
+                r = self.recurrent_activation(x_r + numpy.dot(h, rk_r))
+                hh = numpy.tanh(x_h + numpy.dot(r * h, rk_h))
+            h = z * h + (1 - z) * hh
+
+        # dropout does nothing on inference
+        dense = self.dense_activation(numpy.dot(h, self.dense_kernel) + self.dense_bias)
+        return self.output_activation(numpy.dot(dense, self.output_kernel) + self.output_bias)[:, 0]
+
+    def close(self):
+        pass
+
+
+def export_keras(model, path):
+    """Saves the weights of the keras model to path (.npz)."""
+
+    gru = [l for l in model.layers if l.__class__.__name__ == 'GRU'][0]
+    dense, output = [l for l in model.layers if l.__class__.__name__ == 'Dense']
+    config = gru.get_config()
+    if config.get('activation', 'tanh') != 'tanh':
+        raise ValueError("unsupported gru activation: %s" % config['activation'])
+    kernel, recurrent_kernel, bias = gru.get_weights()
+    dense_kernel, dense_bias = dense.get_weights()
+    output_kernel, output_bias = output.get_weights()
+    numpy.savez(path,
+                gru_kernel=kernel, gru_recurrent_kernel=recurrent_kernel, gru_bias=bias,
+                recurrent_activation=config['recurrent_activation'],
+                dense_kernel=dense_kernel, dense_bias=dense_bias,
+                dense_activation=dense.get_config()['activation'],
+                output_kernel=output_kernel, output_bias=output_bias,
+                output_activation=output.get_config()['activation'])
+
+
+def export_frozen(pb_path, path):
+    """
+    Saves the weights of the frozen .pb model at pb_path to path (.npz). The frozen graph doesn't say which
+    activations were used, so the default ones of train_init are assumed (relu and sigmoid for the dense
+    layers), and the gru recurrent activation is sigmoid only if there's a Sigmoid op in the gru scope.
+    """
+
+    import tensorflow as tf
+    from tensorflow.python.framework import tensor_util
+
+    graph_def = tf.GraphDef()
+    with open(pb_path, 'rb') as f:
+        graph_def.ParseFromString(f.read())
+
+    consts = {}
+    recurrent_activation = 'hard_sigmoid'
+    for node in graph_def.node:
+        if node.op == 'Const':
+            consts[node.name] = node
+        elif node.op == 'Sigmoid' and re.search(r'(^|/)gru(_\d+)?/', node.name):
+            recurrent_activation = 'sigmoid'
+
+    def weight(pattern):
+        names = [n for n in consts if re.search(pattern, n)]
+        return [tensor_util.MakeNdarray(consts[n].attr['value'].tensor) for n in names]
+
+    dense_kernels = weight(r'(^|/)dense(_\d+)?/kernel$')
+    dense_biases = weight(r'(^|/)dense(_\d+)?/bias$')
+    if len(dense_kernels) != 2 or len(dense_biases) != 2:
+        raise ValueError("expected 2 dense layers in %s, found %d" % (pb_path, len(dense_kernels)))
+    numpy.savez(path,
+                gru_kernel=weight(r'(^|/)gru(_\d+)?/kernel$')[0],
+                gru_recurrent_kernel=weight(r'(^|/)gru(_\d+)?/recurrent_kernel$')[0],
+                gru_bias=weight(r'(^|/)gru(_\d+)?/bias$')[0],
+                recurrent_activation=recurrent_activation,
+                dense_kernel=dense_kernels[0], dense_bias=dense_biases[0], dense_activation='relu',
+                output_kernel=dense_kernels[1], output_bias=dense_biases[1], output_activation='sigmoid')
+
+
+def npz_path(pb_path):
+    return os.path.splitext(pb_path)[0] + ".npz"
+
+
+def load_for(pb_path):
+    """The NumpyModel of the .pb at pb_path, exporting its weights first if there's no up to date .npz."""
+
+    path = npz_path(pb_path)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(pb_path):
+        export_frozen(pb_path, path)
+    return NumpyModel.load(path)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print(sys.argv[0], "<frozen .pb> [output .npz]")
+        exit(1)
+
+    out = sys.argv[2] if len(sys.argv) == 3 else npz_path(sys.argv[1])
+    export_frozen(sys.argv[1], out)
+    print("saved", out)
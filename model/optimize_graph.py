@@ -0,0 +1,189 @@
+"""
+Inference-optimized export of frozen .pb models: removes training-only and identity nodes, folds constants, and
+optionally stores the weights as float16 or int8 (cast back to float32 in the graph), for smaller files that
+load faster. The input and output tensors keep their names, so the optimized .pb loads like any other.
+
+python optimize_graph.py <model.pb> <optimized.pb> [float32|float16|int8]
+python optimize_graph.py --compare <model.pb> <optimized.pb> [samples]
+"""
+
+import json
+import os
+import shutil
+import sys
+from timeit import default_timer as timer
+import numpy
+import tensorflow as tf
+from tensorflow.python.framework import tensor_util
+import numpy_model
+import tf_graph_util
+
+WEIGHT_TYPES = ('float32', 'float16', 'int8')
+
+# control flow ops. the identities right after them are part of the while loops frames, so they're kept
+CONTROL_FLOW_OPS = {"Switch", "Merge", "Enter", "Exit", "NextIteration", "LoopCond"}
+
+# only weights with at least this many values are stored with less precision. small ones aren't worth a cast
+MIN_REDUCED_SIZE = 64
+
+
+def _op_name(tensor_name):
+    return tensor_name.lstrip("^").split(":")[0]
+
+
+def _reduce_weights(graph_def, weights):
+    """Replaces the big float32 constants by float16 or int8 ones plus the ops to get them back as float32."""
+
+    out = tf.GraphDef()
+    out.versions.CopyFrom(graph_def.versions)
+    out.library.CopyFrom(graph_def.library)
+    for node in graph_def.node:
+        tensor = node.attr['value'].tensor if node.op == 'Const' else None
+        if tensor is None or tensor.dtype != tf.float32.as_datatype_enum:
+            out.node.add().CopyFrom(node)
+            continue
+        value = tensor_util.MakeNdarray(tensor)
+        if value.size < MIN_REDUCED_SIZE:
+            out.node.add().CopyFrom(node)
+            continue
+
+        # the float32 value keeps the const name, so the nodes using it don't change
+        if weights == 'float16':
+            _add_const(out, node.name + "/float16", value.astype(numpy.float16))
+            _add_cast(out, node.name, node.name + "/float16", tf.float16)
+        else:
+            scale = max(float(numpy.abs(value).max()), 1e-12) / 127
+            _add_const(out, node.name + "/int8", numpy.round(value / scale).astype(numpy.int8))
+            _add_const(out, node.name + "/scale", numpy.float32(scale))
+            _add_cast(out, node.name + "/dequantized", node.name + "/int8", tf.int8)
+            mul = out.node.add()
+            mul.op = "Mul"
+            mul.name = node.name
+            mul.input.extend([node.name + "/dequantized", node.name + "/scale"])
+            mul.attr['T'].type = tf.float32.as_datatype_enum
+    return out
+
+
+def _add_const(graph_def, name, value):
+    node = graph_def.node.add()
+    node.op = "Const"
+    node.name = name
+    node.attr['dtype'].type = tf.as_dtype(value.dtype).as_datatype_enum
+    node.attr['value'].tensor.CopyFrom(tensor_util.make_tensor_proto(value))
+
+
+def _add_cast(graph_def, name, input_name, source_type):
+    node = graph_def.node.add()
+    node.op = "Cast"
+    node.name = name
+    node.input.append(input_name)
+    node.attr['SrcT'].type = source_type.as_datatype_enum
+    node.attr['DstT'].type = tf.float32.as_datatype_enum
+
+
+def optimize_graph_def(graph_def, input_names, output_names, weights='float32'):
+    """
+    The optimized version of the frozen graph_def, which has input_names and output_names ops.
+    weights is float32 (unchanged), float16 or int8 (symmetric, a scale per tensor).
+    """
+
+    from tensorflow.tools.graph_transforms import TransformGraph
+
+    if weights not in WEIGHT_TYPES:
+        raise ValueError("invalid weights type '%s', expected one of %s" % (weights, ", ".join(WEIGHT_TYPES)))
+
+    nodes = {node.name: node for node in graph_def.node}
+    loop_identities = [node.name for node in graph_def.node if node.op == "Identity" and node.input and
+                       nodes[_op_name(node.input[0])].op in CONTROL_FLOW_OPS]
+    graph_def = tf_graph_util.remove_training_nodes(graph_def, input_names + output_names + loop_identities)
+    graph_def = TransformGraph(graph_def, input_names, output_names,
+                               ["fold_constants(ignore_errors=true)", "sort_by_execution_order"])
+    if weights != 'float32':
+        graph_def = _reduce_weights(graph_def, weights)
+    return graph_def
+
+
+def export_optimized(pb_path, out_path, weights='float32'):
+    """Writes the optimized version of the model at pb_path (with its _meta.json and .npz) to out_path."""
+
+    with open(pb_path + "_meta.json") as f:
+        meta = json.load(f)
+    graph_def = tf.GraphDef()
+    with open(pb_path, 'rb') as f:
+        graph_def.ParseFromString(f.read())
+
+    optimized = optimize_graph_def(graph_def, [_op_name(meta['input_name'])], [_op_name(meta['output_name'])],
+                                   weights)
+    with open(out_path, 'wb') as f:
+        f.write(optimized.SerializeToString())
+    shutil.copyfile(pb_path + "_meta.json", out_path + "_meta.json")
+
+    # numpy_model can't read the optimized weights (folded, maybe quantized), so it gets the original ones
+    if not os.path.exists(numpy_model.npz_path(pb_path)):
+        numpy_model.export_frozen(pb_path, numpy_model.npz_path(pb_path))
+    shutil.copyfile(numpy_model.npz_path(pb_path), numpy_model.npz_path(out_path))
+    return len(graph_def.node), len(optimized.node)
+
+
+def _load(path, meta):
+    graph = tf.Graph()
+    with graph.as_default():
+        graph_def = tf.GraphDef()
+        start = timer()
+        with open(path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        tf.import_graph_def(graph_def)
+        load_time = timer() - start
+    session = tf.Session(graph=graph)
+    tensor_in = graph.get_tensor_by_name("import/" + meta['input_name'])
+    tensor_out = graph.get_tensor_by_name("import/" + meta['output_name'])
+    return session, tensor_in, tensor_out, load_time
+
+
+def compare(pb_path, optimized_path, samples=4096, batch_size=256):
+    """Prediction drift and timings of the optimized model against the original one, on random windows."""
+
+    with open(pb_path + "_meta.json") as f:
+        meta = json.load(f)
+
+    results = {}
+    predictions = {}
+    for label, path in (('original', pb_path), ('optimized', optimized_path)):
+        session, tensor_in, tensor_out, load_time = _load(path, meta)
+        x = numpy.random.RandomState(0).rand(samples, *tensor_in.shape.as_list()[1:]).astype(numpy.float32)
+        session.run(tensor_out, {tensor_in: x[:batch_size]})  # warm up
+
+        start = timer()
+        predictions[label] = numpy.concatenate([session.run(tensor_out, {tensor_in: x[i:i + batch_size]})
+                                                for i in range(0, samples, batch_size)])[:, 0]
+        batch_time = timer() - start
+
+        single_count = min(samples, 200)
+        start = timer()
+        for i in range(single_count):
+            session.run(tensor_out, {tensor_in: x[i:i + 1]})
+        single_time = (timer() - start) / single_count
+
+        results[label] = {'file_bytes': os.path.getsize(path), 'load_sec': load_time,
+                          'batch_sec': batch_time, 'single_ms': single_time * 1000}
+        session.close()
+
+    drift = numpy.abs(predictions['original'] - predictions['optimized'])
+    results['max_drift'] = float(drift.max())
+    results['mean_drift'] = float(drift.mean())
+    results['same_decision'] = float(((predictions['original'] > 0.5) == (predictions['optimized'] > 0.5)).mean())
+    results['batch_speedup'] = results['original']['batch_sec'] / results['optimized']['batch_sec']
+    results['single_speedup'] = results['original']['single_ms'] / results['optimized']['single_ms']
+    return results
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 4 and sys.argv[1] == "--compare":
+        print(json.dumps(compare(sys.argv[2], sys.argv[3], *[int(a) for a in sys.argv[4:5]]), indent=2))
+    elif len(sys.argv) in (3, 4) and not sys.argv[1].startswith("--"):
+        nodes, optimized_nodes = export_optimized(sys.argv[1], sys.argv[2], *sys.argv[3:4])
+        print("saved %s: %d nodes -> %d" % (sys.argv[2], nodes, optimized_nodes))
+    else:
+        print(sys.argv[0], "<model.pb> <optimized.pb> [%s]" % "|".join(WEIGHT_TYPES))
+        print(sys.argv[0], "--compare <model.pb> <optimized.pb> [samples]")
+        exit(1)
@@ -1,223 +1,880 @@
+import argparse
 import asyncio
+import os
 import sys
 import numpy
-import tensorflow as tf
 import json
+import struct
+import threading
+import uuid
 import websockets
-from pandas import DataFrame
-from pandas import concat
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from timeit import default_timer as timer
-
-# global state, for both buy and sell models
-sess_buy, sess_sell = None, None
-in_tensor_buy, in_tensor_sell = None, None
-out_tensor_buy, out_tensor_sell = None, None
+from windowing import sliding_windows, holdout_split
+from dataset import load_csv
+from batching import MicroBatcher
+from registry import ModelRegistry, RESERVED_SLOTS
+import numpy_model
+from ringbuffer import WindowRing
+import sweep
+from cache import PredictionCache
+from seriesstore import SeriesStore
+import shm
+import metrics
+from metrics import Metrics
+import workers
+
+started = timer()
+
+# modules that import tensorflow, which takes seconds. they're imported on the background at startup, so the
+# server answers right away (predicting with numpy models doesn't need them at all). see require_tf
+tf, trainer, window_dataset = None, None, None
+tf_import = None  # future of the import, with its time
+tf_import_lock = threading.Lock()
+
+# global state. loaded models by name ("buy" and "sell" are the ones for buy_*/sell_* messages)
+models = ModelRegistry(lambda path, digest: load_model(path, digest), memory_budget=2048 * 2 ** 20)
 train_sess, train_model, train_X, train_y = None, None, None, None
+train_stream = False  # if true, train_fit streams windows through tf.data instead of feeding train_X directly
+train_graph = None
+train_job = None  # future of the running train_fit, if any
+train_source = None  # train_init params (csv_path, timesteps, mode), saved with the checkpoints to resume
 
+train_status = ""  # last progress or done message of the training jobs
 
-def freeze_session(session, keep_var_names=None, output_names=None, clear_devices=True):
-    from tf_graph_util import convert_variables_to_constants
-    graph = session.graph
-    with graph.as_default():
-        freeze_var_names = list(set(v.op.name for v in tf.global_variables()).difference(keep_var_names or []))
-        output_names = output_names or []
-        output_names += [v.op.name for v in tf.global_variables()]
-        # Graph -> GraphDef ProtoBuf
-        input_graph_def = graph.as_graph_def()
-        if clear_devices:
-            for node in input_graph_def.node:
-                node.device = ""
-        frozen_graph = convert_variables_to_constants(session, input_graph_def,
-                                                      output_names, freeze_var_names)
-        return frozen_graph
-
-
-def join_past_rows_features(data, past_rows=1, future_rows=1, dropnan=True):
-    """
-    For each row, join the features since past_rows up to future_rows, so
-    it may be reshaped for a recurrent NN input.
-    """
-
-    n_vars = 1 if type(data) is list else data.shape[1]
-    df = DataFrame(data)
-    cols, names = list(), list()
-    # input sequence (t-n, ... t-1)
-    for i in range(past_rows, 0, -1):
-        cols.append(df.shift(i))
-        names += [('var%d(t-%d)' % (j + 1, i)) for j in range(n_vars)]
-    # forecast sequence (t, t+1, ... t+n)
-    for i in range(0, future_rows):
-        cols.append(df.shift(-i))
-        if i == 0:
-            names += [('var%d(t)' % (j + 1)) for j in range(n_vars)]
-        else:
-            names += [('var%d(t+%d)' % (j + 1, i)) for j in range(n_vars)]
+# train_fit defaults: fraction of the samples held out for validation, epochs without improving it to stop,
+# and epochs between checkpoints (0 disables them)
+DEFAULT_VAL_SPLIT, DEFAULT_PATIENCE, DEFAULT_CHECKPOINT_EVERY = 0.2, 5, 1
+
+# train_fit jobs save their checkpoints under <checkpoint_dir>/<job id>/. set according to --checkpoint-dir
+checkpoint_dir = "checkpoints"
+
+# train_* messages and the trainings run here, so they don't block the event loop (and predictions) for minutes
+train_executor = ThreadPoolExecutor(max_workers=1)
+
+# session.run calls for predictions run here, so concurrent clients aren't serialized on the event loop.
+# replaced at startup according to --inference-threads
+inference_executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+INFERENCE_MESSAGES = {"buy_predict", "sell_predict", "buy_predict_batch", "sell_predict_batch", "model_predict",
+                      "buy_score_series", "sell_score_series", "model_score_series",
+                      "buy_load", "sell_load", "model_load"}
+
+# tf threads used by each loaded model session. 0 lets tf choose
+intra_op_threads, inter_op_threads = 0, 0
+
+# print diagnostics, like the nodes of each loaded graph. set according to --verbose
+verbose = False
+
+# imported graphs by .pb content hash, so reloading a model (even saved again, or somewhere else) doesn't parse
+# and import it again, it just gets a new session
+imported_graphs = OrderedDict()
+IMPORTED_GRAPHS_SIZE = 16
+
+# "tf" to predict .pb models on tf sessions, "numpy" to predict them with numpy_model (.npz models always are)
+engine = "tf"
+
+# slot -> MicroBatcher for single-window predictions, created on first use. batching is disabled if delay is 0
+batchers = {}
+batch_delay, batch_max_size = 0, 256
+
+# predictions by model file and window content, for repeated windows (backtests re-run over the same ticks).
+# None disables it. set according to --cache-size
+prediction_cache = None
+
+# score_series results on disk, by model file, features csv content and timesteps. None disables it.
+# set according to --series-store
+series_store = None
+
+# shared memory channels opened with shm_open, by id of the streams of their connection, closed with it
+shm_channels = {}
+
+# the worker processes that run the predictions with --workers, see workers.py. None runs them in this process
+worker_pool = None
+WORKER_STATES_MAX_AGE = 0.5
+worker_states_snapshot = (float('-inf'), [])  # (time taken, states), see worker_states
+worker_states_lock = threading.Lock()
+
+# request counts and latencies, see stats and --metrics-port
+server_metrics = Metrics()
+requests_in_flight = 0
+
+# binary frame header: message type, model slot id (as replied by model_load), timesteps, features per timestep,
+# window count. followed by count*timesteps*features little-endian float32 values.
+BINARY_HEADER = struct.Struct('<BIHHI')
+BINARY_PREDICT = 1
+BINARY_PREDICT_BATCH = 2
+BINARY_STREAM_PUSH = 3  # slot is the stream id, payload is the newest row
+BINARY_STREAM_SYNC = 4  # slot is the stream id, payload is the whole window
+MAX_STREAMS = 256  # per connection
+BINARY_NAMES = {BINARY_PREDICT: "binary_predict", BINARY_PREDICT_BATCH: "binary_predict_batch",
+                BINARY_STREAM_PUSH: "binary_stream_push", BINARY_STREAM_SYNC: "binary_stream_sync"}
+SLOT_BUY = RESERVED_SLOTS["buy"]
+SLOT_SELL = RESERVED_SLOTS["sell"]
+
+# windows per session.run when scoring a whole series
+SERIES_CHUNK_SIZE = 4096
+
+
+def import_tf():
+    """Imports tensorflow and the modules that need it. Returns the time it took."""
 
-    # put it all together
-    agg = concat(cols, axis=1)
-    agg.columns = names
-    # drop rows with NaN values
-    if dropnan:
-        agg.dropna(inplace=True)
-    return agg
+    global tf, trainer, window_dataset
+    start = timer()
+    import tensorflow
+    import trainer as trainer_module
+    from streaming import window_dataset as window_dataset_function
+    tf, trainer, window_dataset = tensorflow, trainer_module, window_dataset_function
+    return timer() - start
 
 
-def load_model(path):
-    """Load tensorflow .pb model from path, return it as a tf (session, in_tensor, out_tensor) ready to predict."""
+def start_tf_import():
+    """Starts importing the tf modules on the background, if not started yet. Returns the future of the import."""
+
+    global tf_import
+    with tf_import_lock:
+        if tf_import is None:
+            tf_import = ThreadPoolExecutor(max_workers=1).submit(import_tf)
+        return tf_import
+
+
+def require_tf():
+    """Waits until the tf modules are imported (raising the import error, if any)."""
+
+    start_tf_import().result()
+
+
+class GraphModel:
+    """A frozen tensorflow model, loaded on its own session."""
+
+    def __init__(self, session, tensor_in, tensor_out):
+        self.session = session
+        self.tensor_in = tensor_in
+        self.tensor_out = tensor_out
+
+    def predict(self, array):
+        """Returns the predictions for the (count, timesteps, features) array."""
+        return self.session.run(self.tensor_out, {self.tensor_in: array})[:, 0]
+
+    def close(self):
+        self.session.close()
+
+
+def load_model(path, digest):
+    """
+    Load tensorflow .pb model from path (whose content has the sha1 digest), return it as a GraphModel ready to
+    predict. For .npz weights (or any model, if engine is numpy) returns a NumpyModel instead, which doesn't use
+    tf at all.
+    """
+
+    if path.endswith(".npz"):
+        return numpy_model.NumpyModel.load(path)
+    elif engine == "numpy":
+        return numpy_model.load_for(path)
+
+    require_tf()
+    graph, in_tensor, out_tensor = import_graph(path, digest)
+    config = tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                            inter_op_parallelism_threads=inter_op_threads)
+    return GraphModel(tf.Session(graph=graph, config=config), in_tensor, out_tensor)
+
+
+def import_graph(path, digest):
+    """
+    Returns (graph, input tensor, output tensor) of the .pb at path, imported only once per file content (digest,
+    the sha1 the registry already hashed it to).
+    """
+
+    if digest in imported_graphs:
+        imported_graphs.move_to_end(digest)
+        return imported_graphs[digest]
 
+    with open(path, 'rb') as f:
+        data = f.read()
     graph = tf.Graph()
-    sess = tf.Session(graph=graph)
     with graph.as_default():
-        # load model
-        from tensorflow.python.platform import gfile
-        with gfile.FastGFile(path, 'rb') as f:
-            graph_def = tf.GraphDef()
-            graph_def.ParseFromString(f.read())
-            tf.import_graph_def(graph_def)
+        graph_def = tf.GraphDef()
+        graph_def.ParseFromString(data)
+        tf.import_graph_def(graph_def)
 
-        # load .json meta file, which contains the tensor names for input/output
-        with open(path + "_meta.json") as f:
-            meta = json.load(f)
+    # load .json meta file, which contains the tensor names for input/output
+    with open(path + "_meta.json") as f:
+        meta = json.load(f)
 
-        asd = [n.name for n in sess.graph.as_graph_def().node]
-        print(asd)
+    if verbose:
+        print("graph nodes of %s:" % path, [n.name for n in graph_def.node])
 
-        in_tensor = graph.get_tensor_by_name("import/" + meta["input_name"])
-        out_tensor = graph.get_tensor_by_name("import/" + meta["output_name"])
-        return sess, in_tensor, out_tensor
+    imported = (graph,
+                graph.get_tensor_by_name("import/" + meta["input_name"]),
+                graph.get_tensor_by_name("import/" + meta["output_name"]))
+    imported_graphs[digest] = imported
+    while len(imported_graphs) > IMPORTED_GRAPHS_SIZE:
+        imported_graphs.popitem(last=False)
+    return imported
 
 
-def do_prediction(query, session, tensor_in, tensor_out):
-    """Returns a prediction (float) on the given session, parsing the input received from 'predict:' query."""
+def parse_window(query):
+    """Parses a single 'a,b|c,d' window into a (timesteps, features) array."""
 
     lines = query.split('|')
     timesteps = len(lines)
     features_per_line = len(lines[0].split(','))
-    array = numpy.zeros((1, timesteps, features_per_line), dtype=float)
+    array = numpy.zeros((timesteps, features_per_line), dtype=float)
 
     for i in range(timesteps):
         features = lines[i].split(',')
         for j in range(features_per_line):
-            array[0, i, j] = float(features[j])
+            array[i, j] = float(features[j])
+
+    return array
+
+
+def predict(name, array):
+    """Predicts the (count, timesteps, features) array on the model loaded as name, through the cache if enabled."""
+
+    start = timer()
+    try:
+        with models.use(name) as model:
+            if prediction_cache is None:
+                return model.predict(array)
+            return prediction_cache.predict((name, models.digest(name)), model, array)
+    finally:
+        metrics.add_run_time(timer() - start)
+
+
+def do_prediction(query, name):
+    """Returns a prediction (float) on the model loaded as name, parsing the input received from 'predict:' query."""
+
+    return predict(name, parse_window(query)[numpy.newaxis])[0]
+
+
+def do_batch_prediction(query, name):
+    """
+    Returns the predictions for a 'predict_batch:' query, as a list of floats in request order.
+    Windows are separated by ';', and all of them are run in a single session.run call.
+    """
+
+    array = numpy.stack([parse_window(window) for window in query.split(';')])
+    return list(predict(name, array))
+
+
+def score_series(csv_path, timesteps, out_path, name):
+    """
+    Predicts every tick of the feature matrix at csv_path (one row per tick, no price nor output column)
+    and saves the predictions to out_path as a .npy array aligned to the tick index. The first
+    (timesteps - 1) ticks don't have a full window, so they're NaN.
+    If the series store has these predictions, they're copied from there without predicting anything.
+    """
+
+    if series_store is not None:
+        model_digest = models.digest(name)
+        predictions = series_store.get(model_digest, csv_path, timesteps)
+        if predictions is not None:
+            numpy.save(out_path, predictions)
+            return
+
+    features = numpy.loadtxt(csv_path, delimiter=",", ndmin=2)
+
+    x = sliding_windows(features, timesteps)
 
-    res = session.run(tensor_out, {tensor_in: array})
-    return res[0][0]
+    predictions = numpy.full(features.shape[0], numpy.nan)
+    run_start = timer()
+    with models.use(name) as model:
+        for start in range(0, x.shape[0], SERIES_CHUNK_SIZE):
+            chunk = numpy.ascontiguousarray(x[start:start + SERIES_CHUNK_SIZE])
+            predictions[timesteps - 1 + start:timesteps - 1 + start + chunk.shape[0]] = model.predict(chunk)
+    metrics.add_run_time(timer() - run_start)
 
+    numpy.save(out_path, predictions)
+    if series_store is not None:
+        series_store.put(model_digest, csv_path, timesteps, predictions)
 
-def process(msg, content):
-    global sess_buy, sess_sell
-    global in_tensor_buy, in_tensor_sell
-    global out_tensor_buy, out_tensor_sell
-    global train_sess, train_model, train_X, train_y
+
+def fit(job, notify):
+    """
+    Trains the model from train_init (or train_resume) as described by job (see train_fit), from job['epoch'].
+    Runs on train_executor, reporting to notify until 'done:<job id>:<result>'.
+    The last val_split of the samples (in time order) are held out to score the model, and the model ends with
+    the weights of the epoch with the best validation loss. If patience > 0, the training stops after that many
+    epochs without a better one.
+    With val_split 0 everything is trained on, and the reported scores are the training ones.
+    """
+
+    job_id, epochs, batch_size, val_split = job['id'], job['epochs'], job['batch_size'], job['val_split']
+    try:
+        if val_split > 0:
+            x, y, x_val, y_val = holdout_split(train_X, train_y, val_split, train_X.shape[1])
+        else:
+            x, y, x_val, y_val = train_X, train_y, None, None
+
+        with train_graph.as_default(), train_sess.as_default():
+            start = timer()
+            callbacks = [trainer.ProgressCallback(job_id, x.shape[0], notify)]
+            best, stopping = None, None
+            if x_val is not None:
+                # a resumed job continues with the best loss and weights, and epochs waited, of its checkpoint
+                best_loss = job.get('best_loss', float('inf'))
+                best = trainer.BestWeightsCallback(best_loss, trainer.load_best_weights(checkpoint_dir, job_id))
+                callbacks.append(best)
+                if job['patience'] > 0:
+                    stopping = trainer.ResumableEarlyStopping(job['patience'], best_loss, job.get('wait', 0))
+                    callbacks.append(stopping)
+            if job['checkpoint_every'] > 0:
+                callbacks.append(trainer.CheckpointCallback(job, checkpoint_dir, best, stopping))
+            if train_stream:
+                train_data, steps = window_dataset(x, y, batch_size)
+                eval_data, eval_steps = window_dataset(x_val if x_val is not None else x,
+                                                       y_val if y_val is not None else y, batch_size, shuffle=False)
+                history = train_model.fit(train_data, epochs=epochs, initial_epoch=job['epoch'], steps_per_epoch=steps,
+                                          callbacks=callbacks, validation_data=eval_data if x_val is not None else None,
+                                          validation_steps=eval_steps if x_val is not None else None, verbose=2)
+                scores = train_model.evaluate(eval_data, steps=eval_steps)
+            else:
+                history = train_model.fit(x, y, epochs=epochs, initial_epoch=job['epoch'], batch_size=batch_size,
+                                          callbacks=callbacks,
+                                          validation_data=(x_val, y_val) if x_val is not None else None, verbose=2)
+                scores = train_model.evaluate(x_val if x_val is not None else x, y_val if y_val is not None else y,
+                                              batch_size=batch_size)
+            time = timer() - start
+        if job['checkpoint_every'] > 0:
+            # finished, even if stopped early. nothing to resume
+            trainer.remove_job(checkpoint_dir, job_id)
+        notify("done:%s:ok: %sloss %.3f, %sacc %.3f, %d epochs, %.1f sec" % (
+            job_id, "val " if x_val is not None else "", scores[0], "val " if x_val is not None else "", scores[1],
+            len(history.epoch), time))
+    except:
+        notify("done:%s:error: %s" % (job_id, sys.exc_info()[1]))
+
+
+def run_sweep(job_id, csv_path, grid, notify):
+    """Runs a train_sweep on train_executor, reporting each trial to notify until 'done:<job id>:<result>'."""
+
+    try:
+        options = {key: grid.pop(key) for key in ("workers", "val_split", "save") if key in grid}
+        results = sweep.sweep(csv_path, grid, workers=options.get("workers"),
+                              val_split=options.get("val_split", 0.2), save_path=options.get("save"),
+                              notify=lambda text: notify("progress:%s:%s" % (job_id, text)))
+        notify("done:%s:ok:%s" % (job_id, json.dumps(results)))
+    except:
+        notify("done:%s:error: %s" % (job_id, sys.exc_info()[1]))
+
+
+def training_running():
+    return train_job is not None and not train_job.done()
+
+
+def process(msg, content, notify=print):
+    global train_sess, train_model, train_X, train_y, train_stream, train_graph, train_job, train_source
+
+    if msg == "ping": # replies ready:<json> with the startup timings
+        return "ready:" + json.dumps(readiness())
+
+    if msg == "stats": # replies the request metrics, queues, models and training state as json
+        return json.dumps(stats())
+
+    if msg.startswith("train_") and msg != "train_sweep":
+        require_tf()  # on train_executor, the import may still be running at startup
 
     # train
-    if msg == "train_init": # to prepare the data and build the model architecture, based on the given timesteps
+    if msg == "train_init": # :csv path,timesteps[,memory|stream] to prepare the data and build the model architecture
+        if training_running():
+            return "error: training in progress"
+
         tf.keras.backend.clear_session()
 
         params = content.split(",", 2)
         csv_path = params[0]
         timesteps = int(params[1])
+        mode = params[2] if len(params) > 2 else "memory"
+        if mode not in ("memory", "stream"):
+            return "error: invalid train mode '%s'" % mode
 
-        # load csv into x and y
-        print("loading txt...")
-        dataset = numpy.loadtxt(csv_path, delimiter=",")
-        x = dataset[:, 1:-1] # remove price column (the first) and output column (the last)
-        feature_count = x[0].size
-        y = dataset[:, -1:]
-
-        # on each row, include the features from the previous (timestep - 1) rows.
-        # so, will end having feature_count*timesteps features per row.
-        x = join_past_rows_features(x, past_rows=timesteps - 1).values  # from t(timesteps-1) to t(0)
-        x = x.reshape((x.shape[0], timesteps, feature_count))
-        y = y[timesteps - 1:] # remove first _timesteps_ entries, to keep sample count in sync with x
+        # load csv into x and y. on each row, include the features from the previous (timestep - 1) rows.
+        # so, will end having (timesteps, feature_count) features per row.
+        x, y = trainer.training_data(load_csv(csv_path), timesteps)
         print("data preprocessing done. shape:", x.shape)
 
         # build the model
-        train_sess = tf.Session()
-        model = tf.keras.models.Sequential()
-        model.add(tf.keras.layers.GRU(32, input_shape=(timesteps, feature_count)))
-        model.add(tf.keras.layers.Dropout(0.2))
-        model.add(tf.keras.layers.Dense(32, activation='relu'))
-        model.add(tf.keras.layers.Dense(1, activation='sigmoid'))
-        model.compile(loss='binary_crossentropy', optimizer='adam', metrics=['accuracy'])
+        model = trainer.build_model(timesteps, x.shape[2])
         print("model compiled.")
 
-        # save to global state
+        # save to global state. graph and session are kept to train on the executor thread
+        train_graph = tf.get_default_graph()
+        train_sess = tf.keras.backend.get_session()
         train_model = model
         train_X = x
         train_y = y
+        train_stream = mode == "stream"
+        train_source = {'csv_path': csv_path, 'timesteps': timesteps, 'mode': mode}
         return "ok"
 
-    elif msg == "train_fit":
+    elif msg == "train_fit": # :epochs,batch size[,val split[,patience[,checkpoint every]]]. replies job:<id>,
+                             # then progress and done messages
         if train_model is None:
             return "error: model not initialized"
+        if training_running():
+            return "error: training in progress"
+
+        params = content.split(",")
+        job = dict(train_source,
+                   id=uuid.uuid4().hex[:8],
+                   epochs=int(params[0]),
+                   batch_size=int(params[1]),
+                   val_split=float(params[2]) if len(params) > 2 else DEFAULT_VAL_SPLIT,
+                   patience=int(params[3]) if len(params) > 3 else DEFAULT_PATIENCE,
+                   checkpoint_every=int(params[4]) if len(params) > 4 else DEFAULT_CHECKPOINT_EVERY,
+                   epoch=0)
+        if job['checkpoint_every'] > 0:
+            trainer.save_job(checkpoint_dir, job)
+        train_job = train_executor.submit(fit, job, track_training(notify))
+        return "job:" + job['id']
+
+    elif msg == "train_resume": # :job id. continues a train_fit from its last checkpoint. replies like train_fit
+        if training_running():
+            return "error: training in progress"
 
-        params = content.split(",", 2)
-        epochs = int(params[0])
-        batch_size = int(params[1])
-        start = timer()
-        train_model.fit(train_X, train_y, epochs=epochs, batch_size=batch_size, verbose=2)
-        scores = train_model.evaluate(train_X, train_y)
-        time = timer() - start
-        return "ok: loss %.3f, acc %.3f, %.1f sec)" % (scores[0], scores[1], time)
-
-    elif msg == "train_save": # :path
+        try:
+            with open(trainer.job_path(checkpoint_dir, content)) as f:
+                job = json.load(f)
+        except OSError:
+            return "error: no checkpoints for job '%s'" % content
+        if job['epoch'] == 0:
+            return "error: job '%s' didn't reach its first checkpoint" % content
+        if job['epoch'] >= job['epochs']:
+            return "error: job '%s' already finished" % content
+
+        tf.keras.backend.clear_session()
+        train_X, train_y = trainer.training_data(load_csv(job['csv_path']), job['timesteps'])
+        train_model = tf.keras.models.load_model(os.path.join(checkpoint_dir, job['id'], "model.h5"))
+        train_graph = tf.get_default_graph()
+        train_sess = tf.keras.backend.get_session()
+        train_stream = job['mode'] == "stream"
+        train_source = {key: job[key] for key in ('csv_path', 'timesteps', 'mode')}
+        print("resuming job %s at epoch %d/%d" % (job['id'], job['epoch'], job['epochs']))
+        train_job = train_executor.submit(fit, job, track_training(notify))
+        return "job:" + job['id']
+
+    elif msg == "train_sweep": # :csv path,json grid. replies job:<id> right away, then a progress message per trial
+        if training_running():
+            return "error: training in progress"
+
+        csv_path, grid = content.split(",", 1)
+        job_id = uuid.uuid4().hex[:8]
+        train_job = train_executor.submit(run_sweep, job_id, csv_path, json.loads(grid), track_training(notify))
+        return "job:" + job_id
+
+    elif msg == "train_save": # :path[,float32|float16|int8] to also optimize the graph for inference
         if train_model is None:
             return "error: model not initialized"
+        if training_running():
+            return "error: training in progress"
 
-        pb_path = content
-        tensor_in_name = train_model.input.name
-        tensor_out_name = train_model.output.name
-        with open(pb_path + "_meta.json", 'w') as f:
-            json.dump({'input_name': tensor_in_name, 'output_name': tensor_out_name}, f)
-
-        frozen_graph = freeze_session(tf.keras.backend.get_session(),
-                                      output_names=[out.op.name for out in train_model.outputs])
-        tf.train.write_graph(frozen_graph, ".", pb_path, as_text=False)
+        with train_graph.as_default(), train_sess.as_default():
+            params = content.split(",", 1)
+            trainer.save_model(train_model, train_sess, params[0], params[1] if len(params) > 1 else None)
         return "ok"
 
     # load
     if msg == "buy_load":
-        if sess_buy is not None:
-            sess_buy.close()
-
-        sess_buy, in_tensor_buy, out_tensor_buy = load_model(content)
+        load_model_as("buy", content)
         return "ok"
 
     elif msg == "sell_load":
-        if sess_sell is not None:
-            sess_sell.close()
+        load_model_as("sell", content)
+        return "ok"
 
-        sess_sell, in_tensor_sell, out_tensor_sell = load_model(content)
+    elif msg == "model_load": # :name,path. replies ok:<slot>, the slot to use in binary frames
+        name, path = content.split(",", 1)
+        return "ok:%d" % load_model_as(name, path)
+
+    elif msg == "model_unload": # :name
+        models.unload(content)
+        if prediction_cache is not None:
+            prediction_cache.invalidate(content)
         return "ok"
 
+    elif msg == "model_list":
+        return json.dumps(models.list())
+
+    elif msg == "cache_stats":
+        return json.dumps(prediction_cache.stats() if prediction_cache is not None else {})
+
     # predict
     elif msg == "buy_predict":
-        if sess_buy is None:
-            return "error: sess_buy not initialized"
-
-        return str(do_prediction(content, sess_buy, in_tensor_buy, out_tensor_buy))
+        return str(do_prediction(content, "buy"))
 
     elif msg == "sell_predict":
-        if sess_sell is None:
-            return "error: sess_sell not initialized"
+        return str(do_prediction(content, "sell"))
+
+    elif msg == "buy_score_series": # :csv path,timesteps,out path
+        csv_path, timesteps, out_path = content.split(",", 2)
+        score_series(csv_path, int(timesteps), out_path, "buy")
+        return "ok"
 
-        return str(do_prediction(content, sess_sell, in_tensor_sell, out_tensor_sell))
+    elif msg == "sell_score_series": # :csv path,timesteps,out path
+        csv_path, timesteps, out_path = content.split(",", 2)
+        score_series(csv_path, int(timesteps), out_path, "sell")
+        return "ok"
+
+    elif msg == "model_score_series": # :name,csv path,timesteps,out path
+        name, csv_path, timesteps, out_path = content.split(",", 3)
+        score_series(csv_path, int(timesteps), out_path, name)
+        return "ok"
+
+    elif msg == "buy_predict_batch":
+        return ",".join(str(p) for p in do_batch_prediction(content, "buy"))
+
+    elif msg == "sell_predict_batch":
+        return ",".join(str(p) for p in do_batch_prediction(content, "sell"))
+
+    elif msg == "model_predict": # :name:windows separated by ';'
+        name, windows = content.split(":", 1)
+        return ",".join(str(p) for p in do_batch_prediction(windows, name))
+
+    return "error: unknown message type %s" % msg
+
+
+def track_training(notify):
+    """notify for training jobs, remembering their last message for stats."""
+
+    def track(text):
+        global train_status
+        train_status = text
+        notify(text)
+    return track
+
+
+def loaded_models():
+    """
+    (list, memory in bytes) of the loaded models. With --workers, the list of a worker (all of them load the same
+    models) and the memory of all of them.
+    """
+
+    if worker_pool is None:
+        return models.list(), models.memory
+    states = worker_states()
+    return states[0]['models'] if states else [], sum(state['memory'] for state in states)
+
+
+def cache_stats():
+    """Stats of the prediction cache, or of the cache of each worker with --workers. Empty without cache."""
+
+    if worker_pool is not None:
+        return [state['cache'] for state in worker_states() if state['cache'] is not None]
+    return [prediction_cache.stats()] if prediction_cache is not None else []
+
+
+def worker_states():
+    """
+    worker_pool.states(), asked at most once per WORKER_STATES_MAX_AGE. So the gauges of a stats request (or a
+    metrics scrape) share one snapshot instead of asking the workers once per gauge.
+    """
+
+    global worker_states_snapshot
+    with worker_states_lock:
+        taken, states = worker_states_snapshot
+        if timer() - taken > WORKER_STATES_MAX_AGE:
+            states = worker_pool.states()
+            worker_states_snapshot = (timer(), states)
+        return states
+
+
+def stats():
+    snapshot = server_metrics.snapshot()
+    snapshot['training'] = {'running': training_running(), 'status': train_status}
+    snapshot['models'] = loaded_models()[0]
+    caches = cache_stats()
+    if caches:
+        snapshot['cache'] = caches if worker_pool is not None else caches[0]
+    return snapshot
+
+
+server_metrics.gauge("requests_in_flight", lambda: requests_in_flight)
+server_metrics.gauge("batch_queue_depth", lambda: sum(b.queue_depth for b in list(batchers.values())))
+server_metrics.gauge("models_loaded", lambda: len(loaded_models()[0]))
+server_metrics.gauge("models_memory_bytes", lambda: loaded_models()[1])
+server_metrics.gauge("training_running", lambda: int(training_running()))
+server_metrics.gauge("cache_hits", lambda: sum(cache['hits'] for cache in cache_stats()))
+server_metrics.gauge("cache_misses", lambda: sum(cache['misses'] for cache in cache_stats()))
+server_metrics.gauge("workers", lambda: sum(w.alive for w in worker_pool.workers) if worker_pool is not None else 0)
+
+
+def readiness():
+    """Uptime of the server, and whether tf is imported already (and how long it took)."""
+
+    state = {'uptime': timer() - started, 'tf': 'not imported'}
+    if tf_import is not None:
+        if not tf_import.done():
+            state['tf'] = 'importing'
+        elif tf_import.exception() is not None:
+            state['tf'] = 'error: %s' % tf_import.exception()
+        else:
+            state['tf'] = 'ready'
+            state['tf_import_sec'] = tf_import.result()
+    return state
+
+
+def load_model_as(name, path):
+    """Loads path as name, dropping the cached predictions of what name had. Returns the slot."""
+
+    slot, _ = models.load(name, path)
+    if prediction_cache is not None:
+        prediction_cache.invalidate(name)
+    return slot
+
+
+def predict_slot(slot, array):
+    """Predicts the (count, timesteps, features) array on the model at slot. Used by the batchers."""
+
+    if worker_pool is not None:
+        return worker_pool.predict(slot, array)
+    return predict(models.name(slot), array)
+
+
+def batcher(slot):
+    """The MicroBatcher of the model at slot."""
+
+    if slot not in batchers:
+        batchers[slot] = MicroBatcher(lambda array: predict_slot(slot, array), inference_executor,
+                                      max_delay=batch_delay, max_size=batch_max_size)
+    return batchers[slot]
+
+
+def parse_single_prediction(msg):
+    """If msg asks for a single-window prediction returns (slot, window), so it can be batched. Otherwise None."""
+
+    if isinstance(msg, bytes):
+        msg_type, slot, timesteps, features, count = BINARY_HEADER.unpack_from(msg)
+        if msg_type != BINARY_PREDICT:
+            return None
+        array = numpy.frombuffer(msg, dtype='<f4', count=timesteps * features, offset=BINARY_HEADER.size)
+        return slot, array.reshape((timesteps, features))
+
+    if msg.startswith("buy_predict:"):
+        return SLOT_BUY, parse_window(msg[len("buy_predict:"):])
+    elif msg.startswith("sell_predict:"):
+        return SLOT_SELL, parse_window(msg[len("sell_predict:"):])
+    return None
+
+
+class PredictionStream:
+    """Incremental predictions of a model: the client sends only the newest row each tick."""
+
+    def __init__(self, name, timesteps, features):
+        self.name = name
+        self.ring = WindowRing(timesteps, features)
+
+    def predict(self):
+        if not self.ring.full:
+            return "NaN"  # still not enough rows for a window
+        return str(self.values()[0])
+
+    def values(self):
+        """The prediction of the current window as an array, nan until there are enough rows."""
+
+        if not self.ring.full:
+            return numpy.array([numpy.nan])
+        return predict(self.name, self.ring.window()[numpy.newaxis])
+
+
+def process_stream(msg, content, streams):
+    """Handles stream_* and shm_open messages. streams (id -> PredictionStream) are per connection."""
+
+    if msg == "shm_open": # :size in bytes[,spin ms]. replies ok:<path> of the file to map, see shm.py
+        params = content.split(",")
+        spin = float(params[1]) / 1000.0 if len(params) > 1 else shm.DEFAULT_SPIN
+        channel = shm.ShmChannel(int(params[0]), lambda frame: predict_shm(frame, streams), spin)
+        shm_channels.setdefault(id(streams), []).append(channel)
+        return "ok:%s" % channel.path
+
+    elif msg == "stream_open": # :model name,timesteps,features. replies ok:<stream id>
+        name, timesteps, features = content.split(",", 2)
+        stream_id = next((i for i in range(MAX_STREAMS) if i not in streams), None)
+        if stream_id is None:
+            return "error: too many streams open"
+        streams[stream_id] = PredictionStream(name, int(timesteps), int(features))
+        return "ok:%d" % stream_id
+
+    elif msg == "stream_close": # :stream id
+        del streams[int(content)]
+        return "ok"
+
+    stream_id, data = content.split(":", 1)
+    stream = streams.get(int(stream_id))
+    if stream is None:
+        return "error: unknown stream %s" % stream_id
+
+    if msg == "stream_push": # :stream id:newest row
+        stream.ring.push([float(f) for f in data.split(',')])
+    elif msg == "stream_sync": # :stream id:whole window, to resync (ie after a reconnect)
+        stream.ring.sync(parse_window(data))
+    else:
+        return "error: invalid stream message %s" % msg
+    return stream.predict()
+
+
+def predict_binary(frame, streams=None):
+    """The predictions of a binary frame (bytes or memoryview), reading the float32 payload in place."""
+
+    msg, slot, timesteps, features, count = BINARY_HEADER.unpack_from(frame)
+    if msg not in BINARY_NAMES:
+        raise ValueError("invalid binary message %d" % msg)
+    array = numpy.frombuffer(frame, dtype='<f4', count=count * timesteps * features, offset=BINARY_HEADER.size)
+
+    if msg in (BINARY_STREAM_PUSH, BINARY_STREAM_SYNC):
+        stream = (streams or {}).get(slot)
+        if stream is None:
+            raise ValueError("unknown stream %d" % slot)
+        if msg == BINARY_STREAM_PUSH:
+            stream.ring.push(array)
+        else:
+            stream.ring.sync(array.reshape((timesteps, features)))
+        return stream.values()
+
+    return predict_slot(slot, array.reshape((count, timesteps, features)))
+
+
+def predict_shm(frame, streams):
+    """predict_binary for the frames of the shared memory channels, recording their metrics."""
+
+    label = "shm_" + BINARY_NAMES.get(frame[0], "binary")
+    try:
+        res = timed(label, timer(), predict_binary, frame, streams)
+    except Exception:
+        server_metrics.count(label, error=True)
+        raise
+    server_metrics.count(label, error=False)
+    return res
+
+
+def close_shm_channels(streams):
+    """Closes the shared memory channels opened by the connection of streams."""
+
+    for channel in shm_channels.pop(id(streams), []):
+        channel.close()
+
+
+def process_binary(frame, streams=None):
+    """Like process, but for binary frames. Reads the float32 payload straight into the input tensor."""
+
+    res = predict_binary(frame, streams)
+    if frame[0] == BINARY_PREDICT_BATCH:
+        return ",".join(str(p) for p in res)
+    elif numpy.isnan(res[0]):
+        return "NaN"  # a stream still without a whole window
+    return str(res[0])
+
+
+def message_type(msg):
+    """The type of a text or binary message, to label its metrics."""
+
+    if isinstance(msg, bytes):
+        return BINARY_NAMES.get(msg[0], "binary") if msg else "binary"
+    return msg.split(':', 1)[0] if ':' in msg else "invalid"
+
+
+def timed(msg_type, submitted, function, *args):
+    """
+    Runs function(*args), recording how long it waited since submitted (queue), the time running models (run)
+    and everything else, mostly parsing the input and formatting the output (parse).
+    """
+
+    start = timer()
+    server_metrics.observe(msg_type, "queue", start - submitted)
+    metrics.take_run_time()
+    try:
+        return function(*args)
+    finally:
+        run = metrics.take_run_time()
+        server_metrics.observe(msg_type, "run", run)
+        server_metrics.observe(msg_type, "parse", timer() - start - run)
+
+
+def configure(args):
+    """Sets the global state according to the parsed command line args. Also used by the worker processes."""
+
+    global inference_executor, intra_op_threads, inter_op_threads, batch_delay, batch_max_size, engine, verbose
+    global checkpoint_dir, prediction_cache, series_store
+    inference_executor = ThreadPoolExecutor(max_workers=args.inference_threads)
+    intra_op_threads, inter_op_threads = args.intra_op_threads, args.inter_op_threads
+    batch_delay, batch_max_size = args.batch_delay_ms / 1000.0, args.batch_max_size
+    models.memory_budget = args.model_memory_mb * 2 ** 20
+    engine = args.engine
+    verbose = args.verbose
+    checkpoint_dir = args.checkpoint_dir
+    if args.cache_size > 0:
+        prediction_cache = PredictionCache(args.cache_size)
+    if args.series_store:
+        series_store = SeriesStore(args.series_store)
 
 
 async def handle_request(socket, _):
+    # with --workers, the streams and shared memory channels of this connection are kept by its worker
+    connection = worker_pool.connect() if worker_pool is not None else None
+    streams = {}
+    try:
+        await serve_connection(socket, connection, streams)
+    finally:
+        if connection is not None:
+            worker_pool.disconnect(connection)
+        close_shm_channels(streams)
+
+
+async def serve_connection(socket, connection, streams):
+    global requests_in_flight
+    loop = asyncio.get_event_loop()
+
+    def notify(text):
+        """Sends text to this client from any thread, for messages not replying to a request (like job progress)."""
+        asyncio.run_coroutine_threadsafe(socket.send(text), loop)
+
     while True:
         msg = await socket.recv()
         if msg == "bye":
             break
 
+        received = timer()
+        label = message_type(msg)
+        requests_in_flight += 1
         try:
-            msg_type, content = msg.split(':', 1)
-            result = process(msg_type, content)
-            await socket.send(result)
+            single = parse_single_prediction(msg) if batch_delay > 0 else None
+            if single is not None:
+                slot, window = single
+                result = str(await batcher(slot).predict(window))
+                server_metrics.observe(label, "batch", timer() - received)
+            elif connection is not None and workers.handles(msg):
+                result = await worker_pool.process(msg, connection)
+                server_metrics.observe(label, "worker", timer() - received)
+            elif isinstance(msg, bytes):
+                result = await loop.run_in_executor(inference_executor, timed, label, received,
+                                                    process_binary, msg, streams)
+            else:
+                msg_type, content = msg.split(':', 1)
+                if msg_type.startswith("stream_") or msg_type == "shm_open":
+                    result = await loop.run_in_executor(inference_executor, timed, label, received,
+                                                        process_stream, msg_type, content, streams)
+                elif msg_type in INFERENCE_MESSAGES or msg_type == "stats":  # stats may wait for the workers
+                    result = await loop.run_in_executor(inference_executor, timed, label, received,
+                                                        process, msg_type, content, notify)
+                elif msg_type.startswith("train_"):
+                    # preparing the data, building or loading the model and saving it take seconds. the jobs
+                    # run on the same thread, so refuse right away instead of waiting behind a running one
+                    if training_running():
+                        result = "error: training in progress"
+                    else:
+                        result = await loop.run_in_executor(train_executor, timed, label, received,
+                                                            process, msg_type, content, notify)
+                else:
+                    result = timed(label, received, process, msg_type, content, notify)
         except:
-            err = "error: %s", (sys.exc_info()[0])
-            await socket.send(err)
+            result = "error: %s" % (sys.exc_info()[1],)
+        finally:
+            requests_in_flight -= 1
+
+        server_metrics.count(label, error=result.startswith("error"))
+        send_start = timer()
+        await socket.send(result)
+        server_metrics.observe(label, "send", timer() - send_start)
 
 
 if __name__ == '__main__':
@@ -226,6 +883,7 @@ if __name__ == '__main__':
     # print(process("sell_load", "/media/lleps/Compartido/Dev/tradexchange/data/models/[train]fafafa-open.pb"))
     # print(process("buy_predict", "0.9,0.2|0.4,0.2|0.01,0.19"))
     # print(process("sell_predict", "0.9,0.2|0.4,0.2|0.01,0.19"))
+    # print(process("buy_predict_batch", "0.9,0.2|0.4,0.2|0.01,0.19;0.4,0.2|0.01,0.19|0.3,0.3"))
 
     ## test training and saving
     # print(process("train_init", "/media/lleps/Compartido/Dev/tradexchange/data/trainings/[train]besttrainever.csv,4"))
@@ -235,14 +893,51 @@ if __name__ == '__main__':
     # print(process("train_fit", "10,32"))
     # print(process("train_save", "some2.pb"))
 
-    if len(sys.argv) != 3:
-        print(sys.argv[0], "<host> <port>")
-        exit(1)
-
-    start_server = websockets.serve(handle_request, sys.argv[1], int(sys.argv[2]))
+    parser = argparse.ArgumentParser()
+    parser.add_argument("host")
+    parser.add_argument("port", type=int)
+    parser.add_argument("--inference-threads", type=int, default=os.cpu_count(),
+                        help="predictions run concurrently on this many threads")
+    parser.add_argument("--intra-op-threads", type=int, default=0, help="tf intra-op threads per model session")
+    parser.add_argument("--inter-op-threads", type=int, default=0, help="tf inter-op threads per model session")
+    parser.add_argument("--batch-delay-ms", type=float, default=0,
+                        help="wait up to this to batch concurrent single-window predictions. 0 disables batching")
+    parser.add_argument("--batch-max-size", type=int, default=256, help="run a batch as soon as it has this many windows")
+    parser.add_argument("--model-memory-mb", type=int, default=2048,
+                        help="idle models are unloaded when the loaded ones take more than this")
+    parser.add_argument("--engine", choices=["tf", "numpy"], default="tf",
+                        help="numpy predicts the gru models without tf sessions, much faster for small batches")
+    parser.add_argument("--checkpoint-dir", default="checkpoints",
+                        help="train_fit jobs save their checkpoints here, to continue them with train_resume")
+    parser.add_argument("--verbose", action="store_true", help="print diagnostics, like the nodes of loaded graphs")
+    parser.add_argument("--cache-size", type=int, default=0,
+                        help="remember up to this many predictions by model and window. 0 disables the cache")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="serve the metrics as text on this local http port, for scrapers. 0 disables it")
+    parser.add_argument("--series-store", default="",
+                        help="save score_series predictions under this directory and reuse them across restarts")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="run the predictions on this many processes, each with its own copy of the models. "
+                             "0 runs them in the server process")
+    args = parser.parse_args()
+    configure(args)
+
+    # batch messages may carry thousands of windows, so don't cap the frame size.
+    start_server = websockets.serve(handle_request, args.host, args.port, max_size=None)
     asyncio.get_event_loop().run_until_complete(start_server)
 
-    print("listen at", sys.argv[1] + ":" + sys.argv[2])
+    print("listen at", args.host + ":" + str(args.port), "in %.2f sec" % (timer() - started))
     sys.stdout.flush()
 
+    if args.metrics_port:
+        metrics.serve_http(server_metrics, args.metrics_port)
+        print("metrics at http://127.0.0.1:%d/metrics" % args.metrics_port)
+
+    if args.workers > 0:
+        worker_pool = workers.WorkerPool(args.workers, args)
+        print("predicting on %d worker processes" % args.workers)
+
+    # import tf while the first clients connect (and maybe load numpy models, which don't need it)
+    start_tf_import()
+
     asyncio.get_event_loop().run_forever()
@@ -0,0 +1,188 @@
+"""Loaded models by name, sharing the ones loaded from the same file and evicting the idle ones over a memory budget."""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# binary frames address models by slot id: the slot in the low byte, and above it the generation of the slot
+# (how many times it was given to another name), so a client can't predict on a recycled slot by mistake.
+# buy and sell keep the slots they always had
+RESERVED_SLOTS = {"buy": 0, "sell": 1}
+MAX_SLOTS = 256
+SLOT_BITS = 8
+
+
+class ModelEntry:
+    def __init__(self, key, model, memory, digest):
+        self.key = key  # (path, size, mtime)
+        self.model = model
+        self.memory = memory
+        self.digest = digest  # sha1 of the file content
+        self.names = set()
+        self.users = 0  # predictions running right now. can't close the model meanwhile
+
+
+class ModelRegistry:
+    """
+    Models loaded by name. loader(path, digest) returns a model, which must have close(). digest is the sha1 of
+    the file content, for loaders that cache by it. Loading a file that is
+    already loaded (same path, size and mtime) reuses it instead of loading it again. When the memory of
+    the loaded files goes over memory_budget bytes, the least recently used models not in use are closed.
+    Thread safe, predictions use the models from the inference threads.
+    """
+
+    def __init__(self, loader, memory_budget):
+        self.loader = loader
+        self.memory_budget = memory_budget
+        self.entries = OrderedDict()  # key -> ModelEntry, least recently used first
+        self.names = {}  # name -> ModelEntry
+        self.slots = dict(RESERVED_SLOTS)  # name -> slot. kept after unload, so a reload gets the same slot
+        self.slot_names = {slot: name for name, slot in RESERVED_SLOTS.items()}
+        self.released = OrderedDict()  # unloaded names with a slot, oldest first. their slots are reused when full
+        self.generations = {}  # slot -> times it was reused
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def file_key(path):
+        stat = os.stat(path)
+        return os.path.abspath(path), stat.st_size, stat.st_mtime
+
+    @staticmethod
+    def file_digest(path):
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    def load(self, name, path):
+        """Loads path as name (replacing what name had). Returns (slot, cache hit)."""
+
+        key = self.file_key(path)
+        loaded = None
+        while True:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is None and loaded is not None:
+                    entry = self.entries[key] = loaded
+                elif entry is not None and loaded is not None:
+                    loaded.model.close()  # loaded by someone else meanwhile
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                    old = self.names.get(name)
+                    if old is not entry:
+                        if old is not None:
+                            self._release_name(name, old)
+                        self.names[name] = entry
+                        entry.names.add(name)
+                    self._evict(keep=entry)
+                    return self.slot(name), loaded is None
+            # not loaded, or evicted since. loading a tf model takes seconds, don't hold the predictions
+            # on the other models meanwhile
+            digest = self.file_digest(path)
+            loaded = ModelEntry(key, self.loader(path, digest), key[1], digest)
+
+    def unload(self, name):
+        with self.lock:
+            entry = self.names.get(name)
+            if entry is None:
+                raise LookupError("model '%s' not loaded" % name)
+            self._release_name(name, entry)
+
+    def slot(self, name):
+        """The slot id of name, giving it a slot if it has none."""
+
+        with self.lock:
+            if name in self.slots:
+                self.released.pop(name, None)
+                return self._slot_id(self.slots[name])
+
+            if len(self.slots) < MAX_SLOTS:
+                slot = len(self.slots)
+            elif self.released:
+                # reuse the slot of the name unloaded longest ago. the new generation makes its old id invalid
+                old_name, _ = self.released.popitem(last=False)
+                slot = self.slots.pop(old_name)
+                self.generations[slot] = self.generations.get(slot, 0) + 1
+            else:
+                raise ValueError("too many model names")
+            self.slots[name] = slot
+            self.slot_names[slot] = name
+            return self._slot_id(slot)
+
+    def name(self, slot_id):
+        with self.lock:
+            slot, generation = slot_id & (MAX_SLOTS - 1), slot_id >> SLOT_BITS
+            if slot not in self.slot_names:
+                raise LookupError("invalid slot %d" % slot_id)
+            if generation != self.generations.get(slot, 0):
+                raise LookupError("slot %d was given to another model, load the model again" % slot_id)
+            return self.slot_names[slot]
+
+    def digest(self, name):
+        """Hash of the file loaded as name."""
+
+        with self.lock:
+            entry = self.names.get(name)
+            if entry is None:
+                raise LookupError("model '%s' not loaded" % name)
+            return entry.digest
+
+    @contextmanager
+    def use(self, name):
+        """The model loaded as name, which won't be evicted until the block ends."""
+
+        with self.lock:
+            entry = self.names.get(name)
+            if entry is None:
+                raise LookupError("model '%s' not loaded" % name)
+            entry.users += 1
+            self.entries.move_to_end(entry.key)
+        try:
+            yield entry.model
+        finally:
+            with self.lock:
+                entry.users -= 1
+                if not entry.names and entry.users == 0 and self.entries.get(entry.key) is not entry:
+                    entry.model.close()
+
+    def list(self):
+        with self.lock:
+            return [{'name': name, 'slot': self._slot_id(self.slots[name]), 'path': entry.key[0], 'memory': entry.memory}
+                    for name, entry in sorted(self.names.items())]
+
+    @property
+    def memory(self):
+        with self.lock:
+            return sum(entry.memory for entry in self.entries.values())
+
+    def _slot_id(self, slot):
+        return slot | self.generations.get(slot, 0) << SLOT_BITS
+
+    def _release_name(self, name, entry):
+        del self.names[name]
+        self._release_slot(name)
+        entry.names.discard(name)
+        if not entry.names:
+            self._close(entry)
+
+    def _release_slot(self, name):
+        if name not in RESERVED_SLOTS:
+            self.released[name] = True
+
+    def _close(self, entry):
+        del self.entries[entry.key]
+        for name in entry.names:
+            del self.names[name]
+            self._release_slot(name)
+        entry.names.clear()
+        if entry.users == 0:
+            entry.model.close()
+        # otherwise, closed by the last user
+
+    def _evict(self, keep):
+        for entry in list(self.entries.values()):
+            if self.memory <= self.memory_budget:
+                break
+            if entry is not keep and entry.users == 0:
+                print("evicting idle model", entry.key[0])
+                self._close(entry)
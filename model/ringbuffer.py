@@ -0,0 +1,36 @@
+"""Fixed-size window over the latest rows of a stream, for incremental predictions."""
+
+import numpy
+
+
+class WindowRing:
+    """
+    Keeps the last timesteps rows pushed. Every row is stored twice, at i and i + timesteps, so the
+    window (oldest to newest) is always a contiguous slice: no copies nor rolls to read it.
+    """
+
+    def __init__(self, timesteps, features):
+        self.timesteps = timesteps
+        self.data = numpy.zeros((2 * timesteps, features), dtype=numpy.float32)
+        self.next = 0  # where the next row goes
+        self.count = 0
+
+    @property
+    def full(self):
+        return self.count == self.timesteps
+
+    def push(self, row):
+        self.data[self.next] = row
+        self.data[self.next + self.timesteps] = row
+        self.next = (self.next + 1) % self.timesteps
+        self.count = min(self.count + 1, self.timesteps)
+
+    def sync(self, window):
+        """Replaces the content with the (timesteps, features) window. Used to resync after a reconnect."""
+        self.data[:self.timesteps] = window
+        self.data[self.timesteps:] = window
+        self.next = 0
+        self.count = self.timesteps
+
+    def window(self):
+        return self.data[self.next:self.next + self.timesteps]
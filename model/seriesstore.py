@@ -0,0 +1,51 @@
+"""Per-tick predictions saved to disk, reused across server restarts."""
+
+import hashlib
+import os
+import threading
+import numpy
+from atomicfile import atomic_save
+
+
+class SeriesStore:
+    """
+    score_series results as .npy files under directory, named by a hash of (model file hash, features csv
+    hash, timesteps). Keys are content hashes, so a retrained model or changed candles never hit a stale file,
+    even if the csv was rewritten with the same content (as backtests do on each run).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.hashes = {}  # (path, size, mtime) -> content hash, so unchanged files aren't hashed again
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def file_hash(self, path):
+        stat = os.stat(path)
+        key = os.path.abspath(path), stat.st_size, stat.st_mtime
+        with self.lock:
+            if key in self.hashes:
+                return self.hashes[key]
+
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(2 ** 20), b''):
+                sha1.update(block)
+        with self.lock:
+            self.hashes[key] = sha1.hexdigest()
+        return self.hashes[key]
+
+    def path(self, model_digest, csv_path, timesteps):
+        key = "%s:%s:%d" % (model_digest, self.file_hash(csv_path), timesteps)
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + ".npy")
+
+    def get(self, model_digest, csv_path, timesteps):
+        """The stored predictions, or None."""
+
+        try:
+            return numpy.load(self.path(model_digest, csv_path, timesteps))
+        except (OSError, ValueError):
+            return None  # not stored yet, or a broken file
+
+    def put(self, model_digest, csv_path, timesteps, predictions):
+        atomic_save(self.path(model_digest, csv_path, timesteps), lambda tmp_path: numpy.save(tmp_path, predictions))
@@ -0,0 +1,135 @@
+"""
+Shared memory channel for clients on the same host (the JVM starts the server, so it always is). Requests and
+replies go through a memory mapped file instead of the websocket, so a prediction doesn't pay for the loopback
+socket, the framing and the copies on both sides.
+
+Layout, little-endian: the request seq (int64) and length (int32) at 0 and 8, the reply seq, length and status
+at 16, 24 and 28, and from DATA_OFFSET the request area and then the reply area, of half the rest each. The
+client writes a binary frame (same format as the websocket ones) in the request area, then its length and, last,
+a new request seq. The server predicts reading the floats in place, writes the predictions as float64 (or the
+error as utf-8, with status 1) in the reply area and then the reply seq, which the client waits for. One request
+at a time.
+"""
+
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from timeit import default_timer as timer
+import numpy
+
+SEQ = struct.Struct('<q')
+INT = struct.Struct('<i')
+REQUEST_SEQ, REQUEST_LENGTH, REPLY_SEQ, REPLY_LENGTH, REPLY_STATUS, DATA_OFFSET = 0, 8, 16, 24, 28, 64
+STATUS_OK, STATUS_ERROR = 0, 1
+MIN_SIZE, MAX_SIZE = 4096, 2 ** 30
+
+# after a request the server polls without sleeping for spin seconds. then it sleeps between checks, from
+# IDLE_SLEEP doubling up to MAX_IDLE_SLEEP seconds, so idle channels cost almost nothing
+DEFAULT_SPIN = 0.01
+IDLE_SLEEP = 0.0001
+MAX_IDLE_SLEEP = 0.005
+
+
+def default_directory():
+    """/dev/shm if there is one (so the file is never written to disk), else the temp directory."""
+
+    return "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+class ShmChannel:
+    """
+    A channel of size bytes on a new file, served by a thread that replies each request with
+    handle(frame), which receives the frame as a memoryview and returns the predictions.
+    """
+
+    def __init__(self, size, handle, spin=DEFAULT_SPIN, directory=None):
+        if not MIN_SIZE <= size <= MAX_SIZE:
+            raise ValueError("shared memory size must be between %d and %d bytes" % (MIN_SIZE, MAX_SIZE))
+        fd, self.path = tempfile.mkstemp(prefix="predictionserver-", suffix=".shm",
+                                         dir=directory or default_directory())
+        try:
+            os.ftruncate(fd, size)
+            self.memory = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.view = memoryview(self.memory)
+        self.capacity = (size - DATA_OFFSET) // 2
+        self.handle = handle
+        self.spin = spin
+        self.closed = False
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        seq, last_request, sleep = 0, timer(), IDLE_SLEEP
+        while not self.closed:
+            request_seq, = SEQ.unpack_from(self.memory, REQUEST_SEQ)
+            if request_seq == seq:
+                if timer() - last_request <= self.spin:
+                    time.sleep(0)  # still lets the event loop and the inference threads take the GIL
+                else:
+                    time.sleep(sleep)
+                    sleep = min(sleep * 2, MAX_IDLE_SLEEP)
+                continue
+            seq = request_seq
+            self.reply(seq, INT.unpack_from(self.memory, REQUEST_LENGTH)[0])
+            last_request, sleep = timer(), IDLE_SLEEP
+
+    def reply(self, seq, length):
+        try:
+            if not 0 < length <= self.capacity:
+                raise ValueError("invalid request length %d" % length)
+            values = numpy.asarray(self.handle(self.view[DATA_OFFSET:DATA_OFFSET + length]), dtype='<f8')
+            if values.nbytes > self.capacity:
+                raise ValueError("%d predictions don't fit in the reply area" % values.size)
+            status, data = STATUS_OK, values.tobytes()
+        except Exception as e:
+            status, data = STATUS_ERROR, str(e).encode()[:self.capacity]
+
+        offset = DATA_OFFSET + self.capacity
+        self.memory[offset:offset + len(data)] = data
+        INT.pack_into(self.memory, REPLY_LENGTH, len(data))
+        INT.pack_into(self.memory, REPLY_STATUS, status)
+        SEQ.pack_into(self.memory, REPLY_SEQ, seq)  # last, the client waits for it
+
+    def close(self):
+        self.closed = True
+        self.thread.join()
+        self.view.release()
+        self.memory.close()
+        os.remove(self.path)
+
+
+class ShmClient:
+    """The client side of a channel, like the one in TensorflowClient.kt. Used by the benchmark and the tests."""
+
+    def __init__(self, path):
+        with open(path, 'r+b') as f:
+            self.memory = mmap.mmap(f.fileno(), 0)
+        self.capacity = (len(self.memory) - DATA_OFFSET) // 2
+        self.seq = 0
+
+    def request(self, frame):
+        """Sends the binary frame and waits for its predictions. Raises RuntimeError with the server errors."""
+
+        if len(frame) > self.capacity:
+            raise ValueError("frame of %d bytes doesn't fit in the request area" % len(frame))
+        self.seq += 1
+        self.memory[DATA_OFFSET:DATA_OFFSET + len(frame)] = frame
+        INT.pack_into(self.memory, REQUEST_LENGTH, len(frame))
+        SEQ.pack_into(self.memory, REQUEST_SEQ, self.seq)  # last, the server waits for it
+
+        while SEQ.unpack_from(self.memory, REPLY_SEQ)[0] != self.seq:
+            time.sleep(0)  # let the server thread run, if it's in this process
+        length, = INT.unpack_from(self.memory, REPLY_LENGTH)
+        status, = INT.unpack_from(self.memory, REPLY_STATUS)
+        offset = DATA_OFFSET + self.capacity
+        if status != STATUS_OK:
+            raise RuntimeError(self.memory[offset:offset + length].decode())
+        return numpy.frombuffer(self.memory[offset:offset + length], dtype='<f8')
+
+    def close(self):
+        self.memory.close()
@@ -0,0 +1,37 @@
+"""tf.data input pipelines that stream windows from a feature matrix, for datasets larger than RAM."""
+
+import math
+import numpy
+import tensorflow as tf
+
+# max samples held by the shuffle buffer. bounds the memory used for shuffling.
+SHUFFLE_BUFFER_SIZE = 10000
+
+
+def window_dataset(windows, labels, batch_size, shuffle=True, shuffle_buffer=SHUFFLE_BUFFER_SIZE):
+    """
+    Returns (dataset, steps) where dataset repeats forever yielding (x, y) batches of the given windows
+    (usually a sliding_windows view, maybe over a memmap) and labels, and steps is the number of
+    batches per epoch. Only sample indices go through the shuffle buffer, the windows of each batch are
+    gathered on the fly, so peak memory is a few batches whatever the dataset length or timesteps.
+    """
+
+    sample_count = windows.shape[0]
+    timesteps, feature_count = windows.shape[1], windows.shape[2]
+
+    def gather(indices):
+        x = numpy.ascontiguousarray(windows[indices], dtype=numpy.float32)
+        y = numpy.ascontiguousarray(labels[indices], dtype=numpy.float32)
+        return x, y
+
+    def gather_batch(indices):
+        x, y = tf.py_func(gather, [indices], [tf.float32, tf.float32], stateful=False)
+        x.set_shape((None, timesteps, feature_count))
+        y.set_shape((None, 1))
+        return x, y
+
+    dataset = tf.data.Dataset.range(sample_count)
+    if shuffle:
+        dataset = dataset.shuffle(min(shuffle_buffer, sample_count), reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size).map(gather_batch).repeat().prefetch(1)
+    return dataset, int(math.ceil(sample_count / float(batch_size)))
@@ -0,0 +1,115 @@
+"""
+Hyperparameter sweeps: trains a model per combination of a parameter grid on parallel worker processes,
+scoring each on a time-ordered holdout, and ranks them.
+"""
+
+import itertools
+import multiprocessing
+import os
+import shutil
+import tempfile
+from timeit import default_timer as timer
+import numpy_model
+
+# grid parameters and their defaults, for the ones the grid doesn't list
+GRID_DEFAULTS = {'timesteps': [8], 'batch_size': [32], 'epochs': [10], 'rnn_type': ['gru']}
+
+
+def expand_grid(grid):
+    """The list of trials (dicts of parameter -> value) for every combination of the grid lists."""
+
+    unknown = set(grid) - set(GRID_DEFAULTS)
+    if unknown:
+        raise ValueError("unknown sweep parameters: %s" % ", ".join(sorted(unknown)))
+    grid = dict(GRID_DEFAULTS, **grid)
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def run_trial(args):
+    """Trains and scores one trial. Runs on a worker process, which has its own tf graph and session."""
+
+    csv_path, trial, val_split, threads, pb_path = args
+
+    # imported here so the parent doesn't need tf, and each worker sets up its own tf session
+    import tensorflow as tf
+    from dataset import load_csv
+    from windowing import holdout_split
+    import trainer
+
+    config = tf.ConfigProto(intra_op_parallelism_threads=threads, inter_op_parallelism_threads=threads)
+    tf.keras.backend.set_session(tf.Session(config=config))
+
+    start = timer()
+    dataset = load_csv(csv_path)  # maps the sidecar the parent built, so all workers share the same pages
+    x, y = trainer.training_data(dataset, trial['timesteps'])
+    x_train, y_train, x_val, y_val = holdout_split(x, y, val_split, trial['timesteps'])
+    model = trainer.build_model(trial['timesteps'], x.shape[2], trial['rnn_type'])
+    model.fit(x_train, y_train, epochs=trial['epochs'], batch_size=trial['batch_size'], verbose=0)
+    val_loss, val_acc = model.evaluate(x_val, y_val, batch_size=trial['batch_size'], verbose=0)
+    time = timer() - start
+
+    if pb_path is not None:
+        trainer.save_model(model, tf.keras.backend.get_session(), pb_path)
+    return dict(trial, val_loss=float(val_loss), val_acc=float(val_acc), time=time)
+
+
+def sweep(csv_path, grid, workers=None, val_split=0.2, save_path=None, notify=print):
+    """
+    Runs every trial of grid on csv_path with up to workers processes (default one per 2 cores), each one
+    limited to its share of the cpu threads. Returns the results sorted by validation loss, best first.
+    If save_path is given, the best model is saved there as train_save does. notify gets each finished trial.
+    """
+
+    from dataset import load_csv
+    load_csv(csv_path)  # build the memory-mapped sidecar once, before the workers map it
+
+    trials = expand_grid(grid)
+    cpus = os.cpu_count() or 1
+    workers = min(workers or max(1, cpus // 2), len(trials))
+    threads = max(1, cpus // workers)
+
+    tmp_dir = tempfile.mkdtemp(prefix="sweep") if save_path else None
+    pb_paths = [os.path.join(tmp_dir, "trial%d.pb" % i) if tmp_dir else None for i in range(len(trials))]
+    try:
+        # spawn, since tf doesn't survive a fork
+        with multiprocessing.get_context('spawn').Pool(workers) as pool:
+            results = []
+            args = [(csv_path, trial, val_split, threads, pb_path) for trial, pb_path in zip(trials, pb_paths)]
+            for i, result in enumerate(pool.imap(run_trial, args)):
+                result['pb_path'] = pb_paths[i]
+                results.append(result)
+                notify("trial %d/%d: %s" % (len(results), len(trials), format_result(result)))
+
+        results.sort(key=lambda result: result['val_loss'])
+        if save_path:
+            best = results[0]['pb_path']
+            shutil.copyfile(best, save_path)
+            shutil.copyfile(best + "_meta.json", save_path + "_meta.json")
+            if os.path.exists(numpy_model.npz_path(best)):
+                shutil.copyfile(numpy_model.npz_path(best), numpy_model.npz_path(save_path))
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    for result in results:
+        del result['pb_path']
+    return results
+
+
+def format_result(result):
+    return "timesteps %d, batch %d, epochs %d, %s: val loss %.4f, val acc %.3f, %.1f sec" % (
+        result['timesteps'], result['batch_size'], result['epochs'], result['rnn_type'],
+        result['val_loss'], result['val_acc'], result['time'])
+
+
+def format_table(results):
+    """The ranked results as a text table."""
+
+    lines = ["%4s %9s %6s %6s %4s %9s %7s %8s" % (
+        "rank", "timesteps", "batch", "epochs", "rnn", "val_loss", "val_acc", "time")]
+    for rank, result in enumerate(results, 1):
+        lines.append("%4d %9d %6d %6d %4s %9.4f %7.3f %8.1f" % (
+            rank, result['timesteps'], result['batch_size'], result['epochs'], result['rnn_type'],
+            result['val_loss'], result['val_acc'], result['time']))
+    return "\n".join(lines)
@@ -0,0 +1,44 @@
+import os
+
+import numpy
+import pytest
+
+from atomicfile import atomic_save
+
+
+def test_replaces_the_file(tmpdir):
+    path = str(tmpdir.join("a.npy"))
+    atomic_save(path, lambda tmp: numpy.save(tmp, numpy.arange(3)))
+    atomic_save(path, lambda tmp: numpy.save(tmp, numpy.arange(5)))
+    assert list(numpy.load(path)) == [0, 1, 2, 3, 4]
+    assert os.listdir(str(tmpdir)) == ["a.npy"]
+
+
+def test_failed_save_keeps_the_old_file(tmpdir):
+    path = str(tmpdir.join("a.json"))
+    atomic_save(path, lambda tmp: open(tmp, 'w').write("old"))
+
+    def fail(tmp):
+        with open(tmp, 'w') as f:
+            f.write("half")
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        atomic_save(path, fail)
+    assert open(path).read() == "old"
+    assert os.listdir(str(tmpdir)) == ["a.json"]
+
+
+def test_concurrent_saves_use_their_own_temp_file(tmpdir):
+    path = str(tmpdir.join("a.txt"))
+    temps = []
+
+    def outer(tmp):
+        temps.append(tmp)
+        atomic_save(path, lambda inner: temps.append(inner) or open(inner, 'w').write("inner"))
+        with open(tmp, 'w') as f:
+            f.write("outer")
+
+    atomic_save(path, outer)
+    assert temps[0] != temps[1]
+    assert open(path).read() == "outer"
@@ -0,0 +1,67 @@
+import asyncio
+import numpy
+from concurrent.futures import ThreadPoolExecutor
+
+from batching import MicroBatcher
+
+
+class Recorder:
+    def __init__(self):
+        self.batch_sizes = []
+
+    def __call__(self, array):
+        self.batch_sizes.append(array.shape[0])
+        return array.sum(axis=(1, 2))
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+def test_concurrent_requests_are_batched_in_order():
+    recorder = Recorder()
+
+    async def main():
+        batcher = MicroBatcher(recorder, ThreadPoolExecutor(1), max_delay=0.05, max_size=256)
+        windows = [numpy.full((3, 2), i, dtype=numpy.float32) for i in range(10)]
+        return await asyncio.gather(*[batcher.predict(w) for w in windows])
+
+    results = run(main())
+    assert list(results) == [i * 6.0 for i in range(10)]
+    assert recorder.batch_sizes == [10]
+
+
+def test_max_size_flushes_without_waiting():
+    recorder = Recorder()
+
+    async def main():
+        batcher = MicroBatcher(recorder, ThreadPoolExecutor(1), max_delay=10.0, max_size=4)
+        windows = [numpy.ones((2, 2)) for _ in range(8)]
+        return await asyncio.wait_for(asyncio.gather(*[batcher.predict(w) for w in windows]), 5.0)
+
+    assert list(run(main())) == [4.0] * 8
+    assert recorder.batch_sizes == [4, 4]
+
+
+def test_different_shapes_run_separately():
+    recorder = Recorder()
+
+    async def main():
+        batcher = MicroBatcher(recorder, ThreadPoolExecutor(1), max_delay=0.01)
+        return await asyncio.gather(batcher.predict(numpy.ones((3, 2))), batcher.predict(numpy.ones((4, 2))))
+
+    assert list(run(main())) == [6.0, 8.0]
+    assert sorted(recorder.batch_sizes) == [1, 1]
+
+
+def test_errors_reach_every_caller():
+    def failing(array):
+        raise RuntimeError("not initialized")
+
+    async def main():
+        batcher = MicroBatcher(failing, ThreadPoolExecutor(1), max_delay=0.01)
+        return await asyncio.gather(batcher.predict(numpy.ones((1, 1))), batcher.predict(numpy.ones((1, 1))),
+                                    return_exceptions=True)
+
+    results = run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
@@ -0,0 +1,48 @@
+import numpy
+
+from cache import PredictionCache
+
+
+class CountingModel:
+    def __init__(self):
+        self.predicted = 0
+
+    def predict(self, array):
+        self.predicted += array.shape[0]
+        return array.sum(axis=(1, 2))
+
+
+def test_repeated_windows_are_not_predicted_again():
+    cache, model = PredictionCache(100), CountingModel()
+    x = numpy.random.RandomState(0).rand(10, 3, 2)
+    first = cache.predict(("buy", "abc"), model, x)
+    second = cache.predict(("buy", "abc"), model, x[::-1])
+    assert numpy.allclose(first, x.astype(numpy.float32).sum(axis=(1, 2)))
+    assert numpy.array_equal(second, first[::-1])
+    assert model.predicted == 10
+    assert cache.stats()['hits'] == 10 and cache.stats()['misses'] == 10
+
+
+def test_model_key_is_part_of_the_key():
+    cache, model = PredictionCache(100), CountingModel()
+    x = numpy.ones((1, 2, 2))
+    cache.predict(("buy", "abc"), model, x)
+    cache.predict(("buy", "def"), model, x)
+    assert model.predicted == 2
+
+
+def test_bounded_and_invalidated():
+    cache, model = PredictionCache(5), CountingModel()
+    cache.predict(("buy", "abc"), model, numpy.random.RandomState(1).rand(8, 2, 2))
+    assert cache.stats()['size'] == 5
+    cache.predict(("sell", "abc"), model, numpy.ones((1, 2, 2)))
+    cache.invalidate("buy")
+    assert cache.stats()['size'] == 1
+
+
+def test_window_shape_is_part_of_the_key():
+    cache, model = PredictionCache(100), CountingModel()
+    x = numpy.arange(4).reshape((1, 4, 1))
+    cache.predict(("buy", "abc"), model, x)
+    cache.predict(("buy", "abc"), model, x.reshape((1, 2, 2)))  # same bytes
+    assert model.predicted == 2
@@ -0,0 +1,70 @@
+import os
+
+import numpy
+import pytest
+
+import dataset
+from dataset import load_csv, sidecar_path
+
+
+@pytest.fixture
+def parses(monkeypatch):
+    """The csv paths parsed as text, instead of loaded from their sidecar."""
+
+    parsed = []
+    loadtxt = numpy.loadtxt
+
+    def counting_loadtxt(path, *args, **kwargs):
+        parsed.append(path)
+        return loadtxt(path, *args, **kwargs)
+
+    monkeypatch.setattr(dataset.numpy, "loadtxt", counting_loadtxt)
+    return parsed
+
+
+def write_csv(tmpdir, text="1,2,3\n4,5,6\n"):
+    csv = tmpdir.join("train.csv")
+    csv.write(text)
+    return str(csv)
+
+
+def test_sidecar_is_reused(tmpdir, parses):
+    path = write_csv(tmpdir)
+    first = load_csv(path)
+    assert first.dtype == numpy.float32 and first.tolist() == [[1, 2, 3], [4, 5, 6]]
+    assert os.path.exists(sidecar_path(path))
+
+    again = load_csv(path)
+    assert isinstance(again, numpy.memmap)
+    assert again.tolist() == first.tolist()
+    assert parses == [path]
+
+
+def test_rebuilt_when_the_csv_changes(tmpdir, parses):
+    path = write_csv(tmpdir)
+    load_csv(path)
+
+    write_csv(tmpdir, "1,2,3\n4,5,6\n7,8,9\n")  # other size
+    assert load_csv(path).tolist() == [[1, 2, 3], [4, 5, 6], [7, 8, 9]]
+
+    write_csv(tmpdir, "9,8,7\n6,5,4\n3,2,1\n")  # same size, other mtime
+    os.utime(path, (0, 0))
+    assert load_csv(path).tolist() == [[9, 8, 7], [6, 5, 4], [3, 2, 1]]
+    assert len(parses) == 3
+
+
+@pytest.mark.parametrize("meta", [None, "{\"path\": ", "[]"])
+def test_rebuilt_without_a_valid_meta(tmpdir, parses, meta):
+    path = write_csv(tmpdir)
+    load_csv(path)
+    meta_path = sidecar_path(path) + "_meta.json"
+    if meta is None:
+        os.remove(meta_path)
+    else:
+        with open(meta_path, 'w') as f:
+            f.write(meta)
+
+    assert load_csv(path).tolist() == [[1, 2, 3], [4, 5, 6]]
+    assert len(parses) == 2
+    load_csv(path)
+    assert len(parses) == 2  # the meta is valid again
@@ -0,0 +1,58 @@
+import threading
+
+import metrics
+from metrics import Histogram, Metrics
+
+
+def test_histogram_percentiles():
+    histogram = Histogram()
+    for _ in range(98):
+        histogram.observe(0.0004)
+    histogram.observe(0.02)
+    histogram.observe(20)
+    assert histogram.percentile(50) == 0.0005
+    assert histogram.percentile(99) == 0.025
+    assert histogram.percentile(100) == float('inf')
+    assert histogram.summary()['count'] == 100
+
+
+def test_snapshot_and_text():
+    m = Metrics()
+    m.count("buy_predict")
+    m.count("buy_predict", error=True)
+    m.observe("buy_predict", "run", 0.002)
+    m.gauge("queue_depth", lambda: 3)
+    snapshot = m.snapshot()
+    assert snapshot['messages']['buy_predict']['count'] == 2
+    assert snapshot['messages']['buy_predict']['errors'] == 1
+    assert snapshot['messages']['buy_predict']['latency']['run']['count'] == 1
+    assert snapshot['gauges'] == {'queue_depth': 3}
+
+    text = m.text()
+    assert 'predictionserver_messages_total{type="buy_predict"} 2' in text
+    assert 'predictionserver_latency_seconds_bucket{type="buy_predict",phase="run",le="+Inf"} 1' in text
+    assert 'predictionserver_queue_depth 3.0' in text
+
+
+def test_run_time_is_per_thread():
+    metrics.add_run_time(0.5)
+    other = []
+    thread = threading.Thread(target=lambda: other.append(metrics.take_run_time()))
+    thread.start()
+    thread.join()
+    assert other == [0.0]
+    assert metrics.take_run_time() == 0.5
+    assert metrics.take_run_time() == 0.0
+
+
+def test_serve_http():
+    from urllib.request import urlopen
+
+    m = Metrics()
+    m.count("ping")
+    server = metrics.serve_http(m, 0)
+    try:
+        body = urlopen("http://127.0.0.1:%d/metrics" % server.server_address[1]).read().decode()
+        assert 'predictionserver_messages_total{type="ping"} 1' in body
+    finally:
+        server.shutdown()
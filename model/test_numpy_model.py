@@ -0,0 +1,70 @@
+import numpy
+import pytest
+
+from numpy_model import NumpyModel, ACTIVATIONS, export_keras
+
+
+def random_weights(features, units, reset_after, recurrent_activation='hard_sigmoid', seed=0):
+    rnd = numpy.random.RandomState(seed)
+    bias_shape = (2, 3 * units) if reset_after else (3 * units,)
+    return {
+        'gru_kernel': rnd.randn(features, 3 * units).astype(numpy.float32) * 0.5,
+        'gru_recurrent_kernel': rnd.randn(units, 3 * units).astype(numpy.float32) * 0.5,
+        'gru_bias': rnd.randn(*bias_shape).astype(numpy.float32) * 0.1,
+        'recurrent_activation': numpy.array(recurrent_activation),
+        'dense_kernel': rnd.randn(units, 8).astype(numpy.float32),
+        'dense_bias': rnd.randn(8).astype(numpy.float32),
+        'dense_activation': numpy.array('relu'),
+        'output_kernel': rnd.randn(8, 1).astype(numpy.float32),
+        'output_bias': rnd.randn(1).astype(numpy.float32),
+        'output_activation': numpy.array('sigmoid'),
+    }
+
+
+def reference_predict(w, window):
+    """One sample, one gate at a time, straight from the keras GRU equations."""
+
+    units = w['gru_recurrent_kernel'].shape[0]
+    act = ACTIVATIONS[str(w['recurrent_activation'])]
+    reset_after = w['gru_bias'].ndim == 2
+    b_in = w['gru_bias'][0] if reset_after else w['gru_bias']
+    b_rec = w['gru_bias'][1] if reset_after else numpy.zeros(3 * units)
+    k, rk = w['gru_kernel'], w['gru_recurrent_kernel']
+    h = numpy.zeros(units)
+    for x in window:
+        gate = [x.dot(k[:, i * units:(i + 1) * units]) + b_in[i * units:(i + 1) * units] for i in range(3)]
+        rec = [h.dot(rk[:, i * units:(i + 1) * units]) + b_rec[i * units:(i + 1) * units] for i in range(3)]
+        z = act(gate[0] + rec[0])
+        r = act(gate[1] + rec[1])
+        if reset_after:
+            hh = numpy.tanh(gate[2] + r * rec[2])
+        else:
+            hh = numpy.tanh(gate[2] + (r * h).dot(rk[:, 2 * units:]))
+        h = z * h + (1 - z) * hh
+    dense = numpy.maximum(h.dot(w['dense_kernel']) + w['dense_bias'], 0)
+    return 1 / (1 + numpy.exp(-(dense.dot(w['output_kernel']) + w['output_bias'])[0]))
+
+
+@pytest.mark.parametrize("reset_after", [False, True])
+@pytest.mark.parametrize("recurrent_activation", ['hard_sigmoid', 'sigmoid'])
+def test_batched_forward_matches_reference(reset_after, recurrent_activation):
+    w = random_weights(5, 16, reset_after, recurrent_activation)
+    x = numpy.random.RandomState(1).rand(20, 7, 5).astype(numpy.float32)
+    predictions = NumpyModel(w).predict(x)
+    expected = [reference_predict(w, window) for window in x]
+    assert numpy.allclose(predictions, expected, atol=1e-5)
+
+
+def test_matches_keras(tmpdir):
+    tf = pytest.importorskip("tensorflow")
+    model = tf.keras.models.Sequential()
+    model.add(tf.keras.layers.GRU(32, input_shape=(7, 5)))
+    model.add(tf.keras.layers.Dropout(0.2))
+    model.add(tf.keras.layers.Dense(32, activation='relu'))
+    model.add(tf.keras.layers.Dense(1, activation='sigmoid'))
+    path = str(tmpdir.join("model.npz"))
+    export_keras(model, path)
+
+    x = numpy.random.RandomState(2).rand(50, 7, 5).astype(numpy.float32)
+    expected = model.predict(x)[:, 0]
+    assert numpy.allclose(NumpyModel.load(path).predict(x), expected, atol=1e-5)
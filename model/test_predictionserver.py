@@ -0,0 +1,131 @@
+import asyncio
+import threading
+
+import numpy
+import pytest
+
+pytest.importorskip("websockets")
+import predictionserver
+from numpy_model import NumpyModel
+from registry import ModelRegistry
+from test_numpy_model import random_weights
+
+
+class FakeSocket:
+    """Replies each message of msgs, in order, and then says bye."""
+
+    def __init__(self, msgs):
+        self.msgs = list(msgs) + ["bye"]
+        self.sent = []
+
+    async def recv(self):
+        return self.msgs.pop(0)
+
+    async def send(self, text):
+        self.sent.append(text)
+
+
+def serve(msgs, streams=None):
+    socket = FakeSocket(msgs)
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(predictionserver.serve_connection(socket, None, {} if streams is None else streams))
+    finally:
+        loop.close()
+    return socket.sent
+
+
+def test_train_messages_wait_for_tf_off_the_event_loop(monkeypatch):
+    threads = []
+    monkeypatch.setattr(predictionserver, "require_tf", lambda: threads.append(threading.current_thread()))
+    assert serve(["train_save:model.pb"]) == ["error: model not initialized"]
+    assert threads and threads[0] is not threading.main_thread()
+
+
+@pytest.fixture
+def server(tmpdir, monkeypatch):
+    """predictionserver with fresh models, and an .npz gru model of 3 features loaded as 'buy'."""
+
+    monkeypatch.setattr(predictionserver, "models",
+                        ModelRegistry(predictionserver.load_model, memory_budget=2 ** 30))
+    path = str(tmpdir.join("model.npz"))
+    numpy.savez(path, **random_weights(3, 8, True))
+    assert predictionserver.process("buy_load", path) == "ok"
+    return NumpyModel.load(path)
+
+
+def windows(count, timesteps=4, seed=0):
+    return numpy.random.RandomState(seed).rand(count, timesteps, 3).astype(numpy.float32)
+
+
+def frame(msg_type, slot, array):
+    count, timesteps, features = array.shape
+    return predictionserver.BINARY_HEADER.pack(msg_type, slot, timesteps, features, count) + array.astype('<f4').tobytes()
+
+
+def test_binary_header():
+    header = predictionserver.BINARY_HEADER
+    packed = header.pack(predictionserver.BINARY_PREDICT_BATCH, 258, 30, 7, 1000)
+    assert len(packed) == header.size == 13
+    assert header.unpack_from(packed + b'payload') == (predictionserver.BINARY_PREDICT_BATCH, 258, 30, 7, 1000)
+
+
+def test_binary_predict(server):
+    x = windows(1)
+    replies = serve([frame(predictionserver.BINARY_PREDICT, predictionserver.SLOT_BUY, x)])
+    assert float(replies[0]) == pytest.approx(server.predict(x)[0], abs=1e-6)
+
+
+def test_binary_predict_batch(server):
+    x = windows(5)
+    replies = serve([frame(predictionserver.BINARY_PREDICT_BATCH, predictionserver.SLOT_BUY, x)])
+    assert [float(p) for p in replies[0].split(",")] == pytest.approx(list(server.predict(x)), abs=1e-6)
+
+
+def test_malformed_binary_frames(server):
+    good = frame(predictionserver.BINARY_PREDICT_BATCH, predictionserver.SLOT_BUY, windows(2))
+    replies = serve([
+        b'\x01\x00',  # shorter than the header
+        good[:-4],  # the header says more values than the payload has
+        b'\x09' + good[1:],  # unknown message type
+        frame(predictionserver.BINARY_PREDICT, 200, windows(1)),  # no model at the slot
+        good,  # and the connection still works
+    ])
+    assert all(reply.startswith("error: ") for reply in replies[:4]), replies
+    assert len(replies[4].split(",")) == 2
+
+
+def test_score_series(server, tmpdir, monkeypatch):
+    monkeypatch.setattr(predictionserver, "SERIES_CHUNK_SIZE", 3)  # so the series takes a few chunks
+    features = numpy.random.RandomState(3).rand(12, 3)
+    csv_path, out_path = str(tmpdir.join("features.csv")), str(tmpdir.join("scores.npy"))
+    numpy.savetxt(csv_path, features, delimiter=",")
+
+    assert serve(["buy_score_series:%s,4,%s" % (csv_path, out_path)]) == ["ok"]
+    scores = numpy.load(out_path)
+    assert scores.shape == (12,)
+    assert numpy.isnan(scores[:3]).all()
+    expected = [server.predict(features[i - 3:i + 1][numpy.newaxis])[0] for i in range(3, 12)]
+    assert scores[3:] == pytest.approx(expected, abs=1e-6)
+
+
+def test_streams(server):
+    x = windows(2, timesteps=2)
+    rows = [",".join(str(v) for v in row) for row in x.reshape(-1, 3)]
+    streams = {}
+    replies = serve(["stream_open:buy,2,3", "stream_push:0:" + rows[0], "stream_push:0:" + rows[1],
+                     frame(predictionserver.BINARY_STREAM_PUSH, 0, x[1, :1][numpy.newaxis]),
+                     "stream_open:buy,2,3", "stream_close:0", "stream_push:0:" + rows[0]], streams)
+    assert replies[:2] == ["ok:0", "NaN"]  # no whole window yet
+    assert float(replies[2]) == pytest.approx(server.predict(x[:1])[0], abs=1e-6)
+    window = numpy.stack([x[0, 1], x[1, 0]])  # the oldest row dropped
+    assert float(replies[3]) == pytest.approx(server.predict(window[numpy.newaxis])[0], abs=1e-6)
+    assert replies[4:6] == ["ok:1", "ok"]
+    assert replies[6] == "error: unknown stream 0"
+    assert list(streams) == [1]
+
+
+def test_stream_ids_run_out(server):
+    replies = serve(["stream_open:buy,2,3"] * (predictionserver.MAX_STREAMS + 1))
+    assert replies[-2] == "ok:%d" % (predictionserver.MAX_STREAMS - 1)
+    assert replies[-1] == "error: too many streams open"
@@ -0,0 +1,170 @@
+import hashlib
+import threading
+
+import pytest
+
+from registry import ModelRegistry, MAX_SLOTS, SLOT_BITS
+
+
+class FakeModel:
+    def __init__(self, path):
+        self.path = path
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class CountingLoader:
+    def __init__(self):
+        self.loaded = []
+        self.digests = []
+
+    def __call__(self, path, digest):
+        self.loaded.append(path)
+        self.digests.append(digest)
+        return FakeModel(path)
+
+
+def model_file(tmpdir, name, size):
+    path = str(tmpdir.join(name))
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    return path
+
+
+def test_same_file_is_a_cache_hit(tmpdir):
+    loader = CountingLoader()
+    registry = ModelRegistry(loader, memory_budget=1000)
+    path = model_file(tmpdir, "a.pb", 10)
+    assert registry.load("buy", path) == (0, False)
+    assert registry.load("other", path) == (2, True)
+    assert loader.loaded == [path]
+    assert loader.digests == [hashlib.sha1(b'x' * 10).hexdigest()] == [registry.digest("other")]
+    with registry.use("buy") as a, registry.use("other") as b:
+        assert a is b
+
+
+def test_changed_file_is_loaded_again(tmpdir):
+    loader = CountingLoader()
+    registry = ModelRegistry(loader, memory_budget=1000)
+    path = model_file(tmpdir, "a.pb", 10)
+    registry.load("buy", path)
+    with registry.use("buy") as old:
+        pass
+    model_file(tmpdir, "a.pb", 20)
+    assert registry.load("buy", path)[1] is False
+    assert old.closed
+    assert len(loader.loaded) == 2
+
+
+def test_least_recently_used_is_evicted(tmpdir):
+    registry = ModelRegistry(CountingLoader(), memory_budget=25)
+    a, b, c = [model_file(tmpdir, n, 10) for n in ("a.pb", "b.pb", "c.pb")]
+    registry.load("a", a)
+    registry.load("b", b)
+    with registry.use("a"):
+        pass
+    registry.load("c", c)
+    assert [m['name'] for m in registry.list()] == ["a", "c"]
+    with pytest.raises(LookupError):
+        with registry.use("b"):
+            pass
+
+
+def test_models_in_use_are_not_closed(tmpdir):
+    registry = ModelRegistry(CountingLoader(), memory_budget=1000)
+    registry.load("a", model_file(tmpdir, "a.pb", 10))
+    with registry.use("a") as model:
+        registry.unload("a")
+        assert not model.closed
+    assert model.closed
+    assert registry.list() == []
+
+
+def test_slots_are_stable(tmpdir):
+    registry = ModelRegistry(CountingLoader(), memory_budget=1000)
+    path = model_file(tmpdir, "a.pb", 10)
+    assert registry.load("sell", path)[0] == 1
+    slot = registry.load("x", path)[0]
+    registry.unload("x")
+    assert registry.load("x", path)[0] == slot
+    assert registry.name(slot) == "x"
+
+
+def test_model_closed_if_reloaded_while_in_use(tmpdir):
+    registry = ModelRegistry(CountingLoader(), memory_budget=1000)
+    path = model_file(tmpdir, "a.pb", 10)
+    registry.load("a", path)
+    with registry.use("a") as old:
+        registry.unload("a")
+        registry.load("a", path)  # same file key, new entry
+    assert old.closed
+    with registry.use("a") as new:
+        assert new is not old and not new.closed
+
+
+def test_slots_are_reused_when_full(tmpdir):
+    registry = ModelRegistry(CountingLoader(), memory_budget=10 ** 6)
+    path = model_file(tmpdir, "a.pb", 10)
+    names = ["m%d" % i for i in range(MAX_SLOTS - 2)]
+    for name in names:
+        registry.load(name, path)
+    with pytest.raises(ValueError):
+        registry.load("another", path)
+
+    registry.unload("m5")
+    registry.unload("m3")
+    slot = registry.load("another", path)[0]
+    assert slot == 7 | 1 << SLOT_BITS  # m5's slot, the one unloaded first, in its second generation
+    assert registry.name(slot) == "another"
+    with pytest.raises(LookupError):
+        registry.name(7)  # m5's old slot id doesn't predict on another by mistake
+    assert registry.load("m3", path)[0] == 5  # still had its slot
+
+
+def test_loads_dont_block_other_models(tmpdir):
+    loading, release = threading.Event(), threading.Event()
+
+    def slow_loader(path, digest):
+        if path.endswith("slow.pb"):
+            loading.set()
+            release.wait(5)
+        return FakeModel(path)
+
+    registry = ModelRegistry(slow_loader, memory_budget=1000)
+    registry.load("a", model_file(tmpdir, "a.pb", 10))
+    thread = threading.Thread(target=registry.load, args=("slow", model_file(tmpdir, "slow.pb", 10)))
+    thread.start()
+    assert loading.wait(5)
+    with registry.use("a") as model:  # would wait for the slow load if it held the lock
+        assert not model.closed
+    release.set()
+    thread.join()
+    assert [m['name'] for m in registry.list()] == ["a", "slow"]
+
+
+
+def test_concurrent_loads_of_a_file_share_it(tmpdir):
+    loading, release = threading.Event(), threading.Event()
+    loaded = []
+
+    def slow_loader(path, digest):
+        model = FakeModel(path)
+        loaded.append(model)
+        if len(loaded) == 1:
+            loading.set()
+            release.wait(5)
+        return model
+
+    registry = ModelRegistry(slow_loader, memory_budget=1000)
+    path = model_file(tmpdir, "a.pb", 10)
+    thread = threading.Thread(target=registry.load, args=("a", path))
+    thread.start()
+    assert loading.wait(5)
+    registry.load("b", path)  # loads it too, the first load is still running
+    release.set()
+    thread.join()
+    with registry.use("a") as a, registry.use("b") as b:
+        assert a is b is loaded[1]
+    assert loaded[0].closed
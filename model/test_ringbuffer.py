@@ -0,0 +1,23 @@
+import numpy
+
+from ringbuffer import WindowRing
+
+
+def test_window_has_the_last_rows_in_order():
+    ring = WindowRing(3, 2)
+    rows = numpy.arange(20, dtype=numpy.float32).reshape(10, 2)
+    for i, row in enumerate(rows):
+        ring.push(row)
+        assert ring.full == (i >= 2)
+        if ring.full:
+            assert numpy.array_equal(ring.window(), rows[i - 2:i + 1])
+
+
+def test_sync_then_push():
+    ring = WindowRing(4, 1)
+    window = numpy.arange(4, dtype=numpy.float32).reshape(4, 1)
+    ring.sync(window)
+    assert ring.full
+    assert numpy.array_equal(ring.window(), window)
+    ring.push([9])
+    assert numpy.array_equal(ring.window()[:, 0], [1, 2, 3, 9])
@@ -0,0 +1,26 @@
+import os
+import numpy
+
+from seriesstore import SeriesStore
+
+
+def test_reused_while_the_content_is_the_same(tmpdir):
+    store = SeriesStore(str(tmpdir.join("store")))
+    csv = tmpdir.join("features.csv")
+    csv.write("1,2\n3,4\n")
+    predictions = numpy.array([numpy.nan, 0.5])
+
+    assert store.get("model", str(csv), 2) is None
+    store.put("model", str(csv), 2, predictions)
+    assert numpy.array_equal(store.get("model", str(csv), 2), predictions, equal_nan=True)
+
+    # rewritten with the same content, as backtests do
+    csv.write("1,2\n3,4\n")
+    os.utime(str(csv), (0, 0))
+    assert store.get("model", str(csv), 2) is not None
+
+    assert store.get("other model", str(csv), 2) is None
+    assert store.get("model", str(csv), 3) is None
+    csv.write("1,2\n3,5\n")
+    os.utime(str(csv), (1, 1))
+    assert store.get("model", str(csv), 2) is None
@@ -0,0 +1,42 @@
+import struct
+
+import numpy
+import pytest
+
+from shm import ShmChannel, ShmClient
+
+
+def test_round_trip_reads_the_frame_in_place(tmp_path):
+    def handle(frame):
+        count, = struct.unpack_from('<I', frame)
+        return numpy.frombuffer(frame, dtype='<f4', count=count, offset=4) * 2
+
+    channel = ShmChannel(8192, handle, directory=str(tmp_path))
+    client = ShmClient(channel.path)
+    try:
+        for values in ([1.5], [0.25, -3, 8]):
+            frame = struct.pack('<I', len(values)) + numpy.array(values, dtype='<f4').tobytes()
+            assert client.request(frame).tolist() == [v * 2 for v in values]
+    finally:
+        client.close()
+        channel.close()
+
+
+def test_errors_and_limits(tmp_path):
+    def handle(frame):
+        raise ValueError("unknown stream %d" % frame[0])
+
+    channel = ShmChannel(8192, handle, directory=str(tmp_path))
+    client = ShmClient(channel.path)
+    try:
+        with pytest.raises(RuntimeError, match="unknown stream 7"):
+            client.request(b'\x07')
+        with pytest.raises(ValueError):
+            client.request(bytes(client.capacity + 1))
+    finally:
+        client.close()
+        channel.close()
+    assert not list(tmp_path.iterdir())
+
+    with pytest.raises(ValueError):
+        ShmChannel(16, handle, directory=str(tmp_path))
@@ -0,0 +1,21 @@
+import pytest
+
+from sweep import expand_grid, format_table
+
+
+def test_expand_grid():
+    trials = expand_grid({'timesteps': [4, 8], 'rnn_type': ['gru', 'lstm']})
+    assert len(trials) == 4
+    assert {'timesteps': 8, 'rnn_type': 'lstm', 'batch_size': 32, 'epochs': 10} in trials
+
+
+def test_expand_grid_unknown_parameter():
+    with pytest.raises(ValueError):
+        expand_grid({'timestep': [4]})
+
+
+def test_format_table():
+    results = [{'timesteps': 4, 'batch_size': 32, 'epochs': 10, 'rnn_type': 'gru',
+                'val_loss': 0.5, 'val_acc': 0.75, 'time': 12.5}]
+    lines = format_table(results).splitlines()
+    assert len(lines) == 2 and lines[1].split() == ['1', '4', '32', '10', 'gru', '0.5000', '0.750', '12.5']
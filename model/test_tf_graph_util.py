@@ -0,0 +1,246 @@
+"""
+Checks the frozen graphs of tf_graph_util are byte-identical to the ones of its implementation before it was sped
+up (copied below, as it was), which is what the existing .pb models were saved with.
+"""
+
+import copy
+
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+import six
+from tensorflow.core.framework import attr_value_pb2
+from tensorflow.core.framework import graph_pb2
+from tensorflow.core.framework import node_def_pb2
+from tensorflow.python.framework import tensor_util
+from tensorflow.python.platform import tf_logging as logging
+
+import tf_graph_util
+from tf_graph_util import _assert_nodes_are_present, _bfs_for_reachable_nodes, _extract_graph_summary, _node_name
+
+
+def old_extract_sub_graph(graph_def, dest_nodes):
+    """Extract the subgraph that can reach any of the nodes in 'dest_nodes'.
+    Args:
+      graph_def: A graph_pb2.GraphDef proto.
+      dest_nodes: A list of strings specifying the destination node names.
+    Returns:
+      The GraphDef of the sub-graph.
+    Raises:
+      TypeError: If 'graph_def' is not a graph_pb2.GraphDef proto.
+    """
+
+    if not isinstance(graph_def, graph_pb2.GraphDef):
+        raise TypeError("graph_def must be a graph_pb2.GraphDef proto.")
+
+    if isinstance(dest_nodes, six.string_types):
+        raise TypeError("dest_nodes must be a list.")
+
+    name_to_input_name, name_to_node, name_to_seq_num = _extract_graph_summary(
+        graph_def)
+    _assert_nodes_are_present(name_to_node, dest_nodes)
+
+    nodes_to_keep = _bfs_for_reachable_nodes(dest_nodes, name_to_input_name)
+
+    nodes_to_keep_list = sorted(
+        list(nodes_to_keep), key=lambda n: name_to_seq_num[n])
+    # Now construct the output GraphDef
+    out = graph_pb2.GraphDef()
+    for n in nodes_to_keep_list:
+        out.node.extend([copy.deepcopy(name_to_node[n])])
+    out.library.CopyFrom(graph_def.library)
+    out.versions.CopyFrom(graph_def.versions)
+
+    return out
+
+
+def old_convert_variables_to_constants(sess,
+                                       input_graph_def,
+                                       output_node_names,
+                                       variable_names_whitelist=None,
+                                       variable_names_blacklist=None):
+    """Replaces all the variables in a graph with constants of the same values.
+    If you have a trained graph containing Variable ops, it can be convenient to
+    convert them all to Const ops holding the same values. This makes it possible
+    to describe the network fully with a single GraphDef file, and allows the
+    removal of a lot of ops related to loading and saving the variables.
+    Args:
+      sess: Active TensorFlow session containing the variables.
+      input_graph_def: GraphDef object holding the network.
+      output_node_names: List of name strings for the result nodes of the graph.
+      variable_names_whitelist: The set of variable names to convert (by default,
+                                all variables are converted).
+      variable_names_blacklist: The set of variable names to omit converting
+                                to constants.
+    Returns:
+      GraphDef containing a simplified version of the original.
+    """
+
+    def trace_back_find_variable(origin_name, name_to_nodes):
+
+        nodes_in_path = set()
+        control_ops = ["Enter", "Exit", "NextIteration", "Switch"]
+
+        current_name = origin_name
+        while name_to_nodes[current_name].op != "VarHandleOp":
+            nodes_in_path.add(current_name)
+            current_node = name_to_nodes[current_name]
+            op_name = current_node.op
+            if op_name in control_ops or op_name == "Identity":
+                curr_input_name = _node_name(current_node.input[0])
+            else:
+                raise ValueError("Op type %s should not be in the path " +
+                                 "between ReadVariableOp and VarHandleOp" % current_node.op)
+            current_name = curr_input_name
+
+        return current_name, nodes_in_path
+
+    def create_const_op(node_name, dtype, data, data_shape=None):
+        """Creates a Const op."""
+        output_node = node_def_pb2.NodeDef()
+        output_node.op = "Const"
+        output_node.name = node_name
+        output_node.attr["dtype"].CopyFrom(dtype)
+        output_node.attr["value"].CopyFrom(
+            attr_value_pb2.AttrValue(
+                tensor=tensor_util.make_tensor_proto(
+                    data, dtype=dtype.type, shape=data_shape)))
+        return output_node
+
+    # This graph only includes the nodes needed to evaluate the output nodes, and
+    # removes unneeded nodes like those involved in saving and assignment.
+    inference_graph = old_extract_sub_graph(input_graph_def, output_node_names)
+
+    # Identify the ops in the graph.
+    map_name_to_node = {
+        node.name: node for node in inference_graph.node
+    }
+
+    # Get list of variables.
+    variable_names = []
+    variable_dict_names = []
+    resource_identity_types = {}
+    read_variable_op_types = {}
+    for node in inference_graph.node:
+        if node.op in ["Variable", "VariableV2", "VarHandleOp"]:
+            variable_name = node.name
+            if ((variable_names_whitelist is not None
+                 and variable_name not in variable_names_whitelist)
+                    or (variable_names_blacklist is not None
+                        and variable_name in variable_names_blacklist)):
+                continue
+            variable_dict_names.append(variable_name)
+            if node.op == "VarHandleOp":
+                variable_names.append(variable_name + "/Read/ReadVariableOp:0")
+            else:
+                variable_names.append(variable_name + ":0")
+        elif node.op in ["ReadVariableOp", "ResourceGather", "VariableShape"]:
+            # There can be one or more Identity or control flow ops in between the ReadVariableOp
+            # and VarHandleOp.  Store them with the associated dtypes.
+            source_op_name, nodes_in_path = trace_back_find_variable(_node_name(node.input[0]),
+                                                                     map_name_to_node)
+            dtype = map_name_to_node[source_op_name].attr["dtype"]
+            for node_name in nodes_in_path:
+                resource_identity_types[node_name] = dtype
+            read_variable_op_types[node.name] = dtype
+
+    # Gets map of variables and the associated data.
+    if variable_names:
+        returned_variables = sess.run(variable_names)
+    else:
+        returned_variables = []
+    variables_data_map = dict(zip(variable_dict_names, returned_variables))
+    logging.info("Froze %d variables.", len(returned_variables))
+
+    # Reconstruct the graph with constants in place of variables.
+    output_graph_def = graph_pb2.GraphDef()
+    how_many_converted = 0
+    for input_node in inference_graph.node:
+        output_node = node_def_pb2.NodeDef()
+        if input_node.name in variables_data_map:
+            data = variables_data_map[input_node.name]
+            output_node = create_const_op(input_node.name, input_node.attr["dtype"],
+                                          data, data.shape)
+            how_many_converted += 1
+        elif input_node.name in resource_identity_types:
+            # Converts the Identities of type RESOURCE_DT to the appropriate type
+            # based on the input they are referencing.
+            output_node.CopyFrom(input_node)
+            output_node.attr["T"].CopyFrom(resource_identity_types[input_node.name])
+        elif input_node.op == "ReadVariableOp":
+            # The first branch converts all VarHandleOps of ResourceVariables to
+            # constants, so we need to convert the associated ReadVariableOps to
+            # Identity ops.
+            output_node.op = "Identity"
+            output_node.name = input_node.name
+            output_node.input.extend([input_node.input[0]])
+            output_node.attr["T"].CopyFrom(input_node.attr["dtype"])
+            if "_class" in input_node.attr:
+                output_node.attr["_class"].CopyFrom(input_node.attr["_class"])
+        elif input_node.op == "ResourceGather":
+            # The first branch converts all VarHandleOps of ResourceGather to
+            # constants, so we need to convert the associated ResourceGather to Gather
+            # ops with a Const axis feeding into it.
+            if input_node.attr["batch_dims"].i != 0:
+                raise ValueError("batch_dims != 0 is not supported by freeze_graph.")
+            axis_data = input_node.attr["batch_dims"].i
+            axis_node_name = input_node.name + "/axis"
+            axis_dtype = input_node.attr["Tindices"]
+            output_axis_node = create_const_op(axis_node_name, axis_dtype, axis_data)
+            output_graph_def.node.extend([output_axis_node])
+
+            output_node.op = "GatherV2"
+            output_node.name = input_node.name
+            output_node.input.extend(
+                [input_node.input[0], input_node.input[1], axis_node_name])
+            output_node.attr["Tparams"].CopyFrom(input_node.attr["dtype"])
+            output_node.attr["Tindices"].CopyFrom(input_node.attr["Tindices"])
+            output_node.attr["Taxis"].CopyFrom(axis_dtype)
+            if "_class" in input_node.attr:
+                output_node.attr["_class"].CopyFrom(input_node.attr["_class"])
+        elif input_node.op == "VariableShape":
+            output_node.op = "Shape"
+            output_node.name = input_node.name
+            output_node.input.extend([input_node.input[0]])
+            output_node.attr["T"].CopyFrom(read_variable_op_types[input_node.name])
+            output_node.attr["out_type"].CopyFrom(input_node.attr["out_type"])
+        else:
+            output_node.CopyFrom(input_node)
+        output_graph_def.node.extend([output_node])
+
+    output_graph_def.library.CopyFrom(inference_graph.library)
+    logging.info("Converted %d variables to const ops.", how_many_converted)
+    return output_graph_def
+
+
+@pytest.fixture
+def gru_graph():
+    """(session, graph def, output names) of a small keras GRU model like the ones trained by the server."""
+
+    tf.keras.backend.clear_session()
+    model = tf.keras.models.Sequential()
+    model.add(tf.keras.layers.GRU(8, input_shape=(4, 3)))
+    model.add(tf.keras.layers.Dense(1, activation='sigmoid'))
+    session = tf.keras.backend.get_session()
+    graph_def = session.graph.as_graph_def()
+    for node in graph_def.node:
+        node.device = ""
+    yield session, graph_def, [out.op.name for out in model.outputs]
+    tf.keras.backend.clear_session()
+
+
+def serialized(graph_def):
+    return graph_def.SerializeToString(deterministic=True)
+
+
+def test_extract_sub_graph_matches_previous_implementation(gru_graph):
+    _, graph_def, output_names = gru_graph
+    assert serialized(tf_graph_util.extract_sub_graph(graph_def, output_names)) == \
+        serialized(old_extract_sub_graph(graph_def, output_names))
+
+
+def test_frozen_graph_matches_previous_implementation(gru_graph):
+    session, graph_def, output_names = gru_graph
+    frozen = tf_graph_util.convert_variables_to_constants(session, graph_def, output_names)
+    assert serialized(frozen) == serialized(old_convert_variables_to_constants(session, graph_def, output_names))
+    assert not any(node.op in ("VariableV2", "VarHandleOp") for node in frozen.node)
@@ -0,0 +1,84 @@
+import numpy
+import pytest
+from pandas import DataFrame
+from pandas import concat
+
+from windowing import sliding_windows, window_batches, holdout_split
+
+
+def join_past_rows_features(data, past_rows=1, future_rows=1, dropnan=True):
+    """The pandas implementation sliding_windows replaces, used here as reference."""
+
+    n_vars = 1 if type(data) is list else data.shape[1]
+    df = DataFrame(data)
+    cols, names = list(), list()
+    for i in range(past_rows, 0, -1):
+        cols.append(df.shift(i))
+        names += [('var%d(t-%d)' % (j + 1, i)) for j in range(n_vars)]
+    for i in range(0, future_rows):
+        cols.append(df.shift(-i))
+        if i == 0:
+            names += [('var%d(t)' % (j + 1)) for j in range(n_vars)]
+        else:
+            names += [('var%d(t+%d)' % (j + 1, i)) for j in range(n_vars)]
+    agg = concat(cols, axis=1)
+    agg.columns = names
+    if dropnan:
+        agg.dropna(inplace=True)
+    return agg
+
+
+def reference_windows(x, timesteps):
+    joined = join_past_rows_features(x, past_rows=timesteps - 1).values
+    return joined.reshape((joined.shape[0], timesteps, x.shape[1]))
+
+
+def test_sliding_windows_equal_to_pandas_join():
+    x = numpy.random.RandomState(0).rand(200, 5)
+    for timesteps in [1, 2, 7, 32]:
+        expected = reference_windows(x, timesteps)
+        actual = sliding_windows(x, timesteps)
+        assert actual.shape == expected.shape
+        assert numpy.array_equal(actual, expected)
+
+
+def test_sliding_windows_is_a_view():
+    x = numpy.random.RandomState(1).rand(100, 3)
+    windows = sliding_windows(x, 16)
+    assert numpy.shares_memory(windows, x)
+    assert not windows.flags.writeable
+
+
+def test_sliding_windows_on_column_slice():
+    # like train_init does: drop price and output columns before windowing
+    dataset = numpy.random.RandomState(2).rand(50, 6)
+    x = dataset[:, 1:-1]
+    assert numpy.array_equal(sliding_windows(x, 4), reference_windows(x, 4))
+
+
+def test_sliding_windows_shorter_than_timesteps():
+    x = numpy.random.RandomState(3).rand(3, 2)
+    assert sliding_windows(x, 4).shape == (0, 4, 2)
+
+
+def test_window_batches_concatenate_to_windows():
+    x = numpy.random.RandomState(4).rand(101, 4)
+    batches = list(window_batches(x, 8, 10))
+    assert all(b.shape[0] <= 10 for b in batches)
+    assert numpy.array_equal(numpy.concatenate(batches), reference_windows(x, 8))
+
+
+def test_holdout_split_doesnt_share_rows():
+    data = numpy.arange(100).reshape((50, 2))
+    x, y = sliding_windows(data, 4), numpy.arange(47)
+    x_train, y_train, x_val, y_val = holdout_split(x, y, 0.2, 4)
+    assert x_val.shape[0] == 9 and numpy.array_equal(y_val, y[-9:])
+    assert numpy.array_equal(y_train, y[:35])
+    assert not set(x_train.ravel()) & set(x_val.ravel())
+    assert x_train[-1, -1, 0] + 2 == x_val[0, 0, 0]
+
+
+def test_holdout_split_too_small():
+    x = sliding_windows(numpy.zeros((6, 1)), 4)
+    with pytest.raises(ValueError):
+        holdout_split(x, numpy.zeros(3), 0.5, 4)
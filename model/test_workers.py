@@ -0,0 +1,114 @@
+import argparse
+import asyncio
+import struct
+import time
+from concurrent.futures import Future
+
+import numpy
+import pytest
+
+import workers
+from numpy_model import NumpyModel
+from test_numpy_model import random_weights
+
+
+def test_handles():
+    assert workers.handles(b'\x01\x02')
+    assert workers.handles("model_predict:a:0.1,0.2")
+    assert workers.handles("model_load:a,a.pb")
+    assert workers.handles("stream_push:0:0.1")
+    assert not workers.handles("train_fit:10,32")
+    assert not workers.handles("ping:")
+    assert not workers.handles("stats:")
+
+
+def test_worker_args_split_threads():
+    args = argparse.Namespace(workers=4, inference_threads=8, intra_op_threads=0, batch_delay_ms=2,
+                              metrics_port=9000)
+    split = workers.worker_args(args)
+    assert (split.inference_threads, split.intra_op_threads) == (2, 2)
+    assert (split.batch_delay_ms, split.metrics_port, split.workers) == (0, 0, 0)
+    assert args.inference_threads == 8 and args.workers == 4  # the front args are untouched
+
+    args.intra_op_threads, args.workers = 3, 16
+    assert workers.worker_args(args).intra_op_threads == 3
+    assert workers.worker_args(args).inference_threads == 1
+
+
+def server_args(**kwargs):
+    args = dict(inference_threads=2, intra_op_threads=0, inter_op_threads=0, batch_delay_ms=0, batch_max_size=256,
+                model_memory_mb=2048, engine='numpy', checkpoint_dir='checkpoints', verbose=False, cache_size=0,
+                metrics_port=0, series_store='', workers=2)
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+@pytest.fixture
+def pool(tmpdir):
+    """Two spawned workers and an .npz gru model of 3 features, (pool, model path, model)."""
+
+    pytest.importorskip("websockets")  # the workers run predictionserver
+    path = str(tmpdir.join("model.npz"))
+    numpy.savez(path, **random_weights(3, 8, True))
+    pool = workers.WorkerPool(2, server_args())
+    yield pool, path, NumpyModel.load(path)
+    pool.close()
+
+
+def run(pool, connection, *msgs):
+    loop = asyncio.new_event_loop()
+    try:
+        return [loop.run_until_complete(pool.process(msg, connection)) for msg in msgs]
+    finally:
+        loop.close()
+
+
+def stream_push(row):
+    return struct.pack('<BIHHI', 3, 0, 1, len(row), 1) + numpy.asarray(row, '<f4').tobytes()
+
+
+def test_loads_reach_every_worker(pool):
+    pool, path, _ = pool
+    connection = pool.connect()
+    assert run(pool, connection, "model_load:a,%s" % path, "model_load:b,%s" % path) == ["ok:2", "ok:3"]
+    assert [[model['name'] for model in state['models']] for state in pool.states()] == [["a", "b"]] * 2
+    assert run(pool, connection, "model_unload:a") == ["ok"]
+    assert [[model['name'] for model in state['models']] for state in pool.states()] == [["b"]] * 2
+
+
+def test_streams_stay_on_the_connection_worker(pool):
+    pool, path, model = pool
+    rows = numpy.random.RandomState(1).rand(3, 3).astype(numpy.float32)
+    connection = pool.connect()
+    pool.connect()  # so the next predictions may go to the other worker
+    replies = run(pool, connection, "model_load:a,%s" % path, "stream_open:a,2,3",
+                  *[stream_push(row) for row in rows])
+    assert replies[1:3] == ["ok:0", "NaN"]
+    expected = [model.predict(rows[i:i + 2][numpy.newaxis])[0] for i in range(2)]
+    assert [float(p) for p in replies[3:]] == pytest.approx(expected, abs=1e-6)
+
+
+def test_exited_workers_are_skipped(pool):
+    pool, path, model = pool
+    connection = pool.connect()
+    run(pool, connection, "model_load:a,%s" % path)
+    pool.workers[0].process.terminate()
+    deadline = time.time() + 10
+    while pool.workers[0].alive and time.time() < deadline:
+        time.sleep(0.01)
+    assert not pool.workers[0].alive
+
+    window = numpy.random.RandomState(2).rand(1, 2, 3).astype(numpy.float32)
+    for _ in range(3):
+        assert pool.predict(2, window)[0] == pytest.approx(model.predict(window)[0], abs=1e-6)
+    assert len(pool.states()) == 1
+    assert pool.connect()[1] is pool.workers[1]
+
+
+def test_states_skip_workers_that_dont_reply(pool):
+    pool, _, _ = pool
+    assert len(pool.states(timeout=10)) == 2  # started
+    pool.workers[0].request = lambda kind, payload: Future()  # like a worker stuck loading a model
+    start = time.time()
+    assert len(pool.states(timeout=0.2)) == 1
+    assert time.time() - start < 2
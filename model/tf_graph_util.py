@@ -22,7 +22,7 @@
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
-import copy
+import collections
 import re
 import six
 
@@ -150,19 +150,33 @@ def _bfs_for_reachable_nodes(target_nodes, name_to_input_name):
     """Breadth first search for reachable nodes from target nodes."""
     nodes_to_keep = set()
     # Breadth first search to find all the nodes that we should keep.
-    next_to_visit = target_nodes[:]
+    next_to_visit = collections.deque(target_nodes)
     while next_to_visit:
-        node = next_to_visit[0]
-        del next_to_visit[0]
+        node = next_to_visit.popleft()
         if node in nodes_to_keep:
             # Already visited this node.
             continue
         nodes_to_keep.add(node)
         if node in name_to_input_name:
-            next_to_visit += name_to_input_name[node]
+            next_to_visit.extend(name_to_input_name[node])
     return nodes_to_keep
 
 
+def _sub_graph_nodes(graph_def, dest_nodes):
+    """The nodes of graph_def that can reach any of dest_nodes, in graph order. Not copied."""
+    if not isinstance(graph_def, graph_pb2.GraphDef):
+        raise TypeError("graph_def must be a graph_pb2.GraphDef proto.")
+
+    if isinstance(dest_nodes, six.string_types):
+        raise TypeError("dest_nodes must be a list.")
+
+    name_to_input_name, name_to_node, _ = _extract_graph_summary(graph_def)
+    _assert_nodes_are_present(name_to_node, dest_nodes)
+
+    nodes_to_keep = _bfs_for_reachable_nodes(dest_nodes, name_to_input_name)
+    return [node for node in graph_def.node if _node_name(node.name) in nodes_to_keep]
+
+
 @deprecation.deprecated(
     date=None,
     instructions="Use `tf.compat.v1.graph_util.extract_sub_graph`")
@@ -178,24 +192,9 @@ def extract_sub_graph(graph_def, dest_nodes):
       TypeError: If 'graph_def' is not a graph_pb2.GraphDef proto.
     """
 
-    if not isinstance(graph_def, graph_pb2.GraphDef):
-        raise TypeError("graph_def must be a graph_pb2.GraphDef proto.")
-
-    if isinstance(dest_nodes, six.string_types):
-        raise TypeError("dest_nodes must be a list.")
-
-    name_to_input_name, name_to_node, name_to_seq_num = _extract_graph_summary(
-        graph_def)
-    _assert_nodes_are_present(name_to_node, dest_nodes)
-
-    nodes_to_keep = _bfs_for_reachable_nodes(dest_nodes, name_to_input_name)
-
-    nodes_to_keep_list = sorted(
-        list(nodes_to_keep), key=lambda n: name_to_seq_num[n])
-    # Now construct the output GraphDef
+    # Now construct the output GraphDef. extend copies the nodes, so no need to copy them before.
     out = graph_pb2.GraphDef()
-    for n in nodes_to_keep_list:
-        out.node.extend([copy.deepcopy(name_to_node[n])])
+    out.node.extend(_sub_graph_nodes(graph_def, dest_nodes))
     out.library.CopyFrom(graph_def.library)
     out.versions.CopyFrom(graph_def.versions)
 
@@ -266,9 +265,8 @@ def convert_variables_to_constants(sess,
 
         return current_name, nodes_in_path
 
-    def create_const_op(node_name, dtype, data, data_shape=None):
-        """Creates a Const op."""
-        output_node = node_def_pb2.NodeDef()
+    def create_const_op(output_node, node_name, dtype, data, data_shape=None):
+        """Fills output_node (already in the output graph, so it isn't copied again) as a Const op."""
         output_node.op = "Const"
         output_node.name = node_name
         output_node.attr["dtype"].CopyFrom(dtype)
@@ -278,13 +276,14 @@ def convert_variables_to_constants(sess,
                     data, dtype=dtype.type, shape=data_shape)))
         return output_node
 
-    # This graph only includes the nodes needed to evaluate the output nodes, and
-    # removes unneeded nodes like those involved in saving and assignment.
-    inference_graph = extract_sub_graph(input_graph_def, output_node_names)
+    # Only the nodes needed to evaluate the output nodes, without unneeded nodes like those involved in
+    # saving and assignment. These are the input_graph_def nodes themselves: each one is copied just once,
+    # straight into the output graph.
+    inference_nodes = _sub_graph_nodes(input_graph_def, output_node_names)
 
     # Identify the ops in the graph.
     map_name_to_node = {
-        node.name: node for node in inference_graph.node
+        node.name: node for node in inference_nodes
     }
 
     # Get list of variables.
@@ -292,7 +291,7 @@ def convert_variables_to_constants(sess,
     variable_dict_names = []
     resource_identity_types = {}
     read_variable_op_types = {}
-    for node in inference_graph.node:
+    for node in inference_nodes:
         if node.op in ["Variable", "VariableV2", "VarHandleOp"]:
             variable_name = node.name
             if ((variable_names_whitelist is not None
@@ -326,12 +325,22 @@ def convert_variables_to_constants(sess,
     # Reconstruct the graph with constants in place of variables.
     output_graph_def = graph_pb2.GraphDef()
     how_many_converted = 0
-    for input_node in inference_graph.node:
-        output_node = node_def_pb2.NodeDef()
+    for input_node in inference_nodes:
+        if input_node.op == "ResourceGather" and input_node.name not in variables_data_map \
+                and input_node.name not in resource_identity_types:
+            # the axis node goes before the converted node
+            if input_node.attr["batch_dims"].i != 0:
+                raise ValueError("batch_dims != 0 is not supported by freeze_graph.")
+            axis_data = input_node.attr["batch_dims"].i
+            axis_node_name = input_node.name + "/axis"
+            axis_dtype = input_node.attr["Tindices"]
+            create_const_op(output_graph_def.node.add(), axis_node_name, axis_dtype, axis_data)
+
+        output_node = output_graph_def.node.add()
         if input_node.name in variables_data_map:
             data = variables_data_map[input_node.name]
-            output_node = create_const_op(input_node.name, input_node.attr["dtype"],
-                                          data, data.shape)
+            create_const_op(output_node, input_node.name, input_node.attr["dtype"],
+                            data, data.shape)
             how_many_converted += 1
         elif input_node.name in resource_identity_types:
             # Converts the Identities of type RESOURCE_DT to the appropriate type
@@ -351,15 +360,7 @@ def convert_variables_to_constants(sess,
         elif input_node.op == "ResourceGather":
             # The first branch converts all VarHandleOps of ResourceGather to
             # constants, so we need to convert the associated ResourceGather to Gather
-            # ops with a Const axis feeding into it.
-            if input_node.attr["batch_dims"].i != 0:
-                raise ValueError("batch_dims != 0 is not supported by freeze_graph.")
-            axis_data = input_node.attr["batch_dims"].i
-            axis_node_name = input_node.name + "/axis"
-            axis_dtype = input_node.attr["Tindices"]
-            output_axis_node = create_const_op(axis_node_name, axis_dtype, axis_data)
-            output_graph_def.node.extend([output_axis_node])
-
+            # ops with a Const axis feeding into it (added above).
             output_node.op = "GatherV2"
             output_node.name = input_node.name
             output_node.input.extend(
@@ -377,9 +378,8 @@ def convert_variables_to_constants(sess,
             output_node.attr["out_type"].CopyFrom(input_node.attr["out_type"])
         else:
             output_node.CopyFrom(input_node)
-        output_graph_def.node.extend([output_node])
 
-    output_graph_def.library.CopyFrom(inference_graph.library)
+    output_graph_def.library.CopyFrom(input_graph_def.library)
     logging.info("Converted %d variables to const ops.", how_many_converted)
     return output_graph_def
 
@@ -0,0 +1,205 @@
+"""Model building, training data preparation and freezing, shared by the server, buildmodel.py and sweeps."""
+
+import json
+import os
+import shutil
+from timeit import default_timer as timer
+import numpy
+import tensorflow as tf
+from atomicfile import atomic_save
+from windowing import sliding_windows
+import numpy_model
+
+RNN_TYPES = ('gru', 'lstm')
+
+
+def training_data(dataset, timesteps):
+    """
+    Returns (x, y) for a training csv dataset (price, features..., output): x are the sliding windows of
+    the features, each with the previous (timesteps - 1) rows, and y the output of each window's last row.
+    """
+
+    x = dataset[:, 1:-1]  # remove price column (the first) and output column (the last)
+    y = dataset[:, -1:]
+    x = sliding_windows(x, timesteps)  # from t(timesteps-1) to t(0)
+    y = y[timesteps - 1:]  # remove first _timesteps_ entries, to keep sample count in sync with x
+    return x, y
+
+
+def build_model(timesteps, feature_count, rnn_type='gru'):
+    """The compiled recurrent classifier."""
+
+    model = tf.keras.models.Sequential()
+    if rnn_type == 'lstm':
+        model.add(tf.keras.layers.LSTM(32, input_shape=(timesteps, feature_count)))
+    elif rnn_type == 'gru':
+        model.add(tf.keras.layers.GRU(32, input_shape=(timesteps, feature_count)))
+    else:
+        raise ValueError("invalid rnn_type: %s" % rnn_type)
+    model.add(tf.keras.layers.Dropout(0.2))
+    model.add(tf.keras.layers.Dense(32, activation='relu'))
+    model.add(tf.keras.layers.Dense(1, activation='sigmoid'))
+    model.compile(loss='binary_crossentropy', optimizer='adam', metrics=['accuracy'])
+    return model
+
+
+def freeze_session(session, keep_var_names=None, output_names=None, clear_devices=True):
+    from tf_graph_util import convert_variables_to_constants
+    graph = session.graph
+    with graph.as_default():
+        freeze_var_names = list(set(v.op.name for v in tf.global_variables()).difference(keep_var_names or []))
+        output_names = output_names or []
+        output_names += [v.op.name for v in tf.global_variables()]
+        # Graph -> GraphDef ProtoBuf
+        input_graph_def = graph.as_graph_def()
+        if clear_devices:
+            for node in input_graph_def.node:
+                node.device = ""
+        frozen_graph = convert_variables_to_constants(session, input_graph_def,
+                                                      output_names, freeze_var_names)
+        return frozen_graph
+
+
+def save_model(model, session, pb_path, optimize=None):
+    """
+    Saves model (on session) as a frozen pb_path with its _meta.json, plus the .npz weights for numpy_model.
+    If optimize is a weights type (see optimize_graph.py), the graph is optimized for inference before saving.
+    Call it with the model graph and session as default.
+    """
+
+    with open(pb_path + "_meta.json", 'w') as f:
+        json.dump({'input_name': model.input.name, 'output_name': model.output.name}, f)
+
+    frozen_graph = freeze_session(session, output_names=[out.op.name for out in model.outputs])
+    if optimize is not None:
+        from optimize_graph import optimize_graph_def
+        frozen_graph = optimize_graph_def(frozen_graph, [model.input.op.name], [out.op.name for out in model.outputs],
+                                          optimize)
+    tf.train.write_graph(frozen_graph, ".", pb_path, as_text=False)
+    if model.layers[0].__class__.__name__ == 'GRU':  # numpy_model only knows the gru
+        numpy_model.export_keras(model, numpy_model.npz_path(pb_path))
+
+
+class ProgressCallback(tf.keras.callbacks.Callback):
+    """Reports each epoch of a training job through notify, as 'progress:<job id>:<text>' messages."""
+
+    def __init__(self, job_id, sample_count, notify):
+        super(ProgressCallback, self).__init__()
+        self.job_id = job_id
+        self.sample_count = sample_count
+        self.notify = notify
+        self.epoch_start = 0
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_start = timer()
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        time = timer() - self.epoch_start
+        acc = logs.get('acc', logs.get('accuracy', 0.0))
+        text = "epoch %d/%d, loss %.3f, acc %.3f" % (epoch + 1, self.params['epochs'], logs.get('loss', 0.0), acc)
+        if 'val_loss' in logs:
+            text += ", val loss %.3f, val acc %.3f" % (logs['val_loss'], logs.get('val_acc', logs.get('val_accuracy', 0.0)))
+        self.notify("progress:%s:%s, %.1f sec, %d samples/sec" % (
+            self.job_id, text, time, self.sample_count / max(time, 1e-9)))
+
+
+class BestWeightsCallback(tf.keras.callbacks.Callback):
+    """
+    Keeps the weights of the epoch with the lowest val_loss and restores them when the training ends, whether
+    it stopped early or ran all its epochs. (EarlyStopping's restore_best_weights only does it if it stops it.)
+    """
+
+    def __init__(self, best_loss=float('inf'), best_weights=None):
+        super(BestWeightsCallback, self).__init__()
+        self.best_loss = best_loss  # given to continue a checkpointed training, see CheckpointCallback
+        self.best_weights = best_weights
+
+    def on_epoch_end(self, epoch, logs=None):
+        loss = (logs or {}).get('val_loss')
+        if loss is not None and loss < self.best_loss:
+            self.best_loss = loss
+            self.best_weights = self.model.get_weights()
+
+    def on_train_end(self, logs=None):
+        if self.best_weights is not None:
+            self.model.set_weights(self.best_weights)
+
+
+class ResumableEarlyStopping(tf.keras.callbacks.EarlyStopping):
+    """EarlyStopping on val_loss that can continue a checkpointed training, with its best loss and epochs waited."""
+
+    def __init__(self, patience, best_loss=float('inf'), wait=0):
+        super(ResumableEarlyStopping, self).__init__(monitor='val_loss', patience=patience)
+        self.initial_best, self.initial_wait = best_loss, wait
+
+    def on_train_begin(self, logs=None):
+        super(ResumableEarlyStopping, self).on_train_begin(logs)
+        self.best, self.wait = self.initial_best, self.initial_wait
+
+
+def job_path(directory, job_id):
+    return os.path.join(directory, job_id, "job.json")
+
+
+def save_job(directory, job):
+    """Saves the job of a training (see train_fit) as json, under directory."""
+
+    path = job_path(directory, job['id'])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def write(tmp_path):
+        with open(tmp_path, 'w') as f:
+            json.dump(job, f)
+    atomic_save(path, write)
+
+
+def best_weights_path(directory, job_id):
+    return os.path.join(directory, job_id, "best_weights.npz")
+
+
+def load_best_weights(directory, job_id):
+    """The best weights saved by the checkpoints of a job, or None."""
+
+    path = best_weights_path(directory, job_id)
+    if not os.path.exists(path):
+        return None
+    with numpy.load(path) as weights:
+        return [weights["arr_%d" % i] for i in range(len(weights.files))]
+
+
+def remove_job(directory, job_id):
+    """Deletes the checkpoints and job json of a training, once it's finished."""
+
+    shutil.rmtree(os.path.dirname(job_path(directory, job_id)), ignore_errors=True)
+
+
+class CheckpointCallback(tf.keras.callbacks.Callback):
+    """
+    Every job['checkpoint_every'] epochs saves the model (weights and optimizer state) to model.h5 next to the
+    job json (under directory), and the job with the epochs done so far, so train_resume can continue from there.
+    The state of the best (BestWeightsCallback) and stopping (ResumableEarlyStopping) callbacks, if given, is
+    saved too: the best weights next to model.h5, and the best loss and epochs waited in the job.
+    """
+
+    def __init__(self, job, directory, best=None, stopping=None):
+        super(CheckpointCallback, self).__init__()
+        self.job = job
+        self.directory = directory
+        self.best = best
+        self.stopping = stopping
+
+    def on_epoch_end(self, epoch, logs=None):
+        if (epoch + 1) % self.job['checkpoint_every'] != 0 and epoch + 1 != self.params['epochs']:
+            return
+        h5_path = os.path.join(self.directory, self.job['id'], "model.h5")
+        atomic_save(h5_path, lambda tmp_path: self.model.save(tmp_path, include_optimizer=True))
+
+        job = dict(self.job, epoch=epoch + 1)
+        if self.best is not None and self.best.best_weights is not None:
+            atomic_save(best_weights_path(self.directory, self.job['id']),
+                        lambda tmp_path: numpy.savez(tmp_path, *self.best.best_weights))
+            job['best_loss'] = float(self.best.best_loss)
+        if self.stopping is not None:
+            job['wait'] = int(self.stopping.wait)
+        save_job(self.directory, job)
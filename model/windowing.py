@@ -0,0 +1,46 @@
+"""Sliding windows over a feature matrix, for the recurrent models input."""
+
+import numpy
+from numpy.lib.stride_tricks import as_strided
+
+
+def sliding_windows(data, timesteps):
+    """
+    For each row (from timesteps - 1 onwards), join the features of the previous (timesteps - 1) rows,
+    returning a (samples, timesteps, features) array ready for a recurrent NN input. Same output as
+    the old pandas shift()-based join, but this is a read-only strided view over data, so it doesn't
+    copy anything no matter how long the series or how many timesteps.
+    """
+
+    data = numpy.asarray(data)
+    if data.ndim == 1:
+        data = data.reshape((data.shape[0], 1))
+
+    samples = max(0, data.shape[0] - timesteps + 1)
+    row_stride, feature_stride = data.strides
+    return as_strided(data,
+                      shape=(samples, timesteps, data.shape[1]),
+                      strides=(row_stride, row_stride, feature_stride),
+                      writeable=False)
+
+
+def window_batches(data, timesteps, batch_size):
+    """Lazily yields the sliding_windows of data in contiguous batches of up to batch_size samples."""
+
+    windows = sliding_windows(data, timesteps)
+    for start in range(0, windows.shape[0], batch_size):
+        yield numpy.ascontiguousarray(windows[start:start + batch_size])
+
+
+def holdout_split(x, y, val_split, timesteps):
+    """
+    Splits sliding windows and labels in time order: the last val_split of the samples are for validation,
+    the rest before them for training. The (timesteps - 1) samples in between are dropped, since their windows
+    share rows with the first validation windows. Returns (x_train, y_train, x_val, y_val).
+    """
+
+    val_count = int(x.shape[0] * val_split)
+    train_count = x.shape[0] - val_count - (timesteps - 1)
+    if val_count == 0 or train_count <= 0:
+        raise ValueError("not enough samples to hold out %.2f of %d for validation" % (val_split, x.shape[0]))
+    return x[:train_count], y[:train_count], x[-val_count:], y[-val_count:]
@@ -0,0 +1,266 @@
+"""
+Multi-process serving (--workers): the front process keeps the websocket connections and the trainings, and
+spreads the predictions over worker processes, each with its own copy of the loaded models. So predictions
+aren't limited by the GIL of a single process.
+"""
+
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, wait
+
+# sent to every worker, in the same order, so all of them have the same models at the same slots
+BROADCAST_MESSAGES = {"buy_load", "sell_load", "model_load", "model_unload"}
+WORKER_MESSAGES = {"buy_predict", "sell_predict", "buy_predict_batch", "sell_predict_batch", "model_predict",
+                   "buy_score_series", "sell_score_series", "model_score_series", "model_list", "cache_stats",
+                   "stream_open", "stream_close", "stream_push", "stream_sync", "shm_open"} | BROADCAST_MESSAGES
+STREAM_FRAMES = {3, 4}  # BINARY_STREAM_PUSH and BINARY_STREAM_SYNC, which go to the worker with the streams
+
+# seconds to wait for the state of each worker. a worker busy loading a model (loads run in order) is skipped
+STATE_TIMEOUT = 1.0
+
+
+def handles(msg):
+    """Whether msg (text or binary) goes to the workers. Trainings and server messages stay on the front."""
+
+    return isinstance(msg, bytes) or msg.split(':', 1)[0] in WORKER_MESSAGES
+
+
+class Worker:
+    """A worker process, and its pipe. Requests are (id, kind, payload), replies (id, result or exception)."""
+
+    def __init__(self, index, context, args):
+        self.index = index
+        self.connection, worker_connection = context.Pipe()
+        self.process = context.Process(target=worker_main, args=(worker_connection, args), daemon=True)
+        self.process.start()
+        worker_connection.close()
+        self.ids = itertools.count()
+        self.pending = {}  # id -> Future
+        self.lock = threading.Lock()
+        self.down = False  # the process exited (or its pipe broke). it gets no more requests
+        threading.Thread(target=self.read_replies, daemon=True).start()
+
+    @property
+    def load(self):
+        return len(self.pending)
+
+    @property
+    def alive(self):
+        return not self.down and self.process.is_alive()
+
+    def request(self, kind, payload):
+        """Sends a request from any thread. Returns a concurrent Future of the result."""
+
+        future = Future()
+        with self.lock:
+            request_id = next(self.ids)
+            self.pending[request_id] = future
+            try:
+                self.connection.send((request_id, kind, payload))
+            except (OSError, ValueError) as e:
+                del self.pending[request_id]
+                future.set_exception(RuntimeError("worker %d is down: %s" % (self.index, e)))
+        return future
+
+    def read_replies(self):
+        while True:
+            try:
+                request_id, result = self.connection.recv()
+            except (EOFError, OSError):
+                break
+            with self.lock:
+                future = self.pending.pop(request_id)
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+        with self.lock:
+            closed, self.down = self.down, True
+            pending, self.pending = self.pending, {}
+        self.process.join(1)
+        if not closed:
+            print("worker %d exited with %s" % (self.index, self.process.exitcode))
+        for future in pending.values():
+            future.set_exception(RuntimeError("worker %d exited with %s" % (self.index, self.process.exitcode)))
+
+    def close(self):
+        self.down = True
+        # closing the pipe here doesn't end it while read_replies waits on it, so the worker wouldn't see it closed
+        with self.lock:
+            try:
+                self.connection.send((None, "exit", None))
+            except (OSError, ValueError):
+                pass  # exited already
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.connection.close()
+
+
+class WorkerPool:
+    """
+    count worker processes started with args (the parsed server args). Each connection gets a worker for its
+    streams, which are kept by the worker. Other predictions go to the worker with less pending requests.
+    Workers that exit aren't replaced, the rest keep serving.
+    """
+
+    def __init__(self, count, args):
+        context = multiprocessing.get_context('spawn')  # forking a process with tf sessions isn't safe
+        self.workers = [Worker(i, context, args) for i in range(count)]
+        self.connection_ids = itertools.count()
+        self.next_worker = itertools.cycle(self.workers)
+        self.broadcast_lock = threading.Lock()
+
+    def alive_workers(self):
+        workers = [worker for worker in self.workers if worker.alive]
+        if not workers:
+            raise RuntimeError("all the workers exited")
+        return workers
+
+    def least_busy(self):
+        return min(self.alive_workers(), key=lambda worker: worker.load)
+
+    def connect(self):
+        """Returns (id, worker) for a new connection, which must be passed to disconnect when it's closed."""
+
+        alive = self.alive_workers()
+        worker = next(self.next_worker)
+        while worker not in alive:
+            worker = next(self.next_worker)
+        return next(self.connection_ids), worker
+
+    def disconnect(self, connection):
+        connection_id, worker = connection
+        worker.request("close", connection_id)
+
+    def broadcast(self, kind, payload):
+        """Sends the request to every worker. Returns the futures of their results."""
+
+        # sent all at once, so loads from different connections reach every worker in the same order
+        with self.broadcast_lock:
+            return [worker.request(kind, payload) for worker in self.alive_workers()]
+
+    def states(self, timeout=STATE_TIMEOUT):
+        """The loaded models, their memory and cache stats of each worker (see worker_main) that replies in time."""
+
+        done, _ = wait(self.broadcast("state", None), timeout)
+        return [future.result() for future in done if future.exception() is None]
+
+    def predict(self, slot, array):
+        """Predicts the array on the model at slot, waiting for the result. Used by the front batchers."""
+
+        return self.least_busy().request("predict", (slot, array)).result()
+
+    # pickling a batch takes a while and the pipe blocks when full, so the async requests are sent from the
+    # default executor of the loop
+
+    async def send(self, worker, kind, payload):
+        """Sends the request to worker. Returns its result."""
+
+        loop = asyncio.get_event_loop()
+        return await asyncio.wrap_future(await loop.run_in_executor(None, worker.request, kind, payload))
+
+    async def send_all(self, kind, payload):
+        """Broadcasts the request. Returns the results."""
+
+        loop = asyncio.get_event_loop()
+        return await gather(await loop.run_in_executor(None, self.broadcast, kind, payload))
+
+    async def process(self, msg, connection):
+        """Replies msg (see handles) on the workers."""
+
+        connection_id, worker = connection
+        if isinstance(msg, bytes):
+            if msg and msg[0] in STREAM_FRAMES:
+                return await self.send(worker, "binary", (connection_id, msg))
+            return await self.send(self.least_busy(), "binary", (connection_id, msg))
+
+        msg_type, content = msg.split(':', 1)
+        if msg_type in BROADCAST_MESSAGES:
+            results = await self.send_all("process", (msg_type, content))
+            if len(set(results)) > 1:
+                return "error: workers replied differently: %s" % " | ".join(results)
+            return results[0]
+        elif msg_type == "cache_stats":
+            results = await self.send_all("process", (msg_type, content))
+            return json.dumps([json.loads(result) for result in results])
+        elif msg_type.startswith("stream_") or msg_type == "shm_open":
+            return await self.send(worker, "stream", (connection_id, msg_type, content))
+        return await self.send(self.least_busy(), "process", (msg_type, content))
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+
+
+async def gather(futures):
+    return await asyncio.gather(*(asyncio.wrap_future(future) for future in futures))
+
+
+def worker_args(args):
+    """The args of a worker: the cpus given by --inference-threads and tf threads are split between workers."""
+
+    args = type(args)(**vars(args))
+    cpus = max(1, (args.inference_threads or os.cpu_count()) // args.workers)
+    args.inference_threads = cpus
+    if args.intra_op_threads == 0:
+        args.intra_op_threads = cpus
+    args.batch_delay_ms = 0  # the front batches, the workers get the batches already made
+    args.metrics_port = 0
+    args.workers = 0
+    return args
+
+
+def worker_main(connection, args):
+    """Runs in each worker process: replies the requests of the front until the pipe is closed."""
+
+    import predictionserver as ps
+
+    ps.configure(worker_args(args))
+    ps.start_tf_import()
+
+    send_lock = threading.Lock()
+    streams = {}  # connection id -> its streams (and shm channels). its requests come one at a time
+
+    def reply(request_id, kind, payload):
+        try:
+            if kind == "process":
+                result = ps.process(*payload)
+            elif kind == "predict":
+                slot, array = payload
+                result = ps.predict_slot(slot, array)
+            elif kind == "stream":
+                connection_id, msg_type, content = payload
+                result = ps.process_stream(msg_type, content, streams.setdefault(connection_id, {}))
+            elif kind == "binary":
+                connection_id, frame = payload
+                result = ps.process_binary(frame, streams.get(connection_id))
+            elif kind == "state":
+                result = {'models': ps.models.list(), 'memory': ps.models.memory,
+                          'cache': ps.prediction_cache.stats() if ps.prediction_cache is not None else None}
+            elif kind == "close":
+                ps.close_shm_channels(streams.pop(payload, {}))
+                result = "ok"
+            else:
+                result = "error: invalid worker request %s" % kind
+        except Exception as e:
+            result = e if kind == "predict" else "error: %s" % (e,)
+        with send_lock:
+            connection.send((request_id, result))
+
+    while True:
+        try:
+            request_id, kind, payload = connection.recv()
+        except (EOFError, OSError):
+            break
+        if kind == "exit":
+            break
+        if kind == "process" and payload[0] in BROADCAST_MESSAGES:
+            reply(request_id, kind, payload)  # in order, so every worker gives the same slots
+        else:
+            ps.inference_executor.submit(reply, request_id, kind, payload)
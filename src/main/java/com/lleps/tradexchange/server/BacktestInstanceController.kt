@@ -6,6 +6,7 @@ import com.lleps.tradexchange.strategy.Strategy
 import com.lleps.tradexchange.util.get
 import org.ta4j.core.BaseTimeSeries
 import org.ta4j.core.indicators.helpers.ClosePriceIndicator
+import java.io.File
 import java.util.concurrent.atomic.AtomicBoolean
 
 class BacktestInstanceController(
@@ -92,6 +93,8 @@ class BacktestInstanceController(
             input = input
         )
         strategy.init()
+        File("data/backtests").mkdir()
+        strategy.precomputePredictions(timeSeries.endIndex, "data/backtests/$instance-open.csv")
         val startMillis = System.currentTimeMillis()
         var etaLock = 2L
         val etaP = 0.4
@@ -93,6 +93,7 @@ class LiveInstanceController(
             input = input)
         out.write("Initialize model...")
         strategy.init()
+        strategy.useStreamingPredictions()
 
         // init chart data. Should paint some past data to get better feedback
         // also plot past trades reported by the exchange.
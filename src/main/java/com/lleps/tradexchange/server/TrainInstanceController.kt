@@ -42,6 +42,9 @@ class TrainInstanceController(
             "trainEpochs" to "15",
             "trainBatchSize" to "32",
             "trainTimesteps" to "7",
+            "trainStream" to "0",
+            "trainValSplit" to "0.2",
+            "trainPatience" to "5",
             "warmupTicks" to "300") +
             fetchTicksRequiredInput() +
             PredictionModel.getRequiredInput()
@@ -73,6 +76,9 @@ class TrainInstanceController(
         epochs: Int,
         batchSize: Int,
         timesteps: Int,
+        stream: Boolean,
+        valSplit: Double,
+        patience: Int,
         csvPath: String,
         modelPath: String
     ) {
@@ -111,11 +117,13 @@ class TrainInstanceController(
 
         val tf = TensorflowClient.getOrCreate()
         out.write("$type: Init training...")
-        tf.requestInitTrain(csvPath, timesteps)
+        tf.requestInitTrain(csvPath, timesteps, stream)
         out.write("$type: Train for $epochs epochs (bs $batchSize)...")
-        TensorflowClient.setServerOutputCallback { out.write(it) }
-        out.write(tf.requestDoTrain(epochs, batchSize))
-        TensorflowClient.setServerOutputCallback { }
+        val result = tf.requestDoTrain(
+            epochs, batchSize, valSplit, patience,
+            onStart = { jobId -> out.write("$type: Training job $jobId (can be resumed with this id)") },
+            onProgress = { progress -> out.write("$type: $progress") })
+        out.write(result)
         out.write("$type: Save...")
         tf.requestSaveTrain(modelPath)
         out.write("$type: All done!")
@@ -129,13 +137,16 @@ class TrainInstanceController(
         val epochs = input.getValue("trainEpochs").toInt()
         val batchSize = input.getValue("trainBatchSize").toInt()
         val timesteps = input.getValue("trainTimesteps").toInt()
+        val stream = input.getValue("trainStream").toInt() != 0
+        val valSplit = input.getValue("trainValSplit").toDouble()
+        val patience = input.getValue("trainPatience").toInt()
         File("data/trainings").mkdir()
         File("data/models").mkdir()
         val typeStr = if (type == OperationType.BUY) "open" else "close"
         val csvPath = "data/trainings/$instance-$typeStr.csv"
         val modelPath = "data/models/$instance-$typeStr.pb"
         predictionModel!!.saveMetadata(instance)
-        exportAndBuildModelType(type, epochs, batchSize, timesteps, csvPath, modelPath)
+        exportAndBuildModelType(type, epochs, batchSize, timesteps, stream, valSplit, patience, csvPath, modelPath)
     }
 
     private fun resetTrain(input: Map<String, String>) {
@@ -175,6 +186,10 @@ class TrainInstanceController(
             out.write("Loading buy model... (${this.instance})")
             predictionModel.loadBuyModel(this.instance)
             out.write("Loaded.")
+            File("data/trainings").mkdir()
+            if (predictionModel.precomputeBuyPredictions(timeSeries.endIndex, "data/trainings/$instance-open-features.csv")) {
+                out.write("Buy predictions precomputed.")
+            }
         }
         var i = warmupTicks
         var buyPrice = 0.0
@@ -4,6 +4,7 @@ import com.lleps.tradexchange.OperationType
 import com.lleps.tradexchange.indicator.*
 import com.lleps.tradexchange.util.get
 import com.lleps.tradexchange.util.loadFrom
+import com.lleps.tradexchange.util.loadNpyDoubles
 import com.lleps.tradexchange.util.saveTo
 import org.ta4j.core.Indicator
 import org.ta4j.core.TimeSeries
@@ -13,6 +14,9 @@ import org.ta4j.core.indicators.volume.ChaikinMoneyFlowIndicator
 import org.ta4j.core.indicators.volume.ChaikinOscillatorIndicator
 import org.ta4j.core.indicators.volume.OnBalanceVolumeIndicator
 import org.ta4j.core.num.Num
+import java.nio.charset.Charset
+import java.nio.file.Files
+import java.nio.file.Paths
 
 /**
  * The point of this is to group model-related behavior and data, like feature gathering (evaluating
@@ -269,20 +273,28 @@ class PredictionModel private constructor(
     // Predictions
 
     private val mlClient = TensorflowClient.getOrCreate()
+    private var buyModel = ""
+    private var buySlot = -1
+    private var sellSlot = -1
 
     /** Set the model used in [predictBuy]. */
     fun loadBuyModel(name: String) {
         val buyPath = "./data/models/$name-open.pb"
-        if (!mlClient.requestLoadBuyModel(buyPath)) {
-            error("can't load buy model at '$buyPath'.")
+        buyModel = "$name-open"
+        buySlot = try {
+            mlClient.requestLoadModel(buyModel, buyPath)
+        } catch (e: IllegalStateException) {
+            error("can't load buy model at '$buyPath': ${e.message}")
         }
     }
 
     /** Set the model used in [predictSell]. */
     fun loadSellModel(name: String) {
         val sellPath = "./data/models/$name-close.pb"
-        if (!mlClient.requestLoadSellModel(sellPath)) {
-            error("can't load sell model at '$sellPath'.")
+        sellSlot = try {
+            mlClient.requestLoadModel("$name-close", sellPath)
+        } catch (e: IllegalStateException) {
+            error("can't load sell model at '$sellPath': ${e.message}")
         }
     }
 
@@ -296,26 +308,96 @@ class PredictionModel private constructor(
         return predict(i, buy = false, indicators = sellIndicators)
     }
 
+    private var precomputedBuy: DoubleArray? = null
+
+    /**
+     * Predict the buy model on every tick up to [lastTick] in a single server call, so [predictBuy] is
+     * just a lookup afterwards. The features are exported to [csvPath]. Returns false (and does nothing)
+     * if the buy features depend on the trades done, since then they can't be known ahead of time.
+     */
+    fun precomputeBuyPredictions(lastTick: Int, csvPath: String): Boolean {
+        if (buyIndicators.any { it.third is BuyPressureIndicator }) return false
+
+        val sb = StringBuilder()
+        for (i in 0..lastTick) {
+            sb.append(buyIndicators.joinToString(separator = ",") { it.third[i].toString() })
+            sb.append("\n")
+        }
+        Files.write(Paths.get(csvPath), sb.toString().toByteArray(Charset.defaultCharset()))
+        val npyPath = "$csvPath.npy"
+        mlClient.requestScoreSeries(buyModel, csvPath, timesteps, npyPath)
+        precomputedBuy = loadNpyDoubles(npyPath)
+        return true
+    }
+
+    private var buyStream = -1
+    private var lastStreamedTick = -1
+
+    /**
+     * Make [predictBuy] send only the newest features when called on consecutive ticks, as in live
+     * trading. The server keeps the rest of the window.
+     */
+    fun openBuyStream() {
+        buyStream = mlClient.requestOpenStream(buyModel, timesteps, buyIndicators.size)
+        lastStreamedTick = -1
+    }
+
     /** Calculate global buy prediction for the tick [i]. */
     fun predictBuy(i: Int): Double {
+        val precomputed = precomputedBuy
+        if (precomputed != null && i < precomputed.size) return precomputed[i]
+        if (buyStream >= 0) return predictBuyStreaming(i)
         return predict(i, buy = true, indicators = buyIndicators)
     }
 
+    private fun predictBuyStreaming(i: Int): Double {
+        val prediction = try {
+            if (i == lastStreamedTick + 1) {
+                mlClient.requestStreamPush(buyStream, buildWindow(i, buyIndicators).last())
+            } else {
+                mlClient.requestStreamSync(buyStream, buildWindow(i, buyIndicators))
+            }
+        } catch (e: IllegalStateException) {
+            // the server lost the stream (ie, restarted). open it again with the whole window
+            openBuyStream()
+            mlClient.requestStreamSync(buyStream, buildWindow(i, buyIndicators))
+        }
+        lastStreamedTick = i
+        return prediction
+    }
+
+    /**
+     * Calculate global buy predictions for all the ticks in [ticks], in batches of [batchSize] windows
+     * per round-trip. Much faster than calling [predictBuy] tick by tick.
+     */
+    fun predictBuy(ticks: IntRange, batchSize: Int = 1024): DoubleArray {
+        val result = DoubleArray(ticks.count())
+        var offset = 0
+        for (chunk in ticks.chunked(batchSize)) {
+            val windows = Array(chunk.size) { idx -> buildWindow(chunk[idx], buyIndicators) }
+            val predictions = mlClient.requestPredictions(buySlot, windows)
+            predictions.copyInto(result, offset)
+            offset += predictions.size
+        }
+        return result
+    }
+
     private fun predict(
         i: Int,
         buy: Boolean = false,
         indicators: List<Triple<String, String, Indicator<Num>>>
     ): Double {
-        val timestepsArray = Array(timesteps) { index ->
+        val timestepsArray = buildWindow(i, indicators)
+
+        return mlClient.requestPrediction(if (buy) buySlot else sellSlot, timestepsArray)
+    }
+
+    /** Features of the last [timesteps] ticks up to [i], as the (timesteps, features) window the model expects. */
+    private fun buildWindow(i: Int, indicators: List<Triple<String, String, Indicator<Num>>>): Array<DoubleArray> {
+        return Array(timesteps) { index ->
             DoubleArray(indicators.size) { indicatorIndex ->
                 indicators[indicatorIndex].third[i - (timesteps - index - 1)]
             }
         }
-
-        return if (buy) {
-            mlClient.requestBuyPrediction(timestepsArray)
-        } else {
-            mlClient.requestSellPrediction(timestepsArray)
-        }
     }
 }
\ No newline at end of file
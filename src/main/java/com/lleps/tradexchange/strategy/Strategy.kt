@@ -114,6 +114,25 @@ class Strategy(
         if (buyOnly) output.write("Using buy only mode!")
     }
 
+    /**
+     * Predict buys for all the ticks up to [lastTick] at once, exporting the features to [csvPath].
+     * Only useful when all the candles are known beforehand, like in backtesting.
+     */
+    fun precomputePredictions(lastTick: Int, csvPath: String) {
+        val took = measureTimeMillis {
+            if (!predictionModel.precomputeBuyPredictions(lastTick, csvPath)) {
+                output.write("Buy features depend on trades, predicting tick by tick.")
+                return
+            }
+        }
+        output.write("Buy predictions precomputed in ${took}ms.")
+    }
+
+    /** Send only the newest features on each tick for buy predictions. For live trading, where ticks come one by one. */
+    fun useStreamingPredictions() {
+        predictionModel.openBuyStream()
+    }
+
     private fun calculatePredictions(i: Int) {
         val newBuyPrediction = predictionModel.predictBuy(i)
         buyPredictionLastLast = buyPredictionLast
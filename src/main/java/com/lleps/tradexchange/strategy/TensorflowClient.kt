@@ -6,33 +6,117 @@ import org.java_websocket.handshake.ServerHandshake
 import org.slf4j.LoggerFactory
 import java.io.BufferedReader
 import java.io.InputStreamReader
+import java.io.RandomAccessFile
+import java.nio.Buffer
+import java.nio.ByteBuffer
+import java.nio.ByteOrder
+import java.nio.channels.FileChannel
+import java.util.concurrent.ConcurrentHashMap
 import java.util.concurrent.LinkedBlockingQueue
+import java.util.concurrent.TimeUnit
+import java.util.concurrent.locks.LockSupport
 import kotlin.concurrent.thread
+import sun.misc.Unsafe
 
 /** Used to connect to a python tensorflow server through websockets to train and predict with models.  */
 class TensorflowClient(serverURI: URI) : WebSocketClient(serverURI) {
-    private val sb = StringBuilder()
     private val resQueue = LinkedBlockingQueue<String>() // messages received
+    private val jobs = ConcurrentHashMap<String, LinkedBlockingQueue<String>>() // progress/done messages by job id
 
-    fun requestInitTrain(trainCsvPath: String, timesteps: Int) {
-        val result = sendRecv("train_init:$trainCsvPath,$timesteps")
+    private var shm: ByteBuffer? = null // shared memory channel, see requestOpenSharedMemory
+    private var shmCapacity = 0
+    private var shmSeq = 0L
+    private var shmAddress = 0L // of the mapping, to access the seqs with memory barriers
+
+    private fun jobEvents(jobId: String) = jobs.computeIfAbsent(jobId) { LinkedBlockingQueue() }
+
+    /** Prepare training over [trainCsvPath]. If [stream], windows are streamed from disk instead of kept in memory. */
+    fun requestInitTrain(trainCsvPath: String, timesteps: Int, stream: Boolean = false) {
+        val mode = if (stream) "stream" else "memory"
+        val result = sendRecv("train_init:$trainCsvPath,$timesteps,$mode")
         if (result.startsWith("error:")) {
-            error("tf server error: ${result.split(":", limit = 1)[1]}")
+            error("tf server error: ${result.split(":", limit = 2)[1]}")
         }
     }
 
-    fun requestDoTrain(epochs: Int, batchSize: Int): String {
-        val result = sendRecv("train_fit:$epochs,$batchSize")
+    /**
+     * Train the model initialized with [requestInitTrain]. The training runs as a background job in the server,
+     * so predictions keep working meanwhile. Each epoch summary is passed to [onProgress]. Blocks until done.
+     * The last [valSplit] of the samples are held out to score the model, and the training stops after [patience]
+     * epochs without improving the validation loss (0 to never stop early), keeping the best weights.
+     * The job id is passed to [onStart] as soon as the job starts, to [requestResumeTrain] it if interrupted.
+     */
+    fun requestDoTrain(
+        epochs: Int,
+        batchSize: Int,
+        valSplit: Double = 0.2,
+        patience: Int = 5,
+        onStart: (String) -> Unit = { },
+        onProgress: (String) -> Unit = { }
+    ): String {
+        return awaitJob(sendRecv("train_fit:$epochs,$batchSize,$valSplit,$patience"), onStart, onProgress)
+    }
+
+    /**
+     * Continue the training job [jobId] (the id passed to [requestDoTrain] onStart) from its last checkpoint,
+     * even after a server restart. Like [requestDoTrain], blocks until done.
+     */
+    fun requestResumeTrain(jobId: String, onProgress: (String) -> Unit = { }): String {
+        return awaitJob(sendRecv("train_resume:$jobId"), { }, onProgress)
+    }
+
+    /**
+     * Train a model for each combination of [gridJson] (like {"timesteps":[8,16],"rnn_type":["gru","lstm"]}, see
+     * sweep.py) on [trainCsvPath], in parallel server processes. Each finished trial is passed to [onProgress].
+     * Blocks until done, returning the results ranked by validation loss as a json list.
+     */
+    fun requestSweep(trainCsvPath: String, gridJson: String, onProgress: (String) -> Unit = { }): String {
+        return awaitJob(sendRecv("train_sweep:$trainCsvPath,$gridJson"), { }, onProgress).split(":", limit = 2)[1]
+    }
+
+    /**
+     * Wait for the job started with reply [result] (job:<id>) to finish, passing its id to [onStart] and its
+     * progress to [onProgress].
+     */
+    private fun awaitJob(result: String, onStart: (String) -> Unit, onProgress: (String) -> Unit): String {
         if (result.startsWith("error:")) {
-            error("tf server error: ${result.split(":", limit = 1)[1]}")
+            error("tf server error: ${result.split(":", limit = 2)[1]}")
+        }
+        val jobId = result.split(":", limit = 2)[1]
+        onStart(jobId)
+        val events = jobEvents(jobId)
+        try {
+            while (true) {
+                // jobs take minutes, so there's no timeout. just fail if the server is gone
+                val event = events.poll(JOB_POLL_MS, TimeUnit.MILLISECONDS)
+                if (event == null) {
+                    if (!isOpen) error("tf server connection closed during job $jobId")
+                    if (serverProcess?.isAlive == false) error("prediction server exited during job $jobId")
+                    continue
+                }
+                val (type, _, content) = event.split(":", limit = 3)
+                if (type == "progress") {
+                    onProgress(content)
+                    continue
+                }
+                if (content.startsWith("error:")) {
+                    error("tf server error: ${content.split(":", limit = 2)[1]}")
+                }
+                return content
+            }
+        } finally {
+            jobs.remove(jobId)
         }
-        return result
     }
 
-    fun requestSaveTrain(path: String) {
-        val result = sendRecv("train_save:$path")
+    /**
+     * Save the trained model to [path]. If [optimizeWeights] is float32, float16 or int8, the graph is optimized
+     * for inference, storing the weights with that precision.
+     */
+    fun requestSaveTrain(path: String, optimizeWeights: String? = null) {
+        val result = sendRecv("train_save:$path" + (optimizeWeights?.let { ",$it" } ?: ""))
         if (result.startsWith("error:")) {
-            error("tf server error: ${result.split(":", limit = 1)[1]}")
+            error("tf server error: ${result.split(":", limit = 2)[1]}")
         }
     }
 
@@ -40,35 +124,231 @@ class TensorflowClient(serverURI: URI) : WebSocketClient(serverURI) {
 
     fun requestLoadSellModel(path: String): Boolean = sendRecv("sell_load:$path") == "ok"
 
-    fun requestBuyPrediction(data: Array<DoubleArray>) = requestPrediction("buy_predict:", data)
+    /**
+     * Load the model at [path] as [name], so several models can be loaded at once. Loading a file that's
+     * already loaded is almost free. Returns the slot to predict with the model, which fails once the slot
+     * is given to another model (after unloading this one).
+     */
+    fun requestLoadModel(name: String, path: String): Int {
+        return request("model_load:$name,$path").split(":", limit = 2)[1].toInt()
+    }
+
+    fun requestUnloadModel(name: String) {
+        request("model_unload:$name")
+    }
+
+    /** The loaded models, as a json list. */
+    fun requestListModels(): String = request("model_list:")
+
+    /**
+     * Server metrics as json: count, errors and latencies (queue, parse, run, send) by message type, queue depth,
+     * loaded models memory and training state.
+     */
+    fun requestStats(): String = request("stats:")
+
+    /** Server uptime and whether tensorflow is imported yet (with the import time), as json. */
+    fun requestPing(): String = request("ping:").split(":", limit = 2)[1]
+
+    /** Hits, misses and size of the server prediction cache, as json. */
+    fun requestCacheStats(): String = request("cache_stats:")
+
+    /** Like [requestBuyScoreSeries], but with the model loaded as [name]. */
+    fun requestScoreSeries(name: String, csvPath: String, timesteps: Int, outPath: String) {
+        request("model_score_series:$name,$csvPath,$timesteps,$outPath")
+    }
+
+    /** Predict every tick of the features at [csvPath] and save them to [outPath] as a .npy array. */
+    fun requestBuyScoreSeries(csvPath: String, timesteps: Int, outPath: String) {
+        val result = sendRecv("buy_score_series:$csvPath,$timesteps,$outPath")
+        if (result.startsWith("error:")) {
+            error("tf server error: ${result.split(":", limit = 2)[1]}")
+        }
+    }
+
+    fun requestSellScoreSeries(csvPath: String, timesteps: Int, outPath: String) {
+        val result = sendRecv("sell_score_series:$csvPath,$timesteps,$outPath")
+        if (result.startsWith("error:")) {
+            error("tf server error: ${result.split(":", limit = 2)[1]}")
+        }
+    }
+
+    fun requestBuyPrediction(data: Array<DoubleArray>) = requestPrediction(SLOT_BUY, data)
+
+    fun requestSellPrediction(data: Array<DoubleArray>) = requestPrediction(SLOT_SELL, data)
+
+    fun requestBuyPredictions(data: Array<Array<DoubleArray>>) = requestPredictions(SLOT_BUY, data)
+
+    fun requestSellPredictions(data: Array<Array<DoubleArray>>) = requestPredictions(SLOT_SELL, data)
+
+    /**
+     * Open a stream of predictions with the model loaded as [name]: the server keeps the last [timesteps] rows,
+     * so each tick only the newest row has to be sent (see [requestStreamPush]). Returns the stream id.
+     */
+    fun requestOpenStream(name: String, timesteps: Int, features: Int): Int {
+        return request("stream_open:$name,$timesteps,$features").split(":", limit = 2)[1].toInt()
+    }
+
+    fun requestCloseStream(stream: Int) {
+        request("stream_close:$stream")
+    }
+
+    /** Push the newest [row] to the [stream] and predict. NaN until the stream has a whole window. */
+    fun requestStreamPush(stream: Int, row: DoubleArray): Double {
+        shmRequest(BINARY_STREAM_PUSH, stream, arrayOf(arrayOf(row)))?.let { return it[0] }
+        return request(encodeWindows(BINARY_STREAM_PUSH, stream, arrayOf(arrayOf(row)))).toDouble()
+    }
+
+    /** Replace the rows of the [stream] with [window] and predict. Used to (re)start streams. */
+    fun requestStreamSync(stream: Int, window: Array<DoubleArray>): Double {
+        shmRequest(BINARY_STREAM_SYNC, stream, arrayOf(window))?.let { return it[0] }
+        return request(encodeWindows(BINARY_STREAM_SYNC, stream, arrayOf(window))).toDouble()
+    }
+
+    /**
+     * Send the predictions (and stream pushes) of this connection through a shared memory file of [size] bytes
+     * instead of the websocket, which saves the socket round-trip. Only for a server on this host. The server
+     * polls the channel without sleeping for [spinMs] after each request, so requests closer than that are
+     * answered sooner, but it takes a core meanwhile. Batches that don't fit in half of [size] still use the
+     * websocket.
+     */
+    fun requestOpenSharedMemory(size: Int = SHM_DEFAULT_SIZE, spinMs: Int = SHM_DEFAULT_SPIN_MS) {
+        check(ByteOrder.nativeOrder() == ByteOrder.LITTLE_ENDIAN) { "shared memory needs a little-endian host" }
+        val path = request("shm_open:$size,$spinMs").split(":", limit = 2)[1]
+        RandomAccessFile(path, "rw").use { file ->
+            // the mapping stays valid after closing the file
+            val buffer = file.channel.map(FileChannel.MapMode.READ_WRITE, 0, size.toLong())
+            synchronized(this) {
+                shm = buffer.order(ByteOrder.LITTLE_ENDIAN)
+                shmAddress = UNSAFE.getLong(buffer, BUFFER_ADDRESS)
+                shmCapacity = (size - SHM_DATA_OFFSET) / 2
+                shmSeq = 0L
+            }
+        }
+    }
+
+    /**
+     * Predict through the shared memory channel: the frame is written in the request area, then its length and
+     * a new request seq, and the predictions are read as float64 once the server writes the same reply seq.
+     * Returns null if there's no channel or the frame doesn't fit, to use the websocket instead.
+     */
+    @Synchronized
+    private fun shmRequest(type: Int, slot: Int, data: Array<Array<DoubleArray>>): DoubleArray? {
+        val buffer = shm ?: return null
+        val size = frameSize(data)
+        if (size > shmCapacity) return null
 
-    fun requestSellPrediction(data: Array<DoubleArray>) = requestPrediction("sell_predict:", data)
+        buffer.position(SHM_DATA_OFFSET)
+        writeWindows(buffer, type, slot, data)
+        val seq = ++shmSeq
+        buffer.putInt(SHM_REQUEST_LENGTH, size)
+        // release the request: the frame and length stores happen before the server can see the seq. and acquire
+        // the reply: it's read after seeing the reply seq
+        UNSAFE.putLongVolatile(null, shmAddress + SHM_REQUEST_SEQ, seq)
 
-    private fun requestPrediction(prefix: String, data: Array<DoubleArray>): Double {
-        sb.clear()
-        sb.append(prefix)
-        val timestampCount = data.size
-        repeat(timestampCount) { i ->
-            val featureCount = data[i].size
-            repeat(featureCount) { j ->
-                sb.append(data[i][j])
-                if (j < (featureCount - 1)) sb.append(",")
+        var spins = 0
+        while (UNSAFE.getLongVolatile(null, shmAddress + SHM_REPLY_SEQ) != seq) {
+            if (++spins < SHM_SPINS) {
+                Thread.yield()
+            } else {
+                if (!isOpen) error("tf server connection closed")
+                LockSupport.parkNanos(SHM_PARK_NANOS)
             }
-            if (i < (timestampCount - 1)) sb.append("|")
         }
-        return sendRecv(sb.toString()).toDouble()
+        val length = buffer.getInt(SHM_REPLY_LENGTH)
+        val replyOffset = SHM_DATA_OFFSET + shmCapacity
+        if (buffer.getInt(SHM_REPLY_STATUS) != 0) {
+            val message = ByteArray(length) { buffer.get(replyOffset + it) }
+            error("tf server error: ${String(message, Charsets.UTF_8)}")
+        }
+        return DoubleArray(length / 8) { buffer.getDouble(replyOffset + it * 8) }
+    }
+
+    /** Predict [data] with the model at [slot] (as returned by [requestLoadModel]). */
+    fun requestPrediction(slot: Int, data: Array<DoubleArray>): Double {
+        shmRequest(BINARY_PREDICT, slot, arrayOf(data))?.let { return it[0] }
+        val result = sendRecv(encodeWindows(BINARY_PREDICT, slot, arrayOf(data)))
+        if (result.startsWith("error:")) {
+            error("tf server error: ${result.split(":", limit = 2)[1]}")
+        }
+        return result.toDouble()
+    }
+
+    /** Predict all the windows in [data] in a single round-trip. Results are in the same order as [data]. */
+    fun requestPredictions(slot: Int, data: Array<Array<DoubleArray>>): DoubleArray {
+        if (data.isEmpty()) return DoubleArray(0)
+        shmRequest(BINARY_PREDICT_BATCH, slot, data)?.let { return it }
+        val result = sendRecv(encodeWindows(BINARY_PREDICT_BATCH, slot, data))
+        if (result.startsWith("error:")) {
+            error("tf server error: ${result.split(":", limit = 2)[1]}")
+        }
+        return result.split(",").map { it.toDouble() }.toDoubleArray()
+    }
+
+    /** Binary frame: header (type, slot, timesteps, features, count) followed by little-endian float32 values. */
+    private fun encodeWindows(type: Int, slot: Int, data: Array<Array<DoubleArray>>): ByteBuffer {
+        val buffer = ByteBuffer.allocate(frameSize(data)).order(ByteOrder.LITTLE_ENDIAN)
+        writeWindows(buffer, type, slot, data)
+        buffer.flip()
+        return buffer
+    }
+
+    private fun frameSize(data: Array<Array<DoubleArray>>): Int {
+        return BINARY_HEADER_SIZE + data.size * data[0].size * data[0][0].size * 4
+    }
+
+    /** Write the frame of [data] at the [buffer] position, which must be little-endian. */
+    private fun writeWindows(buffer: ByteBuffer, type: Int, slot: Int, data: Array<Array<DoubleArray>>) {
+        buffer.put(type.toByte())
+        buffer.putInt(slot)
+        buffer.putShort(data[0].size.toShort())
+        buffer.putShort(data[0][0].size.toShort())
+        buffer.putInt(data.size)
+        for (window in data) {
+            for (row in window) {
+                for (value in row) buffer.putFloat(value.toFloat())
+            }
+        }
+    }
+
+    /** Send [msg] and return the reply, failing if it's an error. */
+    private fun request(msg: String): String {
+        val result = sendRecv(msg)
+        if (result.startsWith("error:")) {
+            error("tf server error: ${result.split(":", limit = 2)[1]}")
+        }
+        return result
+    }
+
+    private fun request(frame: ByteBuffer): String {
+        val result = sendRecv(frame)
+        if (result.startsWith("error:")) {
+            error("tf server error: ${result.split(":", limit = 2)[1]}")
+        }
+        return result
     }
 
+    @Synchronized
     private fun sendRecv(msg: String): String {
         send(msg)
         return resQueue.take()
     }
 
+    @Synchronized
+    private fun sendRecv(frame: ByteBuffer): String {
+        send(frame)
+        return resQueue.take()
+    }
+
     override fun onOpen(handshakedata: ServerHandshake) {
     }
 
     override fun onMessage(message: String) {
-        resQueue.put(message)
+        // job messages are pushed by the server at any time, replies come in the same order as the requests.
+        if (message.startsWith("progress:") || message.startsWith("done:")) {
+            jobEvents(message.split(":", limit = 3)[1]).put(message)
+        } else {
+            resQueue.put(message)
+        }
     }
 
     override fun onClose(code: Int, reason: String, remote: Boolean) {
@@ -80,58 +360,97 @@ class TensorflowClient(serverURI: URI) : WebSocketClient(serverURI) {
 
     companion object {
         private val LOGGER = LoggerFactory.getLogger(TensorflowClient::class.java)
+        private const val BINARY_HEADER_SIZE = 13
+        private const val BINARY_PREDICT = 1
+        private const val BINARY_PREDICT_BATCH = 2
+        private const val BINARY_STREAM_PUSH = 3
+        private const val BINARY_STREAM_SYNC = 4
+        private const val SLOT_BUY = 0
+        private const val SLOT_SELL = 1
+        // shared memory channel layout, see shm.py
+        private const val SHM_REQUEST_SEQ = 0
+        private const val SHM_REQUEST_LENGTH = 8
+        private const val SHM_REPLY_SEQ = 16
+        private const val SHM_REPLY_LENGTH = 24
+        private const val SHM_REPLY_STATUS = 28
+        private const val SHM_DATA_OFFSET = 64
+        private const val SHM_DEFAULT_SIZE = 4 * 1024 * 1024
+        private const val SHM_DEFAULT_SPIN_MS = 10
+        private const val SHM_SPINS = 10_000 // Thread.yield() polls before parking between polls
+        private const val SHM_PARK_NANOS = 50_000L
+        // the seqs are accessed in native order, which must be the little-endian of the layout
+        private val UNSAFE = Unsafe::class.java.getDeclaredField("theUnsafe").let {
+            it.isAccessible = true
+            it.get(null) as Unsafe
+        }
+        private val BUFFER_ADDRESS = UNSAFE.objectFieldOffset(Buffer::class.java.getDeclaredField("address"))
         private var instance: TensorflowClient? = null
         private var serverStarted = false
+        private var serverProcess: Process? = null
+        private const val CONNECT_TIMEOUT_MS = 60_000L
+        private const val CONNECT_RETRY_MS = 50L
+        private const val JOB_POLL_MS = 1000L
         private var outputCallback: (String) -> Unit = { }
 
         fun setServerOutputCallback(callback: (String) -> Unit) {
             outputCallback = callback
         }
 
+        private const val HOST = "localhost"
+        private const val PORT = "8081"
+
         /** Get the client connection or start the server and make a new one. */
         @Synchronized
         fun getOrCreate(): TensorflowClient {
             if (instance == null) {
-                val host = "localhost"
-                val port = "8081"
-
-                // create a thread with the server process attached
-                if (!serverStarted) {
-                    thread {
-                        LOGGER.info("Initialize prediction server process")
-                        val process = ProcessBuilder()
-                            .command("model/venv/bin/python", "model/predictionserver.py", host, port)
-                            .redirectErrorStream(true)
-                            .start()
-
-                        val reader = BufferedReader(InputStreamReader(process.inputStream))
-                        LOGGER.info("Waiting for the first output line...")
-
-                        // wait for the first line so we're sure the process is ready
-                        while (true) {
-                            val line = reader.readLine() ?: break
-                            LOGGER.info("predictionserver.py: $line")
-                            outputCallback(line)
-                            if (!serverStarted) {
-                                serverStarted = true
-                                LOGGER.info("now proceed.")
-                            }
-                        }
-                        LOGGER.info("prediction server exit code: ${process.exitValue()}")
-                        process.destroy()
+                instance = newConnection()
+            }
+            return instance!!
+        }
+
+        /**
+         * Open a new connection to the server, starting it if necessary. The server answers each connection
+         * concurrently, so use one per thread that does a lot of predictions (ie parallel backtests).
+         * With [sharedMemory], predictions go through a shared memory channel (see [requestOpenSharedMemory]).
+         */
+        @Synchronized
+        fun newConnection(sharedMemory: Boolean = false): TensorflowClient {
+            // create a thread with the server process attached, logging its output
+            if (!serverStarted) {
+                serverStarted = true
+                LOGGER.info("Initialize prediction server process")
+                val process = ProcessBuilder()
+                    .command("model/venv/bin/python", "model/predictionserver.py", HOST, PORT,
+                        "--series-store", "data/predictions", "--checkpoint-dir", "data/checkpoints")
+                    .redirectErrorStream(true)
+                    .start()
+                serverProcess = process
+                thread {
+                    val reader = BufferedReader(InputStreamReader(process.inputStream))
+                    while (true) {
+                        val line = reader.readLine() ?: break
+                        LOGGER.info("predictionserver.py: $line")
+                        outputCallback(line)
                     }
+                    LOGGER.info("prediction server exit code: ${process.waitFor()}")
+                    process.destroy()
                 }
+            }
 
-                // Wait til the server process starts
-                while (!serverStarted) Thread.sleep(100)
-
-                // connect
-                LOGGER.info("Connect to $host:$port...")
-                instance = TensorflowClient(URI("ws://$host:$port"))
-                instance!!.connect()
-                LOGGER.info("connected. all ok")
+            // the server binds the socket before importing tensorflow, so just retry until it accepts connections
+            LOGGER.info("Connect to $HOST:$PORT...")
+            val deadline = System.currentTimeMillis() + CONNECT_TIMEOUT_MS
+            while (true) {
+                val client = TensorflowClient(URI("ws://$HOST:$PORT"))
+                if (client.connectBlocking()) {
+                    LOGGER.info("connected, server ready: ${client.requestPing()}")
+                    if (sharedMemory) client.requestOpenSharedMemory()
+                    return client
+                }
+                if (serverProcess?.isAlive == false) error("prediction server exited")
+                if (System.currentTimeMillis() > deadline) error("can't connect to the prediction server at $HOST:$PORT")
+                Thread.sleep(CONNECT_RETRY_MS)
             }
-            return instance!!
         }
 
         // Used to test the throughput
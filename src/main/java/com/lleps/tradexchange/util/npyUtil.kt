@@ -0,0 +1,24 @@
+package com.lleps.tradexchange.util
+
+import java.nio.ByteBuffer
+import java.nio.ByteOrder
+import java.nio.charset.Charset
+import java.nio.file.Files
+import java.nio.file.Paths
+
+/** Load the 1-d float64 .npy array saved by numpy.save at [fileName]. */
+fun loadNpyDoubles(fileName: String): DoubleArray {
+    val buffer = ByteBuffer.wrap(Files.readAllBytes(Paths.get(fileName))).order(ByteOrder.LITTLE_ENDIAN)
+    check(buffer.get().toInt() and 0xFF == 0x93) { "'$fileName' is not a .npy file" }
+    buffer.position(6)
+    val majorVersion = buffer.get().toInt()
+    buffer.get() // minor version
+    val headerLength = if (majorVersion == 1) buffer.short.toInt() and 0xFFFF else buffer.int
+    val header = ByteArray(headerLength)
+    buffer.get(header)
+    val headerString = header.toString(Charset.forName("latin1"))
+    check(headerString.contains("'<f8'")) { "unsupported .npy dtype: $headerString" }
+    val result = DoubleArray(buffer.remaining() / 8)
+    buffer.asDoubleBuffer().get(result)
+    return result
+}